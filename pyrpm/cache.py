@@ -17,8 +17,10 @@
 #
 
 
-import os, os.path, md5, sha, shutil, sys
-from pyrpm.functions import _uriToFilename, updateDigestFromFile
+import os, os.path, md5, sha, shutil, sys, socket, urllib, urlparse, httplib
+import threading, Queue
+from pyrpm.functions import _uriToFilename, updateDigestFromFile, \
+     mkstemp_file, tmpprefix
 
 try:
     from urlgrabber import urlgrab, urlopen
@@ -26,6 +28,29 @@ except ImportError:
     print >> sys.stderr, "Error: Couldn't import urlgrabber python module for NetworkCache."
 
 
+# Seconds until a stalled download is given up
+DOWNLOAD_TIMEOUT = 30.0
+# Number of bytes to read from a connection at once
+DOWNLOAD_CHUNK = 65536
+
+def _newDigest(cstype):
+    """Return a new digest object for checksum type cstype ("sha" or "md5"),
+    None if the type is not supported."""
+
+    if   cstype == "sha":
+        return sha.new()
+    elif cstype == "md5":
+        return md5.new()
+    return None
+
+def closeConnections(conns):
+    """Close all connections in conns, a dictionary of open connections used
+    by NetworkCache.cacheFile()."""
+
+    for conn in conns.itervalues():
+        conn.close()
+    conns.clear()
+
 class NetworkCache:
     """Class to handle caching network files to a local directory"""
 
@@ -41,6 +66,7 @@ class NetworkCache:
         self.pos[name] = 0
         self.is_local[name] = self.__isLocalURI(self.baseurls[name])
         self.headers[name] = [ ]
+        self.__lock = threading.Lock() # for self.pos in download threads
 
     def __isLocalURI(self, uris):
         is_local = True
@@ -259,6 +285,258 @@ class NetworkCache:
             if self.pos[name] == opos:
                 return None
 
+    def prefetch(self, files, jobs=4, name=None):
+        """Cache files, a list of (uri/file, size, (checksum type, checksum)),
+        using up to jobs parallel downloads.  Use size -1 and checksum None
+        if unknown.
+
+        Every download thread keeps its HTTP connections open and reuses them
+        for further files from the same server.  If a baseurl fails, the next
+        one is tried like in cache().  Size and checksum are checked while
+        the data is written.  Return a list of cached filenames, None for
+        failed downloads, in order of files."""
+
+        if name == None:
+            name = self.default_name
+        if self.callbacks.has_key(name):
+            self.callbacks[name]()
+        results = [ None ] * len(files)
+        queue = Queue.Queue()
+        for i in xrange(len(files)):
+            queue.put(i)
+        def worker():
+            conns = { }
+            try:
+                while True:
+                    try:
+                        i = queue.get_nowait()
+                    except Queue.Empty:
+                        break
+                    (uri, size, checksum) = files[i]
+                    results[i] = self.cacheFile(uri, size, checksum, conns,
+                                                name)
+            finally:
+                closeConnections(conns)
+        threads = [ threading.Thread(target=worker)
+                    for _ in xrange(max(min(jobs, len(files)), 1)) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def cacheFile(self, uri, size=-1, checksum=None, conns=None, name=None):
+        """Cache a single uri/file like prefetch() does, checking size and
+        (checksum type, checksum) if known.
+
+        conns is a dictionary of open connections owned by the calling
+        thread, which are reused and updated; close them with
+        closeConnections() when done.  Return the cached filename, or None
+        on error."""
+
+        if name == None:
+            name = self.default_name
+        if conns is None:
+            conns = { }
+            try:
+                return self.cacheFile(uri, size, checksum, conns, name)
+            finally:
+                closeConnections(conns)
+        try:
+            return self.__cacheFile(uri, size, checksum, conns, name)
+        except (IOError, OSError, socket.error, httplib.HTTPException):
+            return None
+
+    def __cacheFile(self, uri, size, checksum, conns, name):
+        """Cache a single uri/file for cacheFile(), trying all baseurls.
+
+        Return the cached filename, or None on error.  Raise IOError,
+        OSError, socket.error, httplib.HTTPException."""
+
+        if not self.__isURI(uri) and self.is_local[name]:
+            return self.cache(uri, name=name)
+        for baseurl in self.baseurls.get(name, []):
+            if uri.startswith(baseurl):
+                uri = uri[len(baseurl):]
+                break
+        if self.__isLocalURI([uri,]):
+            return self.cache(uri, name=name)
+        destfile = self.getCachedFilename(uri, name)
+        if self.__verifyFile(destfile, size, checksum):
+            return destfile
+        if not os.path.isdir(os.path.dirname(destfile)):
+            try:
+                os.makedirs(os.path.dirname(destfile))
+            except OSError:
+                pass
+        if self.__isURI(uri):
+            if self.__download(uri, destfile, size, checksum, conns, name):
+                return destfile
+            return None
+        self.__lock.acquire()
+        opos = pos = self.pos[name]
+        self.__lock.release()
+        while True:
+            sourceurl = os.path.join(self.baseurls[name][pos],
+                                     self.__makeRel(uri))
+            if self.__download(sourceurl, destfile, size, checksum, conns,
+                               name):
+                # Stay with the working baseurl for further files
+                self.__lock.acquire()
+                self.pos[name] = pos
+                self.__lock.release()
+                return destfile
+            pos = (pos + 1) % len(self.baseurls[name])
+            if pos == opos:
+                return None
+
+    def __verifyFile(self, filename, size, checksum):
+        """Return True if filename exists and matches size and (checksum
+        type, checksum), at least one of them has to be known."""
+
+        if size < 0 and checksum is None:
+            return False
+        try:
+            if size >= 0 and os.stat(filename).st_size != size:
+                return False
+            if checksum is not None:
+                digest = _newDigest(checksum[0])
+                if digest is None:
+                    return False
+                fd = open(filename)
+                try:
+                    updateDigestFromFile(digest, fd)
+                finally:
+                    fd.close()
+                return digest.hexdigest() == checksum[1]
+        except (IOError, OSError):
+            return False
+        return True
+
+    def __download(self, sourceurl, destfile, size, checksum, conns, name):
+        """Download sourceurl to destfile, checking size and (checksum type,
+        checksum) if known.  Reuse and update the open connections in
+        conns.
+
+        Return 1 on success, 0 on error."""
+
+        (scheme, netloc, path, query, fragment) = urlparse.urlsplit(sourceurl)
+        if scheme not in ("http", "https") or \
+               urllib.getproxies().has_key(scheme):
+            # Use urlgrabber for everything httplib can't handle
+            try:
+                urlgrab(sourceurl, destfile, timeout=DOWNLOAD_TIMEOUT,
+                        http_headers=self.headers[name],
+                        ssl_ca_cert='/usr/share/rhn/RHNS-CA-CERT')
+            except Exception:
+                return 0
+            if (size >= 0 or checksum is not None) and \
+                   not self.__verifyFile(destfile, size, checksum):
+                os.unlink(destfile)
+                return 0
+            return 1
+        headers = dict(self.headers[name])
+        for _ in xrange(5): # Maximum number of redirects
+            if query:
+                path += "?" + query
+            response = self.__request(conns, scheme, netloc, path or "/",
+                                      headers)
+            if response is None:
+                return 0
+            if response.status in (301, 302, 303, 307):
+                location = response.getheader("location")
+                response.read()
+                if not location:
+                    return 0
+                (scheme, netloc, path, query, fragment) = \
+                         urlparse.urlsplit(urlparse.urljoin(sourceurl,
+                                                            location))
+                if scheme not in ("http", "https"):
+                    return 0
+                continue
+            if response.status != 200:
+                response.read()
+                return 0
+            return self.__receive(response, destfile, size, checksum, conns,
+                                  (scheme, netloc))
+        return 0
+
+    def __request(self, conns, scheme, netloc, path, headers):
+        """Send a GET request for path to netloc, using an open connection
+        from conns if available.
+
+        Return the httplib.HTTPResponse, or None on error."""
+
+        key = (scheme, netloc)
+        # An open connection may have been closed by the server meanwhile,
+        # try once more with a new one in this case.
+        for _ in xrange(2):
+            conn = conns.get(key)
+            reused = conn is not None
+            if conn is None:
+                if scheme == "https":
+                    conn = httplib.HTTPSConnection(netloc)
+                else:
+                    conn = httplib.HTTPConnection(netloc)
+                conns[key] = conn
+            try:
+                if conn.sock is None:
+                    conn.connect()
+                    conn.sock.settimeout(DOWNLOAD_TIMEOUT)
+                conn.request("GET", path, headers=headers)
+                return conn.getresponse()
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                del conns[key]
+                if not reused:
+                    return None
+        return None
+
+    def __receive(self, response, destfile, size, checksum, conns, key):
+        """Write the body of response to destfile, checking size and
+        (checksum type, checksum) if known.
+
+        Return 1 on success, 0 on error."""
+
+        if size >= 0:
+            length = response.getheader("content-length")
+            if length is not None and length.isdigit() and \
+                   int(length) != size:
+                conns.pop(key).close()
+                return 0
+        digest = None
+        if checksum is not None:
+            digest = _newDigest(checksum[0])
+        (fd, tmpfilename) = mkstemp_file(os.path.dirname(destfile), tmpprefix)
+        ok = 0
+        try:
+            try:
+                received = 0
+                while True:
+                    data = response.read(DOWNLOAD_CHUNK)
+                    if not data:
+                        break
+                    received += len(data)
+                    if size >= 0 and received > size:
+                        break
+                    if digest is not None:
+                        digest.update(data)
+                    os.write(fd, data)
+                ok = (size < 0 or received == size) and \
+                     (digest is None or digest.hexdigest() == checksum[1])
+            finally:
+                os.close(fd)
+                if not ok:
+                    # The connection is in an undefined state
+                    conns.pop(key).close()
+                    os.unlink(tmpfilename)
+        except (IOError, OSError, socket.error, httplib.HTTPException):
+            return 0
+        if not ok:
+            return 0
+        os.rename(tmpfilename, destfile)
+        return 1
+
     def clear(self, uri=None, name=None):
         """Clears either the single given uri/file or the whole cache"""
 
@@ -338,6 +616,15 @@ class SubNetworkCache:
     def cache(self, uri, force=False, copy_local=False, size=-1, md5=0, async=False, name=None):
         return self.nc.cache(self.prefix + "/" + uri, force, copy_local, size, md5, async, name)
 
+    def cacheFile(self, uri, size=-1, checksum=None, conns=None, name=None):
+        return self.nc.cacheFile(self.prefix + "/" + uri, size, checksum,
+                                 conns, name)
+
+    def prefetch(self, files, jobs=4, name=None):
+        return self.nc.prefetch([(self.prefix + "/" + uri, size, checksum)
+                                 for (uri, size, checksum) in files],
+                                jobs, name)
+
     def clear(self, uri=None, name=None):
         if uri == None:
             uri = ''
@@ -36,6 +36,10 @@ class RpmConfig:
         self.ignorearch = 0
         self.nodeps = 0
         self.nosignature = 1        # Default: No signature/gpg checks
+        self.verifyjobs = 0         # Processes for signature checks, 0: CPUs
+        self.fileconflictjobs = 1   # Processes for file conflict checks, 0: CPUs
+        self.extractjobs = 0        # Threads writing files, 0: none
+        self.scriptshell = 0        # Run /bin/sh scriptlets in one shell
         self.noorder = 0
         self.noscripts = 0
         self.notriggers = 0
@@ -63,8 +67,22 @@ class RpmConfig:
                              ("filesizes", "dirindexes", "basenames",
                               "dirnames", "oldfilenames", "filemodes")
         self.timer = 0                   # Output timing information
-        self.ldconfig = 0             # Number of ldconfig calls optimized away
-        self.delayldconfig = 0           # A delayed ldconfig call is pending
+        # %post, %postun and %posttrans scriptlets consisting only of these
+        # commands are delayed until the next other scriptlet or the end of
+        # the transaction and each command is run once.  fnmatch patterns for
+        # a command line without "|| :" and redirections to /dev/null, the
+        # commands have to be idempotent and must not depend on the order
+        # they are run in (not e.g. install-info and install-info --delete).
+        self.coalescescripts = [ "/sbin/ldconfig",
+                                 "/usr/bin/gtk-update-icon-cache *",
+                                 "gtk-update-icon-cache *",
+                                 "/usr/bin/update-desktop-database*",
+                                 "update-desktop-database*",
+                                 "/usr/bin/update-mime-database *",
+                                 "update-mime-database *",
+                                 "/usr/bin/fc-cache*", "fc-cache*" ]
+        self.delayedscripts = [ ]       # Delayed scriptlet commands
+        self.coalesced = 0              # Number of scriptlet runs saved
         self.service = 0                 # Install /sbin/service with "exit 0"
         self.yumconf = ['/etc/yum.conf'] # Yum config files
         self.relver  = None              # Release version, needed by YumConfig
@@ -79,6 +97,14 @@ class RpmConfig:
         self.disablerepo  = [ ]         # Manually disabled repos
         self.cachedir = "/var/cache/pyrpm"      # Directory for cached files
         self.nocache = 0                # Disable caching for packages
+        self.rpmdbcache = 0             # Cache installed packages for yum
+        # Packages installed or erased between rpmdb syncs, with a journal
+        # for crash recovery, 0: sync after every package
+        self.rpmdbbatch = 0
+        self.downloadjobs = 4           # Parallel package downloads
+        # Number of packages downloaded and verified ahead of the
+        # installation, 0: download and verify all packages first
+        self.pipelinewindow = 0
         self.excludes = [ ]
         # The first element should be a full path, interpreted outside
         # self.buildroot
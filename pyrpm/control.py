@@ -19,15 +19,185 @@
 
 import os
 import traceback
+import threading
 from time import clock
 import package
 from resolver import *
 from orderer import *
 from logger import log
-from pyrpm.cache import NetworkCache
+from hashlist import HashList
+from pyrpm.cache import NetworkCache, closeConnections
 from pyrpm import functions
 import se_linux
 
+def _getRepoFileInfo(pkg):
+    """Return (file size or -1, (checksum type, checksum) or None) of the
+    package file of repository RpmPackage pkg, as far as known."""
+
+    size = -1
+    checksum = None
+    if pkg.yumrepo is None:
+        return (size, checksum)
+    sizes = getattr(pkg, "sizes", None)
+    if sizes and sizes.get("package", "").isdigit():
+        size = int(sizes["package"])
+    signature = dict.get(pkg, "signature")
+    if signature:
+        # Repository checksums of the package files are stored as
+        # sha1header or md5 signature tags
+        if signature.has_key("sha1header"):
+            checksum = ("sha", signature["sha1header"])
+        elif signature.has_key("md5"):
+            checksum = ("md5", signature["md5"])
+    return (size, checksum)
+
+def _isNetworkPackage(pkg):
+    """Return True if RpmPackage pkg has to be cached before installing."""
+
+    return pkg.nc is not None and \
+           (pkg.source.startswith("http://") or \
+            pkg.source.startswith("https://") or \
+            pkg.yumrepo != None)
+
+def _verifyPackage(pkg):
+    """Reread RpmPackage pkg and verify its "best" digest or signature.
+
+    Return (1 if verified, -1 if failed, 0 if unknown, None) or (None, error
+    message) if the package could not be read."""
+
+    try:
+        pkg.reread()
+    except Exception, e:
+        return (None, str(e))
+    try:
+        return (pkg.verifyOneSignature(), None)
+    finally:
+        pkg.close()
+        pkg.clear(ntags=pkg.config.nevratags)
+
+class PackagePipeline:
+    """Download and verify the packages of a transaction in background
+    threads, at most config.pipelinewindow packages ahead of the
+    installation."""
+
+    def __init__(self, config, pkgs):
+        """Prepare downloading and verifying RpmPackage list pkgs, in this
+        order, using config.downloadjobs threads."""
+
+        self.config = config
+        self.pkgs = pkgs
+        self.status = { }   # index in self.pkgs => error message or None
+        self.next = 0       # index of the next package to process
+        self.current = 0    # index of the package returned by wait() next
+        self.stopped = False
+        self.cond = threading.Condition()
+        # Free download slots in the look-ahead window
+        self.slots = threading.Semaphore(max(config.pipelinewindow, 1))
+        self.threads = [ threading.Thread(target=self.__worker)
+                         for _ in xrange(max(min(config.downloadjobs,
+                                                 config.pipelinewindow), 1)) ]
+        for thread in self.threads:
+            # Don't keep the interpreter alive if stop() is never called
+            thread.setDaemon(True)
+
+    def start(self):
+        """Start the background threads."""
+
+        for thread in self.threads:
+            thread.start()
+
+    def wait(self):
+        """Wait until the next package has been downloaded and verified.
+
+        Return None on success, an error message otherwise.  Raise ValueError
+        if the signature of the package is wrong."""
+
+        self.cond.acquire()
+        try:
+            while not self.status.has_key(self.current):
+                self.cond.wait()
+            self.current += 1
+            error = self.status.pop(self.current - 1)
+        finally:
+            self.cond.release()
+        if isinstance(error, ValueError):
+            raise error
+        return error
+
+    def done(self):
+        """Mark the package returned by wait() as installed, freeing its slot
+        in the look-ahead window."""
+
+        self.slots.release()
+
+    def stop(self):
+        """Stop the background threads and wait for them."""
+
+        self.cond.acquire()
+        self.stopped = True
+        self.cond.release()
+        for thread in self.threads:
+            self.slots.release()
+        for thread in self.threads:
+            thread.join()
+
+    def __worker(self):
+        """Process packages in order until all are done or stop() is
+        called."""
+
+        conns = { }
+        try:
+            while True:
+                self.slots.acquire()
+                self.cond.acquire()
+                try:
+                    if self.stopped or self.next >= len(self.pkgs):
+                        # Let the other threads notice it, too
+                        self.slots.release()
+                        return
+                    i = self.next
+                    self.next += 1
+                finally:
+                    self.cond.release()
+                try:
+                    error = self.__process(self.pkgs[i], conns)
+                except ValueError, e:
+                    # Wrong signature, raised by wait()
+                    error = e
+                except Exception, e:
+                    error = "Error processing %s: %s" % (self.pkgs[i].source,
+                                                         e)
+                self.cond.acquire()
+                self.status[i] = error
+                if error is not None:
+                    # The installation stops at this package
+                    self.stopped = True
+                self.cond.notifyAll()
+                self.cond.release()
+        finally:
+            closeConnections(conns)
+
+    def __process(self, pkg, conns):
+        """Download and verify RpmPackage pkg, reusing connections in conns.
+
+        Return None on success, an error message otherwise.  Raise ValueError
+        if the signature is wrong."""
+
+        if not self.config.nocache and _isNetworkPackage(pkg):
+            source = pkg.nc.cacheFile(pkg.source, pkg.yumsize,
+                                      pkg.yumchecksum, conns)
+            if source is None:
+                return "Error downloading %s" % pkg.source
+            pkg.source = source
+        if not self.config.nosignature:
+            (status, error) = _verifyPackage(pkg)
+            if error is not None:
+                return "Error rereading package: %s" % error
+            if status == -1:
+                raise ValueError, "Signature verification failed for " \
+                      "package %s" % pkg.getNEVRA()
+        return None
+
 class RpmController:
     """RPM state manager, handling package installation and deinstallation."""
 
@@ -116,7 +286,8 @@ class RpmController:
         log.info2("Ordering transaction...")
         orderer = RpmOrderer(self.config, resolver.installs, resolver.updates,
                              resolver.obsoletes, resolver.erases,
-                             installdb=installdb, erasedb=erasedb)
+                             installdb=installdb, erasedb=erasedb,
+                             resolver=resolver)
         del resolver
         operations = orderer.order()
         if operations is None: # Currently can't happen
@@ -143,6 +314,7 @@ class RpmController:
                 p.nc = nc
                 p.yumhref = pkg.yumhref
                 p.issrc = pkg.issrc
+                (p.yumsize, p.yumchecksum) = _getRepoFileInfo(pkg)
                 # copy NEVRA
                 for tag in self.config.nevratags:
                     p[tag] = pkg[tag]
@@ -185,42 +357,24 @@ class RpmController:
         if operations == []:
             log.error("No updates are necessary.")
             return 1
-        # Cache the packages
-        if not self.config.nocache:
-            log.info2("Caching network packages")
+        pipeline = None
+        if self.config.pipelinewindow > 0:
+            # Packages are downloaded and verified during the installation
+            pipeline = PackagePipeline(self.config,
+                [ pkg for (op, pkg) in operations
+                  if op in (OP_UPDATE, OP_INSTALL, OP_FRESHEN) ])
+        else:
+            # Cache the packages
+            if not self.config.nocache:
+                log.info2("Caching network packages")
+                if self.__cachePackages(operations) == 0:
+                    return 0
+            # check signatures
+            if not self.config.nosignature and \
+                   self.__verifySignatures(operations) == 0:
+                return 0
         new_operations = []
         for (op, pkg) in operations:
-            if op in (OP_UPDATE, OP_INSTALL, OP_FRESHEN):
-                source = pkg.source
-                # cache remote pkgs to disk
-                if not self.config.nocache and \
-                   (pkg.source.startswith("http://") or \
-                    pkg.source.startswith("https://") or \
-                    pkg.yumrepo != None):
-                    log.info3("Caching network package %s", pkg.getNEVRA())
-                    source = pkg.nc.cache(pkg.source)
-                    if source is None:
-                        log.error("Error downloading %s", pkg.source)
-                        return 0
-                pkg.source = source
-
-                # check signature
-                if not self.config.nosignature:
-                    try:
-                        pkg.reread()
-                    except Exception, e:
-                        log.error("Error rereading package: %s", e)
-                        return 0
-                    # Check packages if we have turned on signature checking
-                    if pkg.verifyOneSignature() == -1:
-                        log.error("Signature verification failed for "
-                                  "package %s", pkg.getNEVRA())
-                        raise ValueError
-                    else:
-                        log.info3("Signature of package %s correct",
-                                  pkg.getNEVRA())
-                    pkg.close()
-                    pkg.clear(ntags=self.config.nevratags)
             new_operations.append((op, pkg))
             if pkg["pretransprog"] != None and not self.config.noscripts:
                 try:
@@ -249,89 +403,120 @@ class RpmController:
         # now for RpmDB due to obsoletes caching.
         self.db.obsoletes_list = None
         posttrans = []
-        for (op, pkg) in operations:
-            # Progress
-            opstring = self.opstrings.get(op, "Cleanup: ")
-            i += 1
-            progress = "[%*d/%d] %s%s"
-            log.info2(progress, numops_chars, i, numops,
-                      opstring, pkg.getNEVRA(), nl=0)
-
-            # Save posttrans for later processing (pkg is removed from rpmdb on erase).
-            if pkg["posttransprog"] != None and not self.config.noscripts:
-                posttrans.append((pkg["posttransprog"], pkg["posttrans"],
-                    pkg.getNEVRA(), pkg["prefixes"]))
-
-            # install
-            if op in (OP_INSTALL, OP_UPDATE, OP_FRESHEN):
-                # reread pkg
-                try:
-                    pkg.close()
-                    pkg.open()
-                except IOError, e:
-                    log.error("Error reopening %s: %s", pkg.getNEVRA(), e)
-                    result = 0
-                    break
-                nevra = pkg.getNEVRA()
-                pkg.clear()
-                # Disable verify, already done
-                pkg.verifySignature = None
-                try:
-                    pkg.read()
-                except (IOError, ValueError), e:
-                    log.error("Error rereading %s: %s", nevra, e)
-                    result = 0
-                    break
-                # install on disk
-                try:
-                    if not self.config.justdb:
-                        pkg.install(self.db, buildroot=self.config.buildroot)
-                        self.__runTriggerIn(pkg, self.config.buildroot)
-                        # Ignore errors
-                    else:
-                        log.info2("", nofmt=1) # newline may be after hashes
-                except (IOError, OSError, ValueError), e:
-                    traceback.print_exc()
-                    log.error("Error installing %s: %s", pkg.getNEVRA(), e)
-                    result = 0
-                    break
-                # update DB
-                if self.__addPkgToDB(pkg) == 0:
-                    log.error("Couldn't add package %s to database.",
-                              pkg.getNEVRA())
-                    result = 0
-                    break
-                pkg.clear()
-                try:
-                    pkg.close()
-                except IOError:
-                    # Shouldn't really happen when pkg is open for reading,
-                    # anyway.
-                    pass
-                if not self.config.keepcache and \
-                       pkg.nc != None and pkg.yumhref != None:
-                    pkg.nc.clear(pkg.yumhref)
-            # erase
-            elif op == OP_ERASE:
-                try:
-                    if not self.config.justdb:
-                        self.__runTriggerUn(pkg, self.config.buildroot)
-                        # Ignore errors
-                        pkg.erase(self.db, buildroot=self.config.buildroot)
-                        self.__runTriggerPostUn(pkg, self.config.buildroot)
-                        # Ignore errors
-                    else:
-                        log.info2("", nofmt=1) # newline may be after hashes
-                except (IOError, ValueError), e:
-                    log.error("Error erasing %s: %s", pkg.getNEVRA(), e)
-                    result = 0
-                    break
-                # update DB
-                if self.__erasePkgFromDB(pkg) == 0:
-                    log.error("Couldn't erase package %s from database.",
-                              pkg.getNEVRA())
-                    result = 0
-                    break
+        if pipeline is not None:
+            pipeline.start()
+        if self.config.rpmdbbatch > 0 and \
+               not self.db.beginWrite(self.config.rpmdbbatch):
+            log.warning("Syncing the database after every package")
+        try:
+            for (op, pkg) in operations:
+                if pipeline is not None and \
+                       op in (OP_INSTALL, OP_UPDATE, OP_FRESHEN):
+                    try:
+                        error = pipeline.wait()
+                    except ValueError, e:
+                        # Like __verifySignatures(), but the packages before
+                        # this one are already installed
+                        log.error("%s", e)
+                        raise
+                    if error is not None:
+                        log.error(error)
+                        result = 0
+                        break
+                # Progress
+                opstring = self.opstrings.get(op, "Cleanup: ")
+                i += 1
+                progress = "[%*d/%d] %s%s"
+                log.info2(progress, numops_chars, i, numops,
+                          opstring, pkg.getNEVRA(), nl=0)
+
+                # Save posttrans for later processing (pkg is removed from
+                # rpmdb on erase).
+                if pkg["posttransprog"] != None and not self.config.noscripts:
+                    posttrans.append((pkg["posttransprog"], pkg["posttrans"],
+                        pkg.getNEVRA(), pkg["prefixes"]))
+
+                # install
+                if op in (OP_INSTALL, OP_UPDATE, OP_FRESHEN):
+                    # reread pkg
+                    try:
+                        pkg.close()
+                        pkg.open()
+                    except IOError, e:
+                        log.error("Error reopening %s: %s", pkg.getNEVRA(), e)
+                        result = 0
+                        break
+                    nevra = pkg.getNEVRA()
+                    pkg.clear()
+                    # Disable verify, already done
+                    pkg.verifySignature = None
+                    try:
+                        pkg.read()
+                    except (IOError, ValueError), e:
+                        log.error("Error rereading %s: %s", nevra, e)
+                        result = 0
+                        break
+                    # install on disk
+                    try:
+                        if not self.config.justdb:
+                            pkg.install(self.db,
+                                        buildroot=self.config.buildroot)
+                            self.__runTriggerIn(pkg, self.config.buildroot)
+                            # Ignore errors
+                        else:
+                            # newline may be after hashes
+                            log.info2("", nofmt=1)
+                    except (IOError, OSError, ValueError), e:
+                        traceback.print_exc()
+                        log.error("Error installing %s: %s", pkg.getNEVRA(), e)
+                        result = 0
+                        break
+                    # update DB
+                    if self.__addPkgToDB(pkg) == 0:
+                        log.error("Couldn't add package %s to database.",
+                                  pkg.getNEVRA())
+                        result = 0
+                        break
+                    pkg.clear()
+                    try:
+                        pkg.close()
+                    except IOError:
+                        # Shouldn't really happen when pkg is open for reading,
+                        # anyway.
+                        pass
+                    if not self.config.keepcache and \
+                           pkg.nc != None and pkg.yumhref != None:
+                        pkg.nc.clear(pkg.yumhref)
+                    if pipeline is not None:
+                        pipeline.done()
+                # erase
+                elif op == OP_ERASE:
+                    try:
+                        if not self.config.justdb:
+                            self.__runTriggerUn(pkg, self.config.buildroot)
+                            # Ignore errors
+                            pkg.erase(self.db, buildroot=self.config.buildroot)
+                            self.__runTriggerPostUn(pkg, self.config.buildroot)
+                            # Ignore errors
+                        else:
+                            # newline may be after hashes
+                            log.info2("", nofmt=1)
+                    except (IOError, ValueError), e:
+                        log.error("Error erasing %s: %s", pkg.getNEVRA(), e)
+                        result = 0
+                        break
+                    # update DB
+                    if self.__erasePkgFromDB(pkg) == 0:
+                        log.error("Couldn't erase package %s from database.",
+                                  pkg.getNEVRA())
+                        result = 0
+                        break
+
+        finally:
+            if pipeline is not None:
+                pipeline.stop()
+            if not self.db.endWrite():
+                result = 0
 
         # Start all posttrans scripts:
         for (posttransprog, posttransscript, nevra, prefixes) in posttrans:
@@ -339,7 +524,7 @@ class RpmController:
                 (status, rusage, output) = functions.runScript(
                     posttransprog, posttransscript, [0],
                     rusage=self.config.rusage, prefixes=prefixes,
-                    chroot=self.config.buildroot)
+                    chroot=self.config.buildroot, delay=True)
             except (IOError, OSError), e:
                 log.error("\n%s: Error running post transaction script: %s",
                           nevra, e)
@@ -352,18 +537,74 @@ class RpmController:
                               "package %s", nevra)
                     log.error(output, nofmt=1)
 
-        if self.config.delayldconfig:
-            self.config.delayldconfig = 0
+        # runScript() uses the global rpmconfig
+        if functions.rpmconfig.delayedscripts:
             try:
-                runScript("/sbin/ldconfig", force=1,
-                          chroot=self.config.buildroot)
+                (status, rusage, output) = functions.runDelayedScripts(
+                    self.config.buildroot)
             except (IOError, OSError), e:
-                log.warning("Error running /sbin/ldconfig: %s", e)
-            log.info2("number of /sbin/ldconfig calls optimized away: %d",
-                      self.config.ldconfig)
+                log.warning("Error running delayed scriptlets: %s", e)
+            else:
+                if status != 0:
+                    log.warning("Error running delayed scriptlets:")
+                    log.warning(output, nofmt=1)
+            log.info2("number of scriptlet runs optimized away: %d",
+                      functions.rpmconfig.coalesced)
+        functions.closeScriptShells()
         self.db.close()
         return result
 
+    def __cachePackages(self, operations):
+        """Download the network packages to be installed from (operation,
+        RpmPackage) list operations and set their source to the cached file,
+        using config.downloadjobs parallel downloads per repository.
+
+        Return 1 on success, 0 on error (after warning the user)."""
+
+        caches = HashList() # NetworkCache => [RpmPackage]
+        for (op, pkg) in operations:
+            if op in (OP_UPDATE, OP_INSTALL, OP_FRESHEN) and \
+                   _isNetworkPackage(pkg):
+                caches.setdefault(pkg.nc, [ ]).append(pkg)
+        for nc in caches:
+            pkgs = caches[nc]
+            for pkg in pkgs:
+                log.info3("Caching network package %s", pkg.getNEVRA())
+            sources = nc.prefetch([ (pkg.source, pkg.yumsize, pkg.yumchecksum)
+                                    for pkg in pkgs ],
+                                  self.config.downloadjobs)
+            for (pkg, source) in zip(pkgs, sources):
+                if source is None:
+                    log.error("Error downloading %s", pkg.source)
+                    return 0
+                pkg.source = source
+        return 1
+
+    def __verifySignatures(self, operations):
+        """Verify the signatures of the packages to be installed from
+        (operation, RpmPackage) list operations, using config.verifyjobs
+        processes.
+
+        Return 1 on success, 0 if a package could not be read (after warning
+        the user).  Raise ValueError if a signature is wrong."""
+
+        pkgs = [ pkg for (op, pkg) in operations
+                 if op in (OP_UPDATE, OP_INSTALL, OP_FRESHEN) ]
+        jobs = self.config.verifyjobs or functions.numCPUs()
+        results = functions.parallelMap(_verifyPackage, pkgs, jobs,
+            lambda (status, error): error is None and status != -1)
+        for (pkg, (status, error)) in zip(pkgs, results):
+            if error is not None:
+                log.error("Error rereading package: %s", error)
+                return 0
+            # Check packages if we have turned on signature checking
+            if status == -1:
+                log.error("Signature verification failed for "
+                          "package %s", pkg.getNEVRA())
+                raise ValueError
+            log.info3("Signature of package %s correct", pkg.getNEVRA())
+        return 1
+
     def appendUri(self, uri):
         """Append package from "URI" uri to self.rpms.
 
@@ -66,6 +66,19 @@ class RpmDatabase:
     def isFilelistImported(self):
         return 1
 
+    def beginWrite(self, interval):
+        """Start a write session, the database may delay writing changes to
+        disk for up to interval added or removed packages until endWrite().
+
+        Return 1 on success, 0 on error."""
+        return 1
+
+    def endWrite(self):
+        """End a write session, writing all changes to disk.
+
+        Return 1 on success, 0 on error."""
+        return 1
+
     ### not implemented functions ###
 
     def open(self):
@@ -16,9 +16,10 @@
 # Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
 #
 
-import re, fnmatch
+import re, fnmatch, bisect
+from types import TupleType
 import pyrpm.functions as functions
-from pyrpm.base import RPMSENSE_EQUAL
+from pyrpm.base import RPMSENSE_EQUAL, RPMSENSE_LESS, RPMSENSE_GREATER
 
 def genBasenames2(oldfilenames):
     (basenames, dirnames) = ([], [])
@@ -29,67 +30,214 @@ def genBasenames2(oldfilenames):
     return (basenames, dirnames)
 
 class FilenamesList:
-    """A mapping from filenames to RpmPackages."""
+    """A mapping from filenames to RpmPackages.
+
+    Packages are referenced by small integer ids: a file maps to the id of
+    its package, or to a tuple of ids if several packages contain it.  The
+    directory and file names of added packages are replaced by interned
+    copies, so each name is stored only once for all packages."""
 
     def __init__(self):
         self.clear()
 
     def clear(self):
         """Clear the mapping."""
-        self.path = { } # dirname => { basename => RpmPackage }
+        self.path = { }   # dirname => { basename => package id or (ids) }
+        self.pkgs = [ ]   # package id => RpmPackage, None if removed
+        self.pkgids = { } # RpmPackage => package id
+        self.refs = [ ]   # package id => number of addPkg() calls
 
-    def addPkg(self, pkg):
-        """Add all files from RpmPackage pkg to self."""
+    def _getFiles(self, pkg):
+        """Return ([basename], [files dict of the dirname of each basename])
+        for RpmPackage pkg, or (None, None) if pkg has no file list.
+
+        Create the files dicts if necessary and intern the names in the file
+        list of pkg."""
         path = self.path
         basenames = pkg["basenames"]
         if basenames != None:
-            dirindexes = pkg["dirindexes"]
             dirnames = pkg["dirnames"]
-            for dirname in dirnames:
-                path.setdefault(dirname, {})
-            dirnames = [ dirnames[di] for di in dirindexes ]
+            dirfiles = [ ]
+            for i in xrange(len(dirnames)):
+                dirnames[i] = functions.internName(dirnames[i])
+                dirfiles.append(path.setdefault(dirnames[i], { }))
+            for i in xrange(len(basenames)):
+                basenames[i] = functions.internName(basenames[i])
+            dirfiles = [ dirfiles[di] for di in pkg["dirindexes"] ]
         else:
             if pkg["oldfilenames"] == None:
-                return
+                return (None, None)
             (basenames, dirnames) = genBasenames2(pkg["oldfilenames"])
-            for dirname in dirnames:
-                path.setdefault(dirname, {})
+            basenames = [ functions.internName(basename) for basename in basenames ]
+            dirfiles = [ path.setdefault(functions.internName(dirname), { })
+                         for dirname in dirnames ]
+        return (basenames, dirfiles)
+
+    def addPkg(self, pkg):
+        """Add all files from RpmPackage pkg to self."""
+        (basenames, dirfiles) = self._getFiles(pkg)
+        if basenames == None:
+            return
+        pkgid = self.pkgids.get(pkg)
+        if pkgid == None:
+            pkgid = self.pkgids[pkg] = len(self.pkgs)
+            self.pkgs.append(pkg)
+            self.refs.append(0)
+        self.refs[pkgid] += 1
         for i in xrange(len(basenames)):
-            path[dirnames[i]].setdefault(basenames[i], []).append(pkg)
+            files = dirfiles[i]
+            ids = files.get(basenames[i])
+            if ids == None:
+                files[basenames[i]] = pkgid
+            elif isinstance(ids, TupleType):
+                files[basenames[i]] = ids + (pkgid,)
+            else:
+                files[basenames[i]] = (ids, pkgid)
 
     def removePkg(self, pkg):
         """Remove all files from RpmPackage pkg from self."""
-        basenames = pkg["basenames"]
-        if basenames != None:
-            dirindexes = pkg["dirindexes"]
-            dirnames = pkg["dirnames"]
-            dirnames = [ dirnames[di] for di in dirindexes ]
-        else:
-            if pkg["oldfilenames"] == None:
-                return
-            (basenames, dirnames) = genBasenames2(pkg["oldfilenames"])
+        (basenames, dirfiles) = self._getFiles(pkg)
+        if basenames == None:
+            return
+        pkgid = self.pkgids[pkg]
         for i in xrange(len(basenames)):
-            self.path[dirnames[i]][basenames[i]].remove(pkg)
+            files = dirfiles[i]
+            ids = files[basenames[i]]
+            if not isinstance(ids, TupleType):
+                del files[basenames[i]]
+                continue
+            ids = list(ids)
+            ids.remove(pkgid)
+            if len(ids) == 1:
+                files[basenames[i]] = ids[0]
+            else:
+                files[basenames[i]] = tuple(ids)
+        self.refs[pkgid] -= 1
+        if self.refs[pkgid] == 0:
+            del self.pkgids[pkg]
+            self.pkgs[pkgid] = None
+
+    def _getPkgs(self, ids):
+        """Return a list of the RpmPackages with package id or tuple of ids
+        ids."""
+        if isinstance(ids, TupleType):
+            return [ self.pkgs[pkgid] for pkgid in ids ]
+        return [ self.pkgs[ids] ]
 
     def numDuplicates(self, filename):
         (dirname, basename) = functions.pathsplit2(filename)
-        return len(self.path.get(dirname, {}).get(basename, {}))
+        ids = self.path.get(dirname, {}).get(basename)
+        if ids == None:
+            return 0
+        if isinstance(ids, TupleType):
+            return len(ids)
+        return 1
 
     def duplicates(self):
         dups = { }
         for dirname in self.path.keys():
-            for filename in self.path[dirname].keys():
-                if len(self.path[dirname][filename]) > 1:
-                    dups[dirname + filename] = self.path[dirname][filename]
+            files = self.path[dirname]
+            for filename in files.keys():
+                if isinstance(files[filename], TupleType):
+                    dups[dirname + filename] = self._getPkgs(files[filename])
         return dups
 
     def search(self, name):
-        """Return list of packages providing file with name.
-
-        The list may point to internal structures of FilenamesList and may be
-        changed by calls to addPkg() and removePkg()."""
+        """Return list of packages providing file with name."""
         (dirname, basename) = functions.pathsplit2(name)
-        return self.path.get(dirname, {}).get(basename, [])
+        ids = self.path.get(dirname, {}).get(basename)
+        if ids == None:
+            return [ ]
+        return self._getPkgs(ids)
+
+
+class EVRIndex:
+    """Dependency entries (flag, EVR string, ..., RpmPackage) of one name,
+    sorted by (epoch, version) for bisecting.
+
+    Entries with RPMSENSE_LESS or RPMSENSE_GREATER in their flag or without
+    a version can not be located by bisecting, they are kept in a plain
+    list."""
+
+    def __init__(self, entries=()):
+        """Initialize with a list of (sequence number, entry)."""
+
+        self.other = [ ]   # [(sequence number, (E, V, R), entry)]
+        pure = [ ]
+        for (seq, entry) in entries:
+            (key, evr) = self._split(entry)
+            if key is None:
+                self.other.append((seq, evr, entry))
+            else:
+                pure.append((key, seq, evr, entry))
+        pure.sort()
+        self.keys = [ s[0] for s in pure ] # [(epoch key, version key)]
+        self.entries = [ s[1:] for s in pure ] # parallel to self.keys
+
+    def _split(self, entry):
+        """Return ((epoch key, version key) or None, (E, V, R)) for entry."""
+
+        (flag, version) = entry[:2]
+        evr = functions.evrSplit(version)
+        if version == "" or flag & (RPMSENSE_LESS | RPMSENSE_GREATER):
+            return (None, evr)
+        return ((functions.versionKey(evr[0]),
+                 functions.versionKey(evr[1])), evr)
+
+    def add(self, seq, entry):
+        """Add entry with sequence number seq."""
+
+        (key, evr) = self._split(entry)
+        if key is None:
+            self.other.append((seq, evr, entry))
+            return
+        i = bisect.bisect_right(self.keys, key)
+        self.keys.insert(i, key)
+        self.entries.insert(i, (seq, evr, entry))
+
+    def remove(self, entry):
+        """Remove the oldest occurrence of entry."""
+
+        (key, evr) = self._split(entry)
+        if key is None:
+            for i in xrange(len(self.other)):
+                if self.other[i][2] == entry:
+                    del self.other[i]
+                    return
+            return
+        i = bisect.bisect_left(self.keys, key)
+        while i < len(self.keys) and self.keys[i] == key:
+            if self.entries[i][2] == entry:
+                del self.keys[i]
+                del self.entries[i]
+                return
+            i += 1
+
+    def search(self, flag, evr, match):
+        """Return a list of (sequence number, entry) intersecting
+        (RPMSENSE_* flag, (E, V, R) evr).
+
+        match(flag, evr, entry flag, entry (E, V, R), entry EVR string) is
+        used for all entries, which can not be decided by their position."""
+
+        result = [ (seq, entry) for (seq, eevr, entry) in self.other
+                   if match(flag, evr, entry[0], eevr, entry[1]) ]
+        key = (functions.versionKey(evr[0]), functions.versionKey(evr[1]))
+        lo = bisect.bisect_left(self.keys, key)
+        hi = bisect.bisect_right(self.keys, key, lo)
+        # Entries with lower (epoch, version) intersect if flag has "<",
+        # entries with higher ones if flag has ">".  The release only matters
+        # for the entries with equal (epoch, version).
+        if flag & RPMSENSE_LESS:
+            result.extend([ (seq, entry)
+                            for (seq, eevr, entry) in self.entries[:lo] ])
+        for (seq, eevr, entry) in self.entries[lo:hi]:
+            if match(flag, evr, entry[0], eevr, entry[1]):
+                result.append((seq, entry))
+        if flag & RPMSENSE_GREATER:
+            result.extend([ (seq, entry)
+                            for (seq, eevr, entry) in self.entries[hi:] ])
+        return result
 
 
 class ProvidesList:
@@ -102,6 +250,7 @@ class ProvidesList:
 
     def __init__(self):
         self.hash = { }
+        self.index = { }
         ProvidesList.clear(self)
         self.__len__ = self.hash.__len__
         self.__getitem__ = self.hash.__getitem__
@@ -113,33 +262,69 @@ class ProvidesList:
 
         # %name => [(flag, EVR string, providing RpmPackage)]
         self.hash.clear()
+        # %name => EVRIndex, created by the first versioned search for %name
+        self.index.clear()
+        self.seq = 0 # Sequence number of the last added entry
+
+    def _addEntry(self, name, entry):
+        """Add entry (flag, EVR string, ..., RpmPackage) for name."""
+
+        self.hash.setdefault(name, [ ]).append(entry)
+        self.seq += 1
+        if name in self.index:
+            self.index[name].add(self.seq, entry)
+
+    def _removeEntry(self, name, entry):
+        """Remove entry (flag, EVR string, ..., RpmPackage) for name.
+
+        Raise KeyError, ValueError if the entry does not exist."""
+
+        list = self.hash[name]
+        list.remove(entry)
+        if len(list) == 0:
+            del self.hash[name]
+            self.index.pop(name, None)
+        elif name in self.index:
+            self.index[name].remove(entry)
+
+    def _getIndex(self, name):
+        """Return the EVRIndex for name, create it if necessary."""
+
+        index = self.index.get(name)
+        if index is None:
+            entries = [ ]
+            for entry in self.hash[name]:
+                self.seq += 1
+                entries.append((self.seq, entry))
+            index = self.index[name] = EVRIndex(entries)
+        return index
 
     def addPkg(self, rpm):
         """Add Provides: by RpmPackage rpm. If no self provide is done it will
         be added automatically."""
         for (name, flag, version) in rpm[self.TAG]:
-            self.hash.setdefault(name, [ ]).append((flag, version, rpm))
+            self._addEntry(name, (flag, version, rpm))
         sver = rpm.getEVR()
         if (rpm["name"], RPMSENSE_EQUAL, sver) not in rpm[self.TAG]:
-            self.hash.setdefault(rpm["name"], [ ]).append((RPMSENSE_EQUAL, sver, rpm))
+            self._addEntry(rpm["name"], (RPMSENSE_EQUAL, sver, rpm))
 
     def removePkg(self, rpm):
         """Remove Provides: by RpmPackage rpm"""
 
         for (name, flag, version) in rpm[self.TAG]:
-            list = self.hash[name]
-            list.remove( (flag, version, rpm) )
-            if len(list) == 0:
-                del self.hash[name]
+            self._removeEntry(name, (flag, version, rpm))
         sname = rpm["name"]
         if not self.hash.has_key(sname):
             return
-        list = self.hash[sname]
         sver = rpm.getEVR()
-        if (RPMSENSE_EQUAL, sver, rpm) in list:
-            list.remove( (RPMSENSE_EQUAL, sver, rpm) )
-        if len(list) == 0 and self.hash.has_key(name):
-            del self.hash[name]
+        if (RPMSENSE_EQUAL, sver, rpm) in self.hash[sname]:
+            self._removeEntry(sname, (RPMSENSE_EQUAL, sver, rpm))
+
+    def _match(self, flag, evr, f, fevr, v):
+        """Return True if entry (f, v) with split EVR fevr matches (flag,
+        evr)."""
+
+        return functions.rangeCompare(flag, evr, f, fevr) or v == ""
 
     def search(self, name, flag, version):
         """Return a list of RpmPackage's matching the Requires:
@@ -147,19 +332,21 @@ class ProvidesList:
 
         if not self.hash.has_key(name):
             return { }
-        evr = functions.evrSplit(version)
         ret = { }
-        for (f, v, rpm) in self.hash[name]:
-            if rpm in ret:
-                continue
-            if version == "":
-                ret.setdefault(rpm, [ ]).append((name, f, v))
-                continue
-            if functions.rangeCompare(flag, evr, f, functions.evrSplit(v)):
-                ret.setdefault(rpm, [ ]).append((name, f, v))
-                continue
-            if v == "":
-                ret.setdefault(rpm, [ ]).append((name, f, v))
+        if version == "":
+            for entry in self.hash[name]:
+                rpm = entry[-1]
+                if rpm not in ret:
+                    ret[rpm] = [ (name,) + entry[:-1] ]
+            return ret
+        evr = functions.evrSplit(version)
+        matches = self._getIndex(name).search(flag, evr, self._match)
+        # Report the first matching entry of every package
+        matches.sort()
+        for (seq, entry) in matches:
+            rpm = entry[-1]
+            if rpm not in ret:
+                ret[rpm] = [ (name,) + entry[:-1] ]
         return ret
 
     def __iter__(self):
@@ -176,40 +363,22 @@ class ConflictsList(ProvidesList):
         be added automatically."""
 
         for entry in rpm[self.TAG]:
-            name = entry[0]
-            self.hash.setdefault(name, [ ]).append( entry[1:] + (rpm,) )
+            self._addEntry(entry[0], entry[1:] + (rpm,))
 
     def removePkg(self, rpm):
         """Remove Provides: by RpmPackage rpm"""
         for entry in rpm[self.TAG]:
-            name = entry[0]
-            list = self.hash[name]
-            list.remove( entry[1:] + (rpm,) )
-            if len(list) == 0:
-                del self.hash[name]
+            self._removeEntry(entry[0], entry[1:] + (rpm,))
 
-    def search(self, name, flag, version):
-        # s/Conflicts/Obsoletes/ in ObsoletesList
-        """Return a list of RpmPackage's with Conflicts: matching
-        (name, RPMSENSE_* flag, EVR string)."""
+    # s/Conflicts/Obsoletes/ in ObsoletesList: search() returns a list of
+    # RpmPackage's with Conflicts: matching (name, RPMSENSE_* flag, EVR
+    # string).
 
-        if not self.hash.has_key(name):
-            return { }
-        evr = functions.evrSplit(version)
-        ret = { }
-        for entry in self.hash[name]:
-            f, v = entry[:2]
-            rpm = entry[-1]
-            if rpm in ret:
-                continue
-            if version == "":
-                ret.setdefault(rpm, [ ]).append( (name,) + entry[:-1] )
-                continue
-            if functions.rangeCompare(flag, evr, f, functions.evrSplit(v)):
-                ret.setdefault(rpm, [ ]).append( (name,) + entry[:-1] )
-                continue
+    def _match(self, flag, evr, f, fevr, v):
+        """Return True if entry (f, v) with split EVR fevr matches (flag,
+        evr)."""
 
-        return ret
+        return functions.rangeCompare(flag, evr, f, fevr)
 
 
 class RequiresList(ConflictsList):
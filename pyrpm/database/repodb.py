@@ -72,6 +72,9 @@ class RpmRepoDB(memorydb.RpmMemoryDB):
                 RPMSENSE_EQUAL | RPMSENSE_LESS: "LE",
                 RPMSENSE_EQUAL | RPMSENSE_GREATER: "GE"}
 
+    # Use RpmRepoPackage for the packages in primary.xml
+    COMPACT = True
+
     def __init__(self, config, source, buildroot='', reponame="default", nc=None):
         """Exclude packages matching whitespace-separated excludes.  Use
         reponame for cache subdirectory name and pkg["yumreponame"].
@@ -421,6 +424,9 @@ class RpmRepoDB(memorydb.RpmMemoryDB):
                 except ValueError, e:
                     log.warning("%s: %s", ip, e)
                     continue
+                if pkg is None:
+                    elem.clear()
+                    continue
                 pkg.yumrepo = self
                 if self.comps != None:
                     if   self.comps.hasType(pkg["name"], "mandatory"):
@@ -436,9 +442,25 @@ class RpmRepoDB(memorydb.RpmMemoryDB):
                     log.warning("%s: missing arch= in <package>",
                                 pkg.getNEVRA())
                     continue
-                self.__parseFilelist(ip, props["name"], arch)
+                if self._isKnownPkg(props.get("pkgid")):
+                    self.__skipPackage(ip)
+                else:
+                    self.__parseFilelist(ip, props["name"], arch)
             elem.clear()
 
+    def _isKnownPkg(self, pkgid):
+        """Return True if the package with checksum pkgid is already
+        available and its <package> tag needs not to be parsed."""
+
+        return False
+
+    def __skipPackage(self, ip):
+        """Skip the rest of the current <package> tag."""
+
+        for event, elem in ip:
+            if event == "end" and elem.tag.endswith("}package"):
+                break
+
     def _isExcluded(self, pkg):
         """Return True if RpmPackage pkg is excluded by configuration."""
 
@@ -535,9 +557,13 @@ class RpmRepoDB(memorydb.RpmMemoryDB):
     def __parsePackage(self, ip):
         """Parse a package from current <package> tag.
 
-        Raise ValueError on invalid data."""
+        Return None if the package is skipped, see _isKnownPkg().  Raise
+        ValueError on invalid data."""
 
-        pkg = package.RpmPackage(self.config, "dummy", db = self)
+        if self.COMPACT:
+            pkg = package.RpmRepoPackage(self.config, "dummy", db = self)
+        else:
+            pkg = package.RpmPackage(self.config, "dummy", db = self)
         pkg["signature"] = {}
         pkg["signature"]["size_in_sig"] = [0,]
         pkg.time_file = None
@@ -586,6 +612,9 @@ class RpmRepoDB(memorydb.RpmMemoryDB):
                     pkg["signature"]["sha1header"] = elem.text
                 else:
                     raise ValueError, "Wrong or missing type= in <checksum>"
+                if self._isKnownPkg(elem.text):
+                    self.__skipPackage(ip)
+                    return None
             elif tag.endswith("}location"):
                 href = props.get("href")
                 if href == None:
@@ -629,6 +658,8 @@ class RpmRepoDB(memorydb.RpmMemoryDB):
                     "conflict", "trigger"):
             for suffix in ("name", "flags", "version"):
                 pkg.pop(tag + suffix, None) # remove if set
+        if self.COMPACT:
+            pkg.internTags()
         return pkg
 
     def __parseFilelist(self, ip, pname, arch):
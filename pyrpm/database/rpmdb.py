@@ -18,7 +18,7 @@
 # Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
 #
 
-import time, struct, os, bsddb, re, fnmatch
+import time, struct, os, bsddb, re, fnmatch, md5, cPickle, zlib
 (pack, unpack) = (struct.pack, struct.unpack)
 from binascii import a2b_hex
 from pyrpm.base import *
@@ -38,12 +38,39 @@ class RpmDBPackage(package.RpmPackage):
                 'oldfilenames' : None}
 
     def __init__(self, config, source, verify=None, hdronly=None, db=None):
-        self.indexdata = {}
+        self.indexdata = ""
 
         package.RpmPackage.__init__(self, config, source, verify, hdronly, db)
 
+    def getIndex(self, name):
+        """Return the header index entry (tag, type, offset, count) of tag
+        name or None if the header does not contain it.
+
+        self.indexdata holds the raw index of the Packages record sorted by
+        tag, offset is relative to the start of the record.  Packages
+        restored from the resolver cache read it on first use."""
+
+        if not rpmtag.has_key(name):
+            return None
+        if self.indexdata is None:
+            self.db.readIndex(self)
+        key = pack("!I", rpmtag[name][0])
+        indexdata = self.indexdata
+        (lo, hi) = (0, len(indexdata) / 16)
+        while lo < hi:
+            mid = (lo + hi) / 2
+            if indexdata[mid*16:mid*16+4] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if indexdata[lo*16:lo*16+4] != key:
+            return None
+        (tag, ttype, offset, count) = unpack("!4I",
+                                             indexdata[lo*16:lo*16+16])
+        return (tag, ttype, offset + len(indexdata) + 8, count)
+
     def has_key(self, key):
-        if self.indexdata.has_key(key) or dict.has_key(self, key):
+        if dict.has_key(self, key) or self.getIndex(key) is not None:
             return True
         return key in ('requires','provides','conflicts',
                        'obsoletes', 'triggers')
@@ -55,7 +82,7 @@ class RpmDBPackage(package.RpmPackage):
             tags = [name[:-1] + suffix for suffix in
                     ("name", "flags", "version")]
             self.db.readTags(self, tags)
-        elif not self.indexdata.has_key(name):
+        elif self.getIndex(name) is None:
             return None
         elif name in self.filetags:
             self.db.readTags(self, self.filetags)
@@ -79,6 +106,16 @@ class RpmDBPackage(package.RpmPackage):
 class RpmDB(db.RpmDatabase):
 
     zero = pack("I", 0)
+    # Version of the resolver cache file format
+    CACHEVERSION = 1
+    # Journal of a write session in the database directory
+    JOURNAL = "__pyrpm.journal"
+    # Tags of a Packages record needed to update the indexes
+    INDEXTAGS = ("basenames", "conflictname", "dirnames", "filemd5s",
+                 "group", "installtid", "name", "providename",
+                 "provideversion", "requirename", "requireversion",
+                 "requireflags", "install_sha1header", "install_md5",
+                 "triggername")
 
     def __init__(self, config, source, buildroot=''):
         db.RpmDatabase.__init__(self, config, source, buildroot)
@@ -91,6 +128,13 @@ class RpmDB(db.RpmDatabase):
         self.clear()
         self.dbopen = 0
         self.obsoletes_list = None
+        # (tags of self.tags, source) per package id from the resolver cache,
+        # None if the cache is not loaded
+        self._cache = None
+        self._cachekeys = None
+        self._journal = None    # Journal file object during a write session
+        self._interval = 1      # Changes between syncs in a write session
+        self._pending = 0       # Changes since the last sync
 
         self.path = self._getDBPath()
 
@@ -140,11 +184,16 @@ class RpmDB(db.RpmDatabase):
         return filter(None, result)
 
     def open(self):
-        return self.__openDB4()
+        result = self.__openDB4()
+        if result == self.OK and self.config.rpmdbcache and \
+               self._cache is None:
+            self._loadCache()
+        return result
 
     def close(self):
         if not self.dbopen:
             return
+        self.endWrite()
         self.basenames_db.close()
         self.conflictname_db.close()
         self.dirnames_db.close()
@@ -201,6 +250,158 @@ class RpmDB(db.RpmDatabase):
         """Read the database in memory."""
         return self.open()
 
+    def beginWrite(self, interval):
+        """Start a write session, syncing the database only every interval
+        added or removed packages and at endWrite().
+
+        The changes since the last sync are recorded in a journal, which is
+        replayed when the database is opened after an interrupted session.
+        Return 1 on success, 0 on error."""
+
+        if self.__openDB4() != self.OK:
+            return 0
+        if self._journal is not None:
+            return 1
+        if os.path.exists(self._getJournalFile()):
+            # Would truncate the changes of an interrupted session
+            log.error("rpmdb journal %s of an interrupted write session "
+                      "was not replayed", self._getJournalFile())
+            return 0
+        try:
+            self._journal = open(self._getJournalFile(), "wb")
+        except IOError, e:
+            log.error("Unable to create rpmdb journal: %s", e)
+            return 0
+        self._interval = max(interval, 1)
+        self._pending = 0
+        return 1
+
+    def endWrite(self):
+        """End a write session, sync the database and remove the journal.
+
+        Return 1 on success, 0 on error."""
+
+        if self._journal is None:
+            return 1
+        try:
+            self._sync()
+            self._journal.close()
+            os.unlink(self._getJournalFile())
+        except (bsddb.error, IOError, OSError), e:
+            log.error("Error ending rpmdb write session: %s", e)
+            self._journal = None
+            return 0
+        self._journal = None
+        return 1
+
+    def _getJournalFile(self):
+        """Return the name of the write session journal."""
+
+        return os.path.join(self._getDBPath(), self.JOURNAL)
+
+    def _logChange(self, op, pkgid, data):
+        """Record op ("add" or "remove") of package id pkgid with Packages
+        record data in the journal and write it to disk.
+
+        Raise IOError, OSError."""
+
+        record = cPickle.dumps((op, pkgid, data), 2)
+        self._journal.write(pack("!2I", len(record),
+                                 zlib.crc32(record) & 0xFFFFFFFFL) + record)
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def _changed(self):
+        """Sync the database after a change, in a write session only every
+        self._interval changes.
+
+        Raise bsddb.error, IOError, OSError."""
+
+        if self._journal is None:
+            self._sync()
+            return
+        self._pending += 1
+        if self._pending < self._interval:
+            return
+        self._sync()
+        # All changes are on disk now
+        self._journal.seek(0)
+        self._journal.truncate()
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._pending = 0
+
+    def _replayJournal(self):
+        """Apply the changes recorded in the journal of an interrupted write
+        session again, sync the database and remove the journal.
+
+        Applying a change again is harmless, a record cut off at the end was
+        not applied at all.  Raise bsddb.error, OSError."""
+
+        filename = self._getJournalFile()
+        try:
+            data = open(filename, "rb").read()
+        except IOError:
+            return
+        records = [ ]
+        pos = 0
+        while pos + 8 <= len(data):
+            (size, crc) = unpack("!2I", data[pos:pos+8])
+            record = data[pos+8:pos+8+size]
+            if len(record) != size or \
+                   zlib.crc32(record) & 0xFFFFFFFFL != crc:
+                break
+            records.append(cPickle.loads(record))
+            pos += 8 + size
+        if records:
+            log.warning("Completing %d changes of an interrupted rpmdb "
+                        "write session", len(records))
+        for (op, pkgid, data) in records:
+            pkg = self.__recordPkg(pkgid, data)
+            if pkg is None:
+                continue
+            if op == "add":
+                self.packages_db[pkgid] = data
+                try:
+                    maxid = unpack("I", self.packages_db[self.zero])[0]
+                except (struct.error, KeyError):
+                    maxid = 0
+                if unpack("I", pkgid)[0] > maxid:
+                    self.packages_db[self.zero] = pkgid
+                self.__writeIndexes(pkgid, pkg, True)
+            else:
+                self.__removeIndexes(pkgid, pkg)
+                if self.packages_db.has_key(pkgid):
+                    del self.packages_db[pkgid]
+        self._sync()
+        os.unlink(filename)
+
+    def __recordPkg(self, pkgid, data):
+        """Return a RpmDBPackage with the tags needed for the indexes decoded
+        from Packages record data, or None if data is invalid."""
+
+        pkg = RpmDBPackage(self.config, "dummy")
+        pkg.key = pkgid
+        pkg.db = self
+        try:
+            (indexNo, storeSize) = unpack("!2I", data[0:8])
+        except struct.error:
+            log.error("Invalid rpmdb journal record for %s", repr(pkgid))
+            return None
+        pkg.indexdata = self._sortIndex(data, indexNo)
+        rpmio = io.RpmFileIO("dummy")
+        for tag in self.INDEXTAGS:
+            index = pkg.getIndex(tag)
+            if index is None:
+                continue
+            try:
+                pkg[tag] = rpmio.getHeaderByIndexData(index, data)
+            except ValueError, e:
+                log.error("Invalid rpmdb journal record for %s: %s",
+                          repr(pkgid), e)
+                return None
+        return pkg
+
     def getMemoryCopy(self, reposdb=None):
         from pyrpm.database.rpmshadowdb import RpmShadowDB
         db = RpmShadowDB(self, reposdb)
@@ -239,20 +440,11 @@ class RpmDB(db.RpmDatabase):
         if len(data) < indexNo*16 + 8:
             log.error("Value for key %s in rpmdb is too short", repr(key))
             return None
-        indexdata = unpack("!%sI" % (indexNo*4), data[8:indexNo*16+8])
-        indexes = zip(indexdata[0::4], indexdata[1::4],
-                      indexdata[2::4], indexdata[3::4])
-        indexdata = {}
-        for idx in indexes:
-            if rpmtagname.has_key(idx[0]):
-                indexdata[rpmtagname[idx[0]]] = idx
-        pkg.indexdata = indexdata
-
-        storedata = data[indexNo*16+8:]
+        pkg.indexdata = self._sortIndex(data, indexNo)
         pkg["signature"] = {}
 
         # read the tags
-        ok = self.readTags(pkg, tags, storedata)
+        ok = self.readTags(pkg, tags, data)
         if not ok:
             return None
 
@@ -281,20 +473,59 @@ class RpmDB(db.RpmDatabase):
         return pkg
 
 
-    def readTags(self, pkg, tags, storedata=None):
+    def _sortIndex(self, data, indexNo):
+        """Return the raw index of Packages record data with indexNo entries
+        sorted by tag.
+
+        Only the raw index is kept, tags get decoded on first access.  Big
+        endian entries sorted as strings are sorted by tag."""
+
+        indexdata = data[8:indexNo*16+8]
+        tagnums = list(unpack("!%sI" % (indexNo*4), indexdata)[0::4])
+        sortednums = tagnums[:]
+        sortednums.sort()
+        if tagnums != sortednums:
+            entries = [indexdata[i*16:i*16+16] for i in xrange(indexNo)]
+            entries.sort()
+            indexdata = "".join(entries)
+        return indexdata
+
+    def readIndex(self, pkg):
+        """Read the raw index of pkg from its Packages record.
+
+        Used for packages restored from the resolver cache, an invalid
+        record leaves an empty index."""
+
+        pkg.indexdata = ""
+        data = self.packages_db[pkg.key]
+        try:
+            (indexNo, storeSize) = unpack("!2I", data[0:8])
+        except struct.error:
+            log.error("Value for key %s in rpmdb is too short", repr(pkg.key))
+            return
+        if len(data) < indexNo*16 + 8:
+            log.error("Value for key %s in rpmdb is too short", repr(pkg.key))
+            return
+        pkg.indexdata = self._sortIndex(data, indexNo)
+
+    def readTags(self, pkg, tags, data=None):
+        """Decode tags of pkg from its Packages record data, which is fetched
+        from the database if not given.
+
+        The index offsets point into data directly, so the data area is never
+        copied.  Return 1 on success, 0 on invalid data."""
+
         rpmio = io.RpmFileIO("dummy")
 
-        if storedata is None:
+        if data is None:
             data = self.packages_db[pkg.key]
-            storedata = data[len(pkg.indexdata)*16+8:]
 
         for tag in tags:
-            if pkg.indexdata.has_key(tag):
-                index = pkg.indexdata[tag]
-            else:
+            index = pkg.getIndex(tag)
+            if index is None:
                 continue
             try:
-                tagval = rpmio.getHeaderByIndexData(index, storedata)
+                tagval = rpmio.getHeaderByIndexData(index, data)
             except ValueError, e:
                 log.error("Invalid header entry %s in %s: %s", tag, index, e)
                 return 0
@@ -327,8 +558,114 @@ class RpmDB(db.RpmDatabase):
     def write(self):
         return 1
 
+    def _getCacheFile(self):
+        """Return the name of the resolver cache file for this database."""
+
+        return os.path.join(self.config.cachedir, "rpmdb-%s.cache" %
+                            md5.new(self._getDBPath()).hexdigest())
+
+    def _getCacheKey(self):
+        """Return the (mtime, size) pairs of the Packages and Installtid files
+        identifying the database state, or None if not available."""
+
+        dbpath = self._getDBPath()
+        key = [ ]
+        for name in ("Packages", "Installtid"):
+            try:
+                st = os.stat(os.path.join(dbpath, name))
+            except OSError:
+                return None
+            key.extend((st.st_mtime, st.st_size))
+        return tuple(key)
+
+    def _loadCache(self):
+        """Load the resolver cache if it matches the database.
+
+        The cache holds the tags in self.tags (and the derived obsoletes) of
+        all packages, so reading all packages and the obsoletes list does not
+        need to decode every Packages record."""
+
+        key = self._getCacheKey()
+        if key is None:
+            return
+        try:
+            fd = open(self._getCacheFile(), "rb")
+            try:
+                (version, cachekey, records) = cPickle.load(fd)
+            finally:
+                fd.close()
+        except Exception:
+            return
+        if version != self.CACHEVERSION or cachekey != key:
+            log.debug1("Resolver cache of %s is outdated", self._getDBPath())
+            return
+        self._cachekeys = [pkgid for (pkgid, record) in records]
+        self._cache = dict(records)
+        log.debug1("Read resolver cache of %s", self._getDBPath())
+
+    def _writeCache(self, key, pkgids, pkgs):
+        """Write the resolver cache for database state key from the packages
+        pkgs read for package ids pkgids."""
+
+        records = [ ]
+        for (pkgid, pkg) in zip(pkgids, pkgs):
+            if pkg is None:
+                records.append((pkgid, None))
+                continue
+            tags = { }
+            for tag in self.tags.keys() + ["signature", "obsoletes"]:
+                if dict.has_key(pkg, tag):
+                    tags[tag] = dict.get(pkg, tag)
+            records.append((pkgid, (tags, pkg.source)))
+        filename = self._getCacheFile()
+        try:
+            if not os.path.isdir(self.config.cachedir):
+                os.makedirs(self.config.cachedir)
+            fd = open(filename + ".tmp", "wb")
+            try:
+                cPickle.dump((self.CACHEVERSION, key, records), fd, 2)
+            finally:
+                fd.close()
+            os.rename(filename + ".tmp", filename)
+        except (IOError, OSError), e:
+            log.debug1("Unable to write resolver cache %s: %s", filename, e)
+            return
+        self._cachekeys = pkgids
+        self._cache = dict(records)
+
+    def _dropCache(self):
+        """Forget and remove the resolver cache, the database changes."""
+
+        self._cache = None
+        self._cachekeys = None
+        if not self.config.rpmdbcache:
+            return
+        try:
+            os.unlink(self._getCacheFile())
+        except OSError:
+            pass
+
+    def _cachedRpm(self, key, record):
+        """Return a RpmDBPackage for package id key from its record
+        (tags, source) in the resolver cache."""
+
+        (tags, source) = record
+        pkg = RpmDBPackage(self.config, "dummy")
+        pkg.reponame = "installed"
+        pkg.key = key
+        pkg.db = self
+        pkg.indexdata = None
+        pkg.update(tags)
+        pkg["signature"] = tags["signature"].copy()
+        pkg.source = source
+        pkg.io = None
+        pkg.header_read = 1
+        return pkg
+
     def addPkg(self, pkg):
         self.basenames_cache.clear()
+        if self._cache is not None:
+            self._dropCache()
         result = self._addPkg(pkg)
         if result and pkg["obsoletes"] and self.obsoletes_list is not None:
             p = self.getPkgById(result)
@@ -372,33 +709,18 @@ class RpmDB(db.RpmDatabase):
             pkg["installcolor"] = [self.config.tscolor,]
             pkg["installtid"] = [self.config.tid,]
 
-            self.packages_db[self.zero] = pkgid
-
             (headerindex, headerdata) = rpmio._generateHeader(pkg, 4)
-            self.packages_db[pkgid] = headerindex[8:]+headerdata
-
-            self.__writeDB4(self.basenames_db, "basenames", pkgid, pkg)
-            self.__writeDB4(self.conflictname_db, "conflictname", pkgid, pkg)
-            self.__writeDB4(self.dirnames_db, "dirnames", pkgid, pkg)
-            self.__writeDB4(self.filemd5s_db, "filemd5s", pkgid, pkg, True,
-                            a2b_hex)
-            self.__writeDB4(self.group_db, "group", pkgid, pkg)
-            self.__writeDB4(self.installtid_db, "installtid", pkgid, pkg, True,
-                            lambda x:pack("i", x))
-            self.__writeDB4(self.name_db, "name", pkgid, pkg, False)
-            self.__writeDB4(self.providename_db, "providename", pkgid, pkg)
-            self.__writeDB4(self.provideversion_db, "provideversion", pkgid,
-                            pkg)
-            self.__writeDB4(self.requirename_db, "requirename", pkgid, pkg)
-            self.__writeDB4(self.requireversion_db, "requireversion", pkgid,
-                            pkg)
-            self.__writeDB4(self.sha1header_db, "install_sha1header", pkgid,
-                            pkg, False)
-            self.__writeDB4(self.sigmd5_db, "install_md5", pkgid, pkg, False)
-            self.__writeDB4(self.triggername_db, "triggername", pkgid, pkg)
+            data = headerindex[8:]+headerdata
+            if self._journal is not None:
+                self._logChange("add", pkgid, data)
 
-            self._sync()
-        except bsddb.error:
+            self.packages_db[self.zero] = pkgid
+            self.packages_db[pkgid] = data
+            self.__writeIndexes(pkgid, pkg)
+
+            self._changed()
+        except (bsddb.error, IOError, OSError), e:
+            log.error("Error writing to rpmdb: %s", e)
             functions.unblockSignals(signals)
             return 0 # Due to the blocking, this is now virtually atomic
         functions.unblockSignals(signals)
@@ -406,6 +728,8 @@ class RpmDB(db.RpmDatabase):
 
     def removePkg(self, pkg):
         self.basenames_cache.clear()
+        if self._cache is not None:
+            self._dropCache()
         if (not hasattr(pkg, 'key') or
             not hasattr(pkg, 'db') or
             pkg.db is not self):
@@ -426,28 +750,14 @@ class RpmDB(db.RpmDatabase):
                 functions.unblockSignals(signals)
                 return 0
 
-            self.__removeId(self.basenames_db, "basenames", pkgid, pkg)
-            self.__removeId(self.conflictname_db, "conflictname", pkgid, pkg)
-            self.__removeId(self.dirnames_db, "dirnames", pkgid, pkg)
-            self.__removeId(self.filemd5s_db, "filemd5s", pkgid, pkg, True,
-                            a2b_hex)
-            self.__removeId(self.group_db, "group", pkgid, pkg)
-            self.__removeId(self.installtid_db, "installtid", pkgid, pkg, True,
-                            lambda x:pack("i", x))
-            self.__removeId(self.name_db, "name", pkgid, pkg, False)
-            self.__removeId(self.providename_db, "providename", pkgid, pkg)
-            self.__removeId(self.provideversion_db, "provideversion", pkgid,
-                            pkg)
-            self.__removeId(self.requirename_db, "requirename", pkgid, pkg)
-            self.__removeId(self.requireversion_db, "requireversion", pkgid,
-                            pkg)
-            self.__removeId(self.sha1header_db, "install_sha1header", pkgid,
-                            pkg, False)
-            self.__removeId(self.sigmd5_db, "install_md5", pkgid, pkg, False)
-            self.__removeId(self.triggername_db, "triggername", pkgid, pkg)
+            if self._journal is not None and self.packages_db.has_key(pkgid):
+                self._logChange("remove", pkgid, self.packages_db[pkgid])
+
+            self.__removeIndexes(pkgid, pkg)
             del self.packages_db[pkgid]
-            self._sync()
-        except bsddb.error:
+            self._changed()
+        except (bsddb.error, IOError, OSError), e:
+            log.error("Error writing to rpmdb: %s", e)
             functions.unblockSignals(signals)
             return 0 # FIXME: keep trying?
         functions.unblockSignals(signals)
@@ -504,10 +814,73 @@ class RpmDB(db.RpmDatabase):
             self.triggername_db    = bsddb.hashopen(
                 os.path.join(dbpath, "Triggername"), "c")
             self.dbopen = True
-        except bsddb.error:
+            self._replayJournal()
+        except (bsddb.error, OSError), e:
+            log.error("Error opening rpmdb: %s", e)
+            # Don't use a partly replayed database, the journal is kept
+            if self.dbopen:
+                self.close()
             return
         return self.OK
 
+    def __writeIndexes(self, pkgid, pkg, replay=False):
+        """Add the index entries of RpmPackage pkg with id pkgid.
+
+        Entries already there are not added again if replay.  Raise
+        bsddb.error."""
+
+        self.__writeDB4(self.basenames_db, "basenames", pkgid, pkg, True,
+                        str, replay)
+        self.__writeDB4(self.conflictname_db, "conflictname", pkgid, pkg,
+                        True, str, replay)
+        self.__writeDB4(self.dirnames_db, "dirnames", pkgid, pkg, True, str,
+                        replay)
+        self.__writeDB4(self.filemd5s_db, "filemd5s", pkgid, pkg, True,
+                        a2b_hex, replay)
+        self.__writeDB4(self.group_db, "group", pkgid, pkg, True, str, replay)
+        self.__writeDB4(self.installtid_db, "installtid", pkgid, pkg, True,
+                        lambda x:pack("i", x), replay)
+        self.__writeDB4(self.name_db, "name", pkgid, pkg, False, str, replay)
+        self.__writeDB4(self.providename_db, "providename", pkgid, pkg, True,
+                        str, replay)
+        self.__writeDB4(self.provideversion_db, "provideversion", pkgid,
+                        pkg, True, str, replay)
+        self.__writeDB4(self.requirename_db, "requirename", pkgid, pkg, True,
+                        str, replay)
+        self.__writeDB4(self.requireversion_db, "requireversion", pkgid,
+                        pkg, True, str, replay)
+        self.__writeDB4(self.sha1header_db, "install_sha1header", pkgid,
+                        pkg, False, str, replay)
+        self.__writeDB4(self.sigmd5_db, "install_md5", pkgid, pkg, False,
+                        str, replay)
+        self.__writeDB4(self.triggername_db, "triggername", pkgid, pkg, True,
+                        str, replay)
+
+    def __removeIndexes(self, pkgid, pkg):
+        """Remove the index entries of RpmPackage pkg with id pkgid.
+
+        Raise bsddb.error."""
+
+        self.__removeId(self.basenames_db, "basenames", pkgid, pkg)
+        self.__removeId(self.conflictname_db, "conflictname", pkgid, pkg)
+        self.__removeId(self.dirnames_db, "dirnames", pkgid, pkg)
+        self.__removeId(self.filemd5s_db, "filemd5s", pkgid, pkg, True,
+                        a2b_hex)
+        self.__removeId(self.group_db, "group", pkgid, pkg)
+        self.__removeId(self.installtid_db, "installtid", pkgid, pkg, True,
+                        lambda x:pack("i", x))
+        self.__removeId(self.name_db, "name", pkgid, pkg, False)
+        self.__removeId(self.providename_db, "providename", pkgid, pkg)
+        self.__removeId(self.provideversion_db, "provideversion", pkgid,
+                        pkg)
+        self.__removeId(self.requirename_db, "requirename", pkgid, pkg)
+        self.__removeId(self.requireversion_db, "requireversion", pkgid,
+                        pkg)
+        self.__removeId(self.sha1header_db, "install_sha1header", pkgid,
+                        pkg, False)
+        self.__removeId(self.sigmd5_db, "install_md5", pkgid, pkg, False)
+        self.__removeId(self.triggername_db, "triggername", pkgid, pkg)
+
     def __removeId(self, db, tag, pkgid, pkg, useidx=True, func=str):
         """Remove index entries for tag of RpmPackage pkg (with id pkgid) from
         a BSD database db.
@@ -536,12 +909,13 @@ class RpmDB(db.RpmDatabase):
             else:
                 db[key] = ndata
 
-    def __writeDB4(self, db, tag, pkgid, pkg, useidx=True, func=str):
+    def __writeDB4(self, db, tag, pkgid, pkg, useidx=True, func=str,
+                   replay=False):
         """Add index entries for tag of RpmPackage pkg (with id pkgid) to a
         BSD database db.
 
         The tag has a single value if not useidx.  Convert the value using
-        func."""
+        func.  Entries already there are not added again if replay."""
 
         tnamehash = {}
         if not pkg.has_key(tag):
@@ -564,7 +938,16 @@ class RpmDB(db.RpmDatabase):
                     continue
                 else:
                     tnamehash[key] = 1
-            db[key] = db.get(key, "") + (pkgid + pack("I", idx))
+            entry = pkgid + pack("I", idx)
+            data = db.get(key, "")
+            if replay:
+                for i in xrange(0, len(data), 8):
+                    if data[i:i+8] == entry:
+                        break
+                else:
+                    db[key] = data + entry
+            else:
+                db[key] = data + entry
             if not useidx:
                 break
 
@@ -653,6 +1036,13 @@ class RpmDB(db.RpmDatabase):
     def getPkgById(self, id):
         if self._pkgs.has_key(id):
             return self._pkgs[id]
+        elif self._cache is not None and self._cache.has_key(id):
+            record = self._cache[id]
+            if record is None:
+                return None
+            pkg = self._cachedRpm(id, record)
+            self._pkgs[id] = pkg
+            return pkg
         else:
             pkg = self.readRpm(id, self.packages_db, self.tags)
             if pkg is not None:
@@ -665,7 +1055,16 @@ class RpmDB(db.RpmDatabase):
         return filter(None, result)
 
     def getPkgs(self):
-        result = [self.getPkgById(key) for key in self.packages_db.keys()]
+        if self._cache is not None:
+            result = [self.getPkgById(key) for key in self._cachekeys]
+            return filter(None, result)
+        if self.config.rpmdbcache:
+            key = self._getCacheKey()
+        pkgids = self.packages_db.keys()
+        result = [self.getPkgById(pkgid) for pkgid in pkgids]
+        if self.config.rpmdbcache and key is not None and \
+               key == self._getCacheKey():
+            self._writeCache(key, pkgids, result)
         return filter(None, result)
 
     def getNames(self):
@@ -37,6 +37,8 @@ class RpmMemoryDB(memorydb.RpmMemoryDB, rpmdb.RpmDB):
 
     open = rpmdb.RpmDB.open
     close = rpmdb.RpmDB.close
+    beginWrite = rpmdb.RpmDB.beginWrite
+    endWrite = rpmdb.RpmDB.endWrite
 
 
     def read(self):
@@ -47,6 +47,6 @@ if sqlite:
 
         def executemany(self, query, param_sequence):
             query = self.___translate_query(query)
-            return self.cursor.executemany(SQL, param_sequence)
+            return self.cursor.executemany(query, param_sequence)
 
 # vim:ts=4:sw=4:showmatch:expandtab
@@ -65,7 +65,7 @@ USEYUM = False # disable yum metadata parser for now
 import sqlitecompat as sqlite3
 from lrucache import SmallLRUCache
 
-class SqliteRpmPackage(package.RpmPackage):
+class SqliteRpmPackage(package.RpmRepoPackage):
 
     CACHE = {
         'requires' : SmallLRUCache(maxsize=100),
@@ -75,7 +75,8 @@ class SqliteRpmPackage(package.RpmPackage):
 
     def __init__(self, config, source, verify=None, hdronly=None, db=None):
         self.filesloaded = False
-        package.RpmPackage.__init__(self, config, source, verify, hdronly, db)
+        package.RpmRepoPackage.__init__(self, config, source, verify, hdronly,
+                                        db)
 
     def has_key(self, name):
         if dict.has_key(self, name):
@@ -165,6 +166,9 @@ class SqliteRepoDB(repodb.RpmRepoDB):
 
     COLUMNS_LOOKUP = set(COLUMNS)
 
+    # Columns of the requires, provides, conflicts and obsoletes tables
+    DEPCOLUMNS = ('name', 'flags', 'epoch', 'version', 'release', 'pkgKey')
+
     DB2PKG = {
         # 'time_file' : '' # -> pkg.time_file
         'time_build' : 'buildtime',
@@ -195,8 +199,20 @@ class SqliteRepoDB(repodb.RpmRepoDB):
 
     tags = 'pkgKey, name, arch, version, epoch, release, location_href'
 
+    # Import XML metadata in one transaction with batched inserts and create
+    # the indexes afterwards
+    BULKLOAD = True
+    # Number of rows per INSERT statement collected in a bulk load before
+    # they get written
+    BULK_ROWS = 5000
+
     def __init__(self, config, source, buildroot='', reponame="default", nc=None):
         repodb.RpmRepoDB.__init__(self, config, source, buildroot, reponame, nc)
+        self._bulk = None       # query: [cursor, rows] during bulk loads
+        self._bulkids = None    # pkgIds or pkgKeys added in bulk load
+        self._bulkkey = 0       # last pkgKey assigned in bulk load
+        self._known = None      # pkgId: pkgKey of cache being updated
+        self._seen = None       # pkgIds of _known found in the metadata
         self._primarydb = None
         self._filelistsdb = None
         self._othersdb = None
@@ -278,6 +294,59 @@ class SqliteRepoDB(repodb.RpmRepoDB):
         cursor.execute(query, values)# XXX ??? .encode('utf8'))
         return cursor.lastrowid
 
+    def insertRows(self, table, columns, rows, cursor):
+        """Insert rows of values for columns into a database table.
+
+        During a bulk load the rows are only queued, see beginBulkLoad()."""
+        if not rows:
+            return
+        query = "INSERT INTO %s (%s) VALUES (%s)" % \
+                (table, ",".join(columns), ", ".join(["?"] * len(columns)))
+        if self._bulk is None:
+            cursor.executemany(query, rows)
+            return
+        if not self._bulk.has_key(query):
+            self._bulk[query] = [cursor, []]
+        queued = self._bulk[query][1]
+        queued.extend(rows)
+        if len(queued) >= self.BULK_ROWS:
+            cursor.executemany(query, queued)
+            del queued[:]
+
+    def beginBulkLoad(self, db):
+        """Prepare the new database db for importing a whole metadata file.
+
+        Rows are collected and written with executemany() until
+        endBulkLoad(), pkgKeys are assigned here instead of by sqlite.  The
+        cache file is regenerated if the import does not complete, so db is
+        neither synced nor journaled meanwhile."""
+        cur = db.cursor()
+        cur.execute("PRAGMA synchronous = OFF")
+        cur.execute("PRAGMA journal_mode = OFF")
+        self._bulk = {}
+        self._bulkids = set()
+        self._bulkkey = 0
+
+    def endBulkLoad(self, db):
+        """Write all queued rows, commit them and restore the default sync
+        and journal settings of db."""
+        try:
+            for (query, (cursor, rows)) in self._bulk.iteritems():
+                if rows:
+                    cursor.executemany(query, rows)
+            db.commit()
+        finally:
+            self.abortBulkLoad()
+        cur = db.cursor()
+        cur.execute("PRAGMA journal_mode = DELETE")
+        cur.execute("PRAGMA synchronous = FULL")
+
+    def abortBulkLoad(self):
+        """Forget about a bulk load and all rows not written yet."""
+        self._bulk = None
+        self._bulkids = None
+        self._bulkkey = 0
+
     def loadCache(self, filename):
         """Load cache from filename, check if it is valid and that dbversion
         matches the required dbversion"""
@@ -319,6 +388,11 @@ class SqliteRepoDB(repodb.RpmRepoDB):
             filenames TEXT,
             filetypes TEXT)
         """)
+        self._filelistsdb.commit()
+
+    def createFilelistsIndexes(self):
+        """Create the indexes of the filelists metadata tables"""
+        cur = self._filelistsdb.cursor()
         cur.execute("CREATE INDEX keyfile ON filelist (pkgKey)")
         cur.execute("CREATE INDEX pkgId ON packages (pkgId)")
         cur.execute("CREATE INDEX dirnames ON filelist (dirname)")
@@ -340,6 +414,11 @@ class SqliteRepoDB(repodb.RpmRepoDB):
             date TEXT,
             changelog TEXT)
         """)
+        self._othersdb.commit()
+
+    def createOthersIndexes(self):
+        """Create the indexes of the other.xml.gz metadata tables"""
+        cur = self._othersdb.cursor()
         cur.execute("CREATE INDEX keychange ON changelog (pkgKey)")
         cur.execute("CREATE INDEX pkgId ON packages (pkgId)")
         self._othersdb.commit()
@@ -379,7 +458,12 @@ class SqliteRepoDB(repodb.RpmRepoDB):
             type TEXT,
             pkgKey TEXT)
         """)
-        # Create indexes for faster searching
+        self._primarydb.commit()
+
+    def createPrimaryIndexes(self):
+        """Create the indexes of the primary metadata tables for faster
+           searching"""
+        cur = self._primarydb_cursor
         cur.execute("CREATE INDEX packagename ON packages (name)")
         cur.execute("CREATE INDEX providesname ON provides (name)")
         cur.execute("CREATE INDEX pkgprovides ON provides (pkgKey)")
@@ -481,6 +565,20 @@ class SqliteRepoDB(repodb.RpmRepoDB):
                 return 0
 
         if filename:
+            if not USEYUM and dbtype in ('primary', 'filelists') and \
+                   os.path.exists(dbfilename):
+                try:
+                    csum, db = self.loadCache(dbfilename)
+                except sqlite3.Error:
+                    db = None
+                if db is not None:
+                    log.info2("Updating %s", dbfilename)
+                    try:
+                        if self.updateDbFile(dbtype, filename, db):
+                            return 1
+                    except sqlite3.Error, e:
+                        log.warning("Updating %s failed: %s", dbfilename, e)
+                    db.close()
             log.info2("Creating %s", dbfilename)
             if USEYUM:
                 parser = yum.mdparser.MDParser(filename)
@@ -503,16 +601,110 @@ class SqliteRepoDB(repodb.RpmRepoDB):
                         "CREATE INDEX IF NOT EXISTS "
                         "requiresname ON requires (name)")
                 return 1
-            db = self.create(dbfilename)
-            setattr(self, "_%sdb" % dbtype, db)
-            setattr(self, "_%sdb_cursor" % dbtype, db.cursor())
-            if dbtype == 'primary':
-                self.createPrimaryTables()
-            elif dbtype == 'filelists':
-                self.createFilelistsTables()
-            elif dbtype == 'other':
-                self.createOthersTables()
+            return self.importDbFile(dbtype, filename, dbfilename)
+        return 0
+
+    def updateDbFile(self, dbtype, filename, db):
+        """Update the existing sqlite cache db for dbtype to the XML metadata
+        in filename.
+
+        Packages already in db are not parsed again, new packages are added
+        and vanished packages removed.  Only primary and filelists caches
+        can be updated.  Return 1 on success, 0 on error."""
+        cur = db.cursor()
+        cur.execute("SELECT dbversion FROM db_info")
+        if cur.fetchone()[0] != dbversion:
+            return 0
+        setattr(self, "_%sdb" % dbtype, db)
+        setattr(self, "_%sdb_cursor" % dbtype, db.cursor())
+        if dbtype == 'primary':
+            tables = ('packages', 'requires', 'provides', 'conflicts',
+                      'obsoletes', 'files')
+        else:
+            tables = ('packages', 'filelist')
+        known = {}
+        cur.execute("SELECT pkgId, pkgKey FROM packages")
+        for (pkgId, pkgKey) in cur.fetchall():
+            known[pkgId] = pkgKey
+        if dbtype == 'filelists':
+            # Keep only file lists matching the pkgKeys of the primary cache,
+            # new packages may reuse the pkgKeys of removed ones
+            pcur = self._primarydb_cursor
+            pcur.execute("SELECT pkgId, pkgKey FROM packages")
+            primary = {}
+            for (pkgId, pkgKey) in pcur.fetchall():
+                primary[pkgId] = pkgKey
+            stale = []
+            for (pkgId, pkgKey) in known.items():
+                if primary.get(pkgId) != pkgKey:
+                    stale.append(pkgKey)
+                    del known[pkgId]
+            self.deletePkgKeys(cur, tables, stale)
+
+        try:
+            fd = PyGZIP(filename)
+            ip = iterparse(fd, events=("start","end"))
+            ip = iter(ip)
+        except IOError:
+            return 0
+        self._known = known
+        self._seen = set()
+        try:
+            self._parse(ip)
+            vanished = [pkgKey for (pkgId, pkgKey) in known.iteritems()
+                        if pkgId not in self._seen]
+        finally:
+            self._known = None
+            self._seen = None
+        self.deletePkgKeys(cur, tables, vanished)
+        if dbtype == 'primary':
+            for pkgKey in vanished:
+                self._pkgs.pop(int(pkgKey), None)
+        log.info2("%s: %d packages kept, %d removed", self.reponame,
+                  len(known) - len(vanished), len(vanished))
+        cur.execute("DELETE FROM db_info")
+        self.setInfo(db, dbversion, self.repomd[dbtype]["checksum"])
+        db.commit()
+        return 1
 
+    def deletePkgKeys(self, cursor, tables, pkgKeys):
+        """Delete all rows of the packages in list pkgKeys from tables"""
+        for i in xrange(0, len(pkgKeys), 500):
+            keys = pkgKeys[i:i + 500]
+            marks = ",".join(["?"] * len(keys))
+            for table in tables:
+                cursor.execute("DELETE FROM %s WHERE pkgKey IN (%s)" %
+                               (table, marks), keys)
+
+    def _isKnownPkg(self, pkgid):
+        if self._known is None or not self._known.has_key(pkgid):
+            return False
+        self._seen.add(pkgid)
+        return True
+
+    def importDbFile(self, dbtype, filename, dbfilename):
+        """Create the sqlite cache dbfilename for dbtype from the XML metadata
+        in filename.
+
+        Return 1 on success, 0 on error."""
+        db = self.create(dbfilename)
+        setattr(self, "_%sdb" % dbtype, db)
+        setattr(self, "_%sdb_cursor" % dbtype, db.cursor())
+        if dbtype == 'primary':
+            (createTables, createIndexes) = (self.createPrimaryTables,
+                                             self.createPrimaryIndexes)
+        elif dbtype == 'filelists':
+            (createTables, createIndexes) = (self.createFilelistsTables,
+                                             self.createFilelistsIndexes)
+        elif dbtype == 'other':
+            (createTables, createIndexes) = (self.createOthersTables,
+                                             self.createOthersIndexes)
+        if self.BULKLOAD:
+            self.beginBulkLoad(db)
+        try:
+            createTables()
+            if not self.BULKLOAD:
+                createIndexes()
             try:
                 fd = PyGZIP(filename)
                 ip = iterparse(fd, events=("start","end"))
@@ -520,10 +712,14 @@ class SqliteRepoDB(repodb.RpmRepoDB):
             except IOError:
                 return 0
             self._parse(ip)
-            self.setInfo(db, dbversion, self.repomd[dbtype]["checksum"])
-            db.commit()
-            return 1
-        return 0
+            if self.BULKLOAD:
+                self.endBulkLoad(db)
+                createIndexes()
+        finally:
+            self.abortBulkLoad()
+        self.setInfo(db, dbversion, self.repomd[dbtype]["checksum"])
+        db.commit()
+        return 1
 
     #def readPrimary(self):
     #    result = self.getDbFile("primary")
@@ -545,12 +741,19 @@ class SqliteRepoDB(repodb.RpmRepoDB):
             return
         pkgId, pkgKey = op[0], op[1]
 
-        try:
-            self.insertHash('packages', {'pkgId' : pkgId, 'pkgKey' : pkgKey},
-                fcur)
-        except sqlite3.DatabaseError:
-            # Files of package already in database: skipping
-            return
+        if self._bulk is not None:
+            if pkgKey in self._bulkids:
+                return
+            self._bulkids.add(pkgKey)
+            self.insertRows('packages', ('pkgId', 'pkgKey'),
+                            [(pkgId, pkgKey)], fcur)
+        else:
+            try:
+                self.insertHash('packages',
+                                {'pkgId' : pkgId, 'pkgKey' : pkgKey}, fcur)
+            except sqlite3.DatabaseError:
+                # Files of package already in database: skipping
+                return
 
         if self._pkgs.has_key(pkgKey) and self._pkgs[pkgKey] is not None:
             self._pkgs[pkgKey]['oldfilenames'] = filelist
@@ -563,14 +766,13 @@ class SqliteRepoDB(repodb.RpmRepoDB):
             dirs[dirname]['files'].append(filename)
             dirs[dirname]['types'].append(ftype[0])
 
+        rows = []
         for (dirname, dir) in dirs.items():
-            data = {
-                'pkgKey': pkgKey,
-                'dirname': dirname,
-                'filenames': '/'.join(dir['files']),
-                'filetypes': ''.join(dir['types'])
-            }
-            self.insertHash('filelist', data, fcur)
+            rows.append((pkgKey, dirname, '/'.join(dir['files']),
+                         ''.join(dir['types'])))
+        self.insertRows('filelist',
+                        ('pkgKey', 'dirname', 'filenames', 'filetypes'),
+                        rows, fcur)
 
     def importFilelist(self):
         # try mirror that just worked
@@ -714,32 +916,43 @@ class SqliteRepoDB(repodb.RpmRepoDB):
             data['size_' + k] = v
 
         # check if package already in db
-        cur.execute('SELECT pkgKey FROM packages WHERE pkgId=?',
-                    (data['pkgId'],))
-        if cur.fetchone():
-            return
-
-        pkgKey = self.insertHash('packages', data, cur)
+        if self._bulk is not None:
+            if data['pkgId'] in self._bulkids:
+                return
+            self._bulkids.add(data['pkgId'])
+            self._bulkkey += 1
+            data['pkgKey'] = pkgKey = self._bulkkey
+            keys = data.keys()
+            keys.sort()
+            self.insertRows('packages', keys, [[data[k] for k in keys]], cur)
+        else:
+            cur.execute('SELECT pkgKey FROM packages WHERE pkgId=?',
+                        (data['pkgId'],))
+            if cur.fetchone():
+                return
+            pkgKey = self.insertHash('packages', data, cur)
         pkg.pkgKey = pkgKey
 
+        if sqlite3.sqlite:
+            pre = "True"
+        else:
+            pre = True
         for tag in ('requires', 'provides', 'conflicts', 'obsoletes'):
+            (rows, prerows) = ([], [])
             for (n, f, v) in pkg[tag]:
                 epoch, version, release = functions.evrSplit(v, "")
-                data = {
-                    'name' : n,
-                    'flags' : self.flagmap[f & base.RPMSENSE_SENSEMASK],
-                    'epoch' : epoch,
-                    'version' : version,
-                    'release' : release,
-                    'pkgKey' : pkgKey,
-                    }
+                row = (n, self.flagmap[f & base.RPMSENSE_SENSEMASK],
+                       epoch, version, release, pkgKey)
                 if (f & base.RPMSENSE_PREREQ) and tag == 'requires':
-                    data['pre'] = True
-                self.insertHash(tag, data, cur)
-
-        for f, t in  zip(pkg.iterFilenames(), pkg.filetypelist):
-            self.insertHash(
-                'files', {'name' : f, 'type' : t[0], 'pkgKey' : pkgKey}, cur)
+                    prerows.append(row + (pre,))
+                else:
+                    rows.append(row)
+            self.insertRows(tag, self.DEPCOLUMNS, rows, cur)
+            self.insertRows(tag, self.DEPCOLUMNS + ('pre',), prerows, cur)
+
+        self.insertRows('files', ('name', 'type', 'pkgKey'),
+                        [(f, t[0], pkgKey) for (f, t) in
+                         zip(pkg.iterFilenames(), pkg.filetypelist)], cur)
 
     # remove package
     def removePkg(self, pkg):
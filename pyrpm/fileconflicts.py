@@ -0,0 +1,264 @@
+#
+# Copyright (C) 2004, 2005 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as published by
+# the Free Software Foundation; version 2 only
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+"""
+File conflict detection
+-----------------------
+
+The files of each set of packages are collected in one list of (dirname,
+basename, package number, file index) entries sorted by path.  Paths shared
+by several packages are found by a k-way merge of these lists, only their
+entries get compared.
+
+Files with identical attributes never conflict with each other, so the
+entries of a shared path are grouped by their attributes and the groups get
+compared instead of all pairs of packages.
+
+The shared paths can be checked by several processes, each one getting the
+paths of some directories.  The workers are forked, so they share the
+packages with the parent and only send back package numbers.
+"""
+
+import heapq
+from stat import S_ISLNK, S_ISDIR
+from hashlist import HashList
+import base, functions
+
+def getFileEntries(pkgs, first=0):
+    """Return the files of the RpmPackage's in list pkgs as a list of
+    (dirname, basename, package number, file index) sorted by path.
+
+    The packages are numbered starting with first."""
+
+    entries = [ ]
+    n = first
+    for pkg in pkgs:
+        if pkg.has_key("oldfilenames"):
+            files = pkg["oldfilenames"]
+            for i in xrange(len(files)):
+                j = files[i].rfind("/") + 1
+                entries.append((files[i][:j], files[i][j:], n, i))
+        elif pkg["basenames"]:
+            (basenames, dirnames, dirindexes) = (pkg["basenames"],
+                                                 pkg["dirnames"],
+                                                 pkg["dirindexes"])
+            entries.extend([(dirnames[dirindexes[i]], basenames[i], n, i)
+                            for i in xrange(len(basenames))])
+        n += 1
+    entries.sort()
+    return entries
+
+def mergeFileEntries(streams):
+    """Yield the entries of the sorted entry lists in list streams in sorted
+    order."""
+
+    if len(streams) == 1:
+        for entry in streams[0]:
+            yield entry
+        return
+    heap = [(stream[0], 0, stream) for stream in streams if stream]
+    heapq.heapify(heap)
+    while heap:
+        (entry, pos, stream) = heap[0]
+        pos += 1
+        if pos < len(stream):
+            heapq.heapreplace(heap, (stream[pos], pos, stream))
+        else:
+            heapq.heappop(heap)
+        yield entry
+
+def iterSharedFiles(streams):
+    """Yield (filename, [(package number, file index)]) for each path found
+    more than once in the sorted entry lists in list streams."""
+
+    (dirname, basename, shared) = (None, None, [ ])
+    for (d, b, n, i) in mergeFileEntries(streams):
+        if b == basename and d == dirname:
+            shared.append((n, i))
+            continue
+        if len(shared) > 1:
+            yield (dirname + basename, shared)
+        (dirname, basename, shared) = (d, b, [(n, i)])
+    if len(shared) > 1:
+        yield (dirname + basename, shared)
+
+def isMultilibFile(pkg1, rfi1, pkg2, rfi2):
+    """Return True if RpmFileInfo rfi1 of RpmPackage pkg1 and rfi2 of pkg2
+    are variants of the same file for different architectures, which may
+    be installed together."""
+
+    # do not check packages with the same NEVR which are
+    # not buildarchtranslate compatible
+    return pkg1.getNEVR() == pkg2.getNEVR() and \
+           base.buildarchtranslate[pkg1["arch"]] != \
+           base.buildarchtranslate[pkg2["arch"]] and \
+           pkg1["arch"] != "noarch" and \
+           pkg2["arch"] != "noarch" and \
+           rfi1.filecolor != rfi2.filecolor and \
+           rfi1.filecolor > 0 and rfi2.filecolor > 0
+
+def filesConflict(rfi1, rfi2):
+    """Return 1 if RpmFileInfo's rfi1 and rfi2 of the same path in different
+    packages conflict, 0 otherwise.  isMultilibFile() is not checked."""
+
+    # check if user and group are identical
+    if rfi1.uid != rfi2.uid and \
+           rfi1.gid != rfi2.gid:
+        return 1
+
+    # ignore directories
+    if S_ISDIR(rfi1.mode) and S_ISDIR(rfi2.mode):
+        return 0
+    # ignore links
+    if S_ISLNK(rfi1.mode) and S_ISLNK(rfi2.mode) and \
+           (rfi1.linkto == rfi2.linkto):
+        return 0
+
+    # ignore identical files
+    if rfi1.mode == rfi2.mode and \
+           rfi1.filesize == rfi2.filesize and \
+           rfi1.md5sum == rfi2.md5sum:
+        return 0
+
+    # ignore ghost files
+    if rfi1.flags & base.RPMFILE_GHOST or \
+           rfi2.flags & base.RPMFILE_GHOST:
+        return 0
+
+    return 1
+
+def checkFileInfo(pkg, rfi):
+    """Raise ValueError if RpmFileInfo rfi of RpmPackage pkg lacks data
+    needed for conflict checking."""
+
+    if not rfi.mode:
+        raise ValueError, \
+              "Package '%s': File mode is not set for file '%s'" % \
+              (pkg.getNEVRA(), rfi.filename)
+
+def addFileConflicts(filename, files, conflicts, new=None):
+    """Compare the files [(RpmPackage, RpmFileInfo)] sharing filename, add
+    conflicts to HashList conflicts: RpmPackage => [(filename, conflicting
+    RpmPackage)].
+
+    Only conflicts of packages in set new are added if new is not None.
+    Raise ValueError on invalid package data."""
+
+    groups = { }
+    keys = [ ]
+    for (pkg, rfi) in files:
+        checkFileInfo(pkg, rfi)
+        linkto = None
+        if S_ISLNK(rfi.mode):
+            linkto = rfi.linkto
+        key = (rfi.uid, rfi.gid, rfi.mode, rfi.filesize, rfi.md5sum, linkto,
+               rfi.flags & base.RPMFILE_GHOST)
+        if not groups.has_key(key):
+            groups[key] = [ ]
+            keys.append(key)
+        groups[key].append((pkg, rfi))
+    for j in xrange(len(keys)):
+        group1 = groups[keys[j]]
+        for k in xrange(j+1, len(keys)):
+            group2 = groups[keys[k]]
+            if not filesConflict(group1[0][1], group2[0][1]):
+                continue
+            for (pkg1, rfi1) in group1:
+                for (pkg2, rfi2) in group2:
+                    if pkg1 is pkg2 or \
+                           isMultilibFile(pkg1, rfi1, pkg2, rfi2):
+                        continue
+                    if new is None or pkg1 in new:
+                        conflicts.setdefault(pkg1, [ ]).append(
+                            (filename, pkg2))
+                    if new is None or pkg2 in new:
+                        conflicts.setdefault(pkg2, [ ]).append(
+                            (filename, pkg1))
+
+def addSharedFileConflicts(shared, conflicts, new=None, jobs=1):
+    """Check the paths in list shared: [(filename, [(RpmPackage, file index
+    or None)])] and add conflicts to HashList conflicts like
+    addFileConflicts().
+
+    Use up to jobs processes, the paths are distributed by the hash of their
+    dirname.  The conflicts are added in order of shared in any case.  Raise
+    ValueError on invalid package data, OSError if forking fails."""
+
+    if jobs <= 1 or len(shared) < 2:
+        for (filename, files) in shared:
+            files = [(pkg, pkg.getRpmFileInfoView(filename, i))
+                     for (pkg, i) in files]
+            addFileConflicts(filename, files, conflicts, new)
+        return
+    pkgs = [ ]
+    numbers = { } # RpmPackage => index in pkgs
+    shards = [[] for _ in xrange(jobs)] # [[index in shared]]
+    for pos in xrange(len(shared)):
+        (filename, files) = shared[pos]
+        for (pkg, i) in files:
+            if not numbers.has_key(pkg):
+                numbers[pkg] = len(pkgs)
+                pkgs.append(pkg)
+        shards[hash(filename[:filename.rfind("/")]) % jobs].append(pos)
+
+    def checkShard(shard):
+        # Return [(index in shared, [(package number, [conflicting package
+        # numbers])])]
+        result = [ ]
+        for pos in shard:
+            (filename, files) = shared[pos]
+            found = HashList()
+            addFileConflicts(filename,
+                             [(pkg, pkg.getRpmFileInfoView(filename, i))
+                              for (pkg, i) in files], found, new)
+            if len(found) > 0:
+                result.append((pos, [(numbers[pkg], [numbers[p] for (f, p)
+                                                     in found[pkg]])
+                                     for pkg in found]))
+        return result
+
+    results = [ ]
+    for result in functions.parallelMap(checkShard, shards, jobs):
+        results.extend(result)
+    results.sort()
+    for (pos, found) in results:
+        filename = shared[pos][0]
+        for (n, others) in found:
+            l = conflicts.setdefault(pkgs[n], [ ])
+            for m in others:
+                l.append((filename, pkgs[m]))
+
+def findFileConflicts(pkgsets, jobs=1):
+    """Find file conflicts among the RpmPackage's in the list of package
+    lists pkgsets, using up to jobs processes.
+
+    Return a HashList: RpmPackage => [(filename, conflicting RpmPackage)].
+    Raise ValueError on invalid package data, OSError if forking fails."""
+
+    pkgs = [ ]
+    streams = [ ]
+    for pkgset in pkgsets:
+        streams.append(getFileEntries(pkgset, len(pkgs)))
+        pkgs.extend(pkgset)
+    shared = [(filename, [(pkgs[n], i) for (n, i) in files])
+              for (filename, files) in iterSharedFiles(streams)]
+    del streams
+    conflicts = HashList()
+    addSharedFileConflicts(shared, conflicts, jobs=jobs)
+    return conflicts
+
+# vim:ts=4:sw=4:showmatch:expandtab
@@ -17,7 +17,9 @@
 #
 
 
-import fcntl, os, os.path, sys, resource, getopt, errno, signal, shutil
+import fcntl, os, os.path, sys, resource, getopt, errno, signal, shutil, re
+import fnmatch, random
+import cPickle, threading, Queue, traceback
 from types import TupleType
 from stat import S_ISREG, S_ISLNK, S_ISDIR, S_ISFIFO, S_ISCHR, S_ISBLK, S_IMODE, S_ISSOCK
 try:
@@ -141,8 +143,215 @@ def mkstemp_mknod(dirname, pre, mode, rdev):
             raise
     raise IOError, (errno.EEXIST, "No usable temporary file name found")
 
+# Redirections to /dev/null and "|| :" ignored when matching scriptlet commands
+_scriptnoise = re.compile(r"\s*(\d?>>?|&>|>&)\s*/dev/null|\s*\d>&\d|"
+                          r"\s*\|\|\s*(:|true|/bin/true)\s*$")
+_scriptspecial = re.compile(r"[;`$(){}<>&|\\]")
+
+def getCoalescableCommands(prog, script):
+    """Return the list of command lines of the scriptlet (script with
+    interpreter prog) if they all match rpmconfig.coalescescripts, None
+    otherwise."""
+
+    if isinstance(prog, TupleType):
+        args = list(prog)
+    else:
+        args = [prog]
+    if script is None:
+        lines = [" ".join(args)]
+    elif args == ["/bin/sh"]:
+        lines = script.split("\n")
+    else:
+        return None
+    commands = [ ]
+    for line in lines:
+        line = line.strip()
+        if not line or line[0] == "#":
+            continue
+        command = _scriptnoise.sub("", line)
+        if _scriptspecial.search(command):
+            return None
+        for pattern in rpmconfig.coalescescripts:
+            if fnmatch.fnmatchcase(command, pattern):
+                break
+        else:
+            return None
+        commands.append(line)
+    if not commands:
+        return None
+    return commands
+
+def runDelayedScripts(chroot=''):
+    """Run the scriptlet commands delayed by runScript(), if any.
+
+    Return (exit status, getrusage() stats, script output) like runScript().
+    Raise IOError, OSError."""
+
+    commands = rpmconfig.delayedscripts
+    if not commands:
+        return (0, None, "")
+    rpmconfig.delayedscripts = [ ]
+    if commands == ["/sbin/ldconfig"]:
+        # No shell needed, it might not be installed yet
+        return runScript("/sbin/ldconfig", chroot=chroot)
+    return runScript("/bin/sh", "\n".join(commands) + "\n", chroot=chroot)
+
+def _scriptEnvironment(prefixes=None):
+    """Return the environment for scriptlets with the install prefixes in
+    list prefixes."""
+
+    # FIXME: what about PATH=%{_install_script_path}?
+    e = {"HOME": "/", "USER": "root", "LOGNAME": "root",
+         "PATH": "/sbin:/bin:/usr/sbin:/usr/bin:/usr/X11R6/bin",
+         "PYRPM_VERSION" : __version__}
+    if prefixes:
+        e["RPM_INSTALL_PREFIX"] = prefixes[0]
+        idx = 1
+        for prefix in prefixes:
+            e["RPM_INSTALL_PREFIX%d" % idx] = prefix
+            idx += 1
+    return e
+
+def _prepareScriptRoot():
+    """Make sure /dev/null exists for scriptlets, in the child process after
+    chroot()."""
+
+    if not os.path.exists("/dev"):
+        os.mkdir("/dev")
+    if not os.path.exists("/dev/null"):
+        os.mknod("/dev/null", 0666, 259)
+
+def shellQuote(value):
+    """Return string value quoted for /bin/sh."""
+
+    return "'" + value.replace("'", "'\\''") + "'"
+
+class ScriptShell:
+    """A /bin/sh running in a chroot, which runs shell scriptlets in
+    subshells instead of starting a new shell for each one.
+
+    The scriptlets are sourced from their temporary file in a subshell with
+    their arguments, install prefixes and umask and with stdin from
+    /dev/null.  After the output of each scriptlet the shell prints the
+    times of its children and a line with a random marker and the exit
+    status."""
+
+    def __init__(self, chroot=''):
+        """Start /bin/sh in chroot.
+
+        Raise OSError."""
+
+        self.chroot = chroot
+        self.marker = "PYRPM-%d-%d" % (os.getpid(),
+                                       random.randint(0, 0x3fffffff))
+        self.times = (0.0, 0.0)  # (user, system) times of children
+        (inrfd, self.wfd) = os.pipe()
+        (self.rfd, outwfd) = os.pipe()
+        for fd in (self.wfd, self.rfd):
+            fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+        self.pid = os.fork()
+        if self.pid == 0:
+            try:
+                if chroot:
+                    os.chroot(chroot)
+                _prepareScriptRoot()
+                os.dup2(inrfd, 0)
+                os.dup2(outwfd, 1)
+                os.dup2(1, 2)
+                for fd in (inrfd, outwfd):
+                    if fd > 2:
+                        os.close(fd)
+                os.chdir("/")
+                os.execve("/bin/sh", ["/bin/sh"], _scriptEnvironment())
+            finally:
+                os._exit(255)
+        os.close(inrfd)
+        os.close(outwfd)
+
+    def run(self, filename, otherargs=[], prefixes=None):
+        """Run the shell script filename (a path in the chroot) with
+        arguments otherargs and install prefixes in list prefixes.
+
+        Return (exit status, [user time, system time], script output) like
+        runScript(), the times are None if the shell does not report them.
+        Raise IOError if the shell has died, OSError."""
+
+        umask = os.umask(022)
+        os.umask(umask)
+        cmd = [ "umask %03o" % umask ]
+        env = _scriptEnvironment(prefixes)
+        for key in env.keys():
+            if key.startswith("RPM_INSTALL_PREFIX"):
+                cmd.append("%s=%s; export %s" % (key, shellQuote(env[key]),
+                                                 key))
+        cmd.append("set -- %s" % " ".join([shellQuote(str(arg))
+                                          for arg in otherargs]))
+        cmd.append(". %s" % shellQuote(filename))
+        cmd = "(%s) </dev/null 2>&1\ns=$?\necho\ntimes\necho %s $s\n" % \
+              ("\n".join(cmd), self.marker)
+        try:
+            while cmd:
+                cmd = cmd[os.write(self.wfd, cmd):]
+        except OSError, e:
+            if e.errno == errno.EPIPE:
+                raise IOError, (e.errno, "Scriptlet shell has died")
+            raise
+        end = "\n%s " % self.marker
+        data = ""
+        while not data.endswith("\n") or data.rfind(end) == -1:
+            chunk = os.read(self.rfd, 65536)
+            if not chunk:
+                raise IOError, (errno.EPIPE, "Scriptlet shell has died")
+            data += chunk
+        pos = data.rfind(end)
+        status = int(data[pos + len(end):-1]) << 8
+        # output, empty line and two lines of times
+        pos2 = data.rfind("\n", 0, pos)
+        pos1 = data.rfind("\n", 0, pos2)
+        times = re.findall(r"(\d+)m([\d.]+)s", data[pos2:pos])
+        output = data[:pos1]
+        if len(times) != 2:
+            return (status, None, output)
+        times = (int(times[0][0]) * 60 + float(times[0][1]),
+                 int(times[1][0]) * 60 + float(times[1][1]))
+        rusage = [ times[0] - self.times[0], times[1] - self.times[1] ]
+        self.times = times
+        return (status, rusage, output)
+
+    def close(self):
+        """Stop the shell."""
+
+        try:
+            os.write(self.wfd, "exit 0\n")
+        except OSError:
+            pass
+        os.close(self.wfd)
+        os.close(self.rfd)
+        os.waitpid(self.pid, 0)
+
+_scriptshells = { } # chroot => ScriptShell
+
+def getScriptShell(chroot=''):
+    """Return the ScriptShell for chroot, starting it if necessary, or None
+    if chroot contains no /bin/sh.
+
+    Raise OSError."""
+
+    if not _scriptshells.has_key(chroot):
+        if not os.path.exists(chroot + "/bin/sh"):
+            return None
+        _scriptshells[chroot] = ScriptShell(chroot)
+    return _scriptshells[chroot]
+
+def closeScriptShells():
+    """Stop all ScriptShell's started by runScript()."""
+
+    for shell in _scriptshells.values():
+        shell.close()
+    _scriptshells.clear()
+
 def runScript(prog=None, script=None, otherargs=[], force=False, rusage=False,
-              tmpdir="/var/tmp", chroot='', prefixes=None):
+              tmpdir="/var/tmp", chroot='', prefixes=None, delay=False):
     """Run (script otherargs) with interpreter prog (which can be a list
     containing initial arguments).
 
@@ -150,7 +359,17 @@ def runScript(prog=None, script=None, otherargs=[], force=False, rusage=False,
     The following env. variables are defined: RPM_INSTALL_PREFIX.
 
     Return (exit status, getrusage() stats, script output).  Use None instead
-    of getrusage() data if !rusage.  Disable ldconfig optimization if force.
+    of getrusage() data if !rusage.
+
+    If delay and not force, scriptlets consisting only of commands matching
+    rpmconfig.coalescescripts are not run but added to
+    rpmconfig.delayedscripts, which are run before the next other scriptlet.
+    runDelayedScripts() has to be called after the last scriptlet.  Only
+    delay scriptlets which may run after the following ones, like %post.
+
+    If rpmconfig.scriptshell, /bin/sh scripts are run by a ScriptShell per
+    chroot, unless SELinux contexts have to be set for them.
+    closeScriptShells() has to be called after the last scriptlet then.
     Raise IOError, OSError."""
 
     if chroot is None:
@@ -174,16 +393,21 @@ def runScript(prog=None, script=None, otherargs=[], force=False, rusage=False,
         args = prog
     else:
         args = [prog]
-    if not force and args == ["/sbin/ldconfig"] and script == None:
-        if rpmconfig.delayldconfig == 1:
-            rpmconfig.ldconfig += 1
-        # FIXME: assumes delayldconfig is checked after all runScript
-        # invocations
-        rpmconfig.delayldconfig = 1
-        return (0, None, "")
-    elif rpmconfig.delayldconfig:
-        rpmconfig.delayldconfig = 0
-        runScript("/sbin/ldconfig", force=1, chroot=chroot)
+    if delay and not force:
+        commands = getCoalescableCommands(prog, script)
+        if commands is not None:
+            if rpmconfig.delayedscripts:
+                # Runs with the delayed commands
+                rpmconfig.coalesced += 1
+            for command in commands:
+                # The order of the commands doesn't matter, run each once
+                # after the last files it uses are installed
+                if command in rpmconfig.delayedscripts:
+                    rpmconfig.delayedscripts.remove(command)
+                rpmconfig.delayedscripts.append(command)
+            return (0, None, "")
+    if rpmconfig.delayedscripts:
+        runDelayedScripts(chroot)
     if script != None:
         (fd, tmpfilename) = mkstemp_file(tdir, "rpm-tmp.")
         # test for open fds:
@@ -193,6 +417,23 @@ def runScript(prog=None, script=None, otherargs=[], force=False, rusage=False,
         fd = None
         args.append(tmpfilename[len(chroot):])
         args += otherargs
+        if rpmconfig.scriptshell and args[0] == "/bin/sh" and \
+               not (rpmconfig.selinux_enabled and
+                    se_linux.is_selinux_enabled()):
+            shell = getScriptShell(chroot)
+            if shell is not None:
+                try:
+                    (status, rusage_val, cret) = shell.run(
+                        tmpfilename[len(chroot):], otherargs, prefixes)
+                except IOError:
+                    # Start a new shell next time, run this script alone
+                    shell.close()
+                    del _scriptshells[chroot]
+                else:
+                    os.unlink(tmpfilename)
+                    if not rusage:
+                        rusage_val = None
+                    return (status, rusage_val, cret)
     (rfd, wfd) = os.pipe()
 
     if rusage:
@@ -204,10 +445,7 @@ def runScript(prog=None, script=None, otherargs=[], force=False, rusage=False,
             if chroot:
                 os.chroot(chroot)
             os.close(rfd)
-            if not os.path.exists("/dev"):
-                os.mkdir("/dev")
-            if not os.path.exists("/dev/null"):
-                os.mknod("/dev/null", 0666, 259)
+            _prepareScriptRoot()
             fd = os.open("/dev/null", os.O_RDONLY)
             if fd != 0:
                 os.dup2(fd, 0)
@@ -217,16 +455,7 @@ def runScript(prog=None, script=None, otherargs=[], force=False, rusage=False,
                 os.close(wfd)
             os.dup2(1, 2)
             os.chdir("/")
-            # FIXME: what about PATH=%{_install_script_path}?
-            e = {"HOME": "/", "USER": "root", "LOGNAME": "root",
-                 "PATH": "/sbin:/bin:/usr/sbin:/usr/bin:/usr/X11R6/bin",
-                 "PYRPM_VERSION" : __version__}
-            if prefixes:
-                e["RPM_INSTALL_PREFIX"] = prefixes[0]
-                idx = 1
-                for prefix in prefixes:
-                    e["RPM_INSTALL_PREFIX%d" % idx] = prefix
-                    idx += 1
+            e = _scriptEnvironment(prefixes)
             if rpmconfig.selinux_enabled and se_linux.is_selinux_enabled():
                 _env = [ "%s=%s" % (key, e[key]) for key in e.keys() ]
                 se_linux.rpm_execcon(0, args[0], args, _env)
@@ -288,12 +517,14 @@ def brRealPath(prefix, filename):
     return prefix + filename
             
 def installFile(rfi, infd, size, useAttrs=True, pathPrefix=None,
-                useSEcontext=True):
+                useSEcontext=True, writer=None):
     """Install a file described by RpmFileInfo rfi, with input of given size
     from CPIOFile infd.
 
     infd can be None if size == 0.  Ignore file attributes in rfi if useAttrs
-    is False.  Prefix filenames by pathPrefix if defined.  Raise ValueError on
+    is False.  Prefix filenames by pathPrefix if defined.  If writer is not
+    None, the data of regular files up to writer.MAXSIZE bytes is read and
+    the files are written by FileWriter writer later.  Raise ValueError on
     invalid mode, IOError, OSError."""
 
     filename = rfi.filename
@@ -302,25 +533,25 @@ def installFile(rfi, infd, size, useAttrs=True, pathPrefix=None,
     mode = rfi.mode
     if S_ISREG(mode):
         makeDirs(filename)
-        (fd, tmpfilename) = mkstemp_file(os.path.dirname(filename), tmpprefix)
-        try:
-            try:
-                data = "1"
-                while size > 0 and data:
-                    data = infd.read(65536)
-                    if data:
-                        size -= len(data)
-                        os.write(fd, data)
-            finally:
-                os.close(fd)
-            if useAttrs:
-                _setFileAttrs(tmpfilename, rfi)
-            if useSEcontext:
-                _setSEcontext(tmpfilename, rfi)
-        except (IOError, OSError):
-            os.unlink(tmpfilename)
-            raise
-        os.rename(tmpfilename, filename)
+        chunks = [ ]
+        if writer is not None and size <= writer.MAXSIZE:
+            while size > 0:
+                data = infd.readBuffer(size)
+                if not data:
+                    raise IOError, "Unexpected EOF from CPIO archive"
+                size -= len(data)
+                chunks.append(data)
+            writer.add(filename, rfi, chunks, useAttrs, useSEcontext)
+            return
+        def write(fd):
+            left = size
+            while left > 0:
+                data = infd.readBuffer(min(left, 1048576))
+                if not data:
+                    raise IOError, "Unexpected EOF from CPIO archive"
+                left -= len(data)
+                os.write(fd, data)
+        _installRegFile(filename, rfi, write, useAttrs, useSEcontext)
     elif S_ISDIR(mode):
         if not os.path.isdir(filename):
             os.makedirs(filename)
@@ -402,6 +633,107 @@ def installFile(rfi, infd, size, useAttrs=True, pathPrefix=None,
     else:
         raise ValueError, "%s: not a valid filetype" % (oct(mode))
 
+def _installRegFile(filename, rfi, write, useAttrs, useSEcontext):
+    """Install regular file filename described by RpmFileInfo rfi, with data
+    written by write(file descriptor).
+
+    Ignore file attributes in rfi if useAttrs is False.  Raise IOError,
+    OSError."""
+
+    (fd, tmpfilename) = mkstemp_file(os.path.dirname(filename), tmpprefix)
+    try:
+        try:
+            write(fd)
+        finally:
+            os.close(fd)
+        if useAttrs:
+            _setFileAttrs(tmpfilename, rfi)
+        if useSEcontext:
+            _setSEcontext(tmpfilename, rfi)
+    except:
+        os.unlink(tmpfilename)
+        raise
+    os.rename(tmpfilename, filename)
+
+class FileWriter:
+    """Write regular files of a package in background threads, while the
+    payload is decompressed by the installing thread."""
+
+    # Largest file written in the background, larger ones are written by
+    # installFile() directly
+    MAXSIZE = 1048576
+    # Number of files queued per thread
+    QUEUE = 16
+
+    def __init__(self, jobs):
+        """Start jobs threads."""
+
+        self.queue = Queue.Queue(jobs * self.QUEUE)
+        self.error = None       # sys.exc_info() of the first failed write
+        self.lock = threading.Lock()
+        self.threads = [ threading.Thread(target=self.__worker)
+                         for _ in xrange(jobs) ]
+        for thread in self.threads:
+            # Don't keep the interpreter alive if close() is never called
+            thread.setDaemon(True)
+            thread.start()
+
+    def add(self, filename, rfi, chunks, useAttrs, useSEcontext):
+        """Queue writing the strings or buffer objects in list chunks to
+        regular file filename described by RpmFileInfo rfi, like installFile()
+        does.
+
+        Raise the exception of a previous write, if any."""
+
+        self.__raiseError()
+        self.queue.put((filename, rfi, chunks, useAttrs, useSEcontext))
+
+    def wait(self):
+        """Wait until all queued files are written and stop the threads.
+
+        Raise the exception of the first failed write, if any."""
+
+        self.close()
+        self.__raiseError()
+
+    def close(self):
+        """Wait until all queued files are written and stop the threads."""
+
+        if not self.threads:
+            return
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = [ ]
+
+    def __raiseError(self):
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+
+    def __worker(self):
+        """Write queued files until None is dequeued."""
+
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                # Discard the rest after an error
+                continue
+            (filename, rfi, chunks, useAttrs, useSEcontext) = item
+            def write(fd):
+                for data in chunks:
+                    os.write(fd, data)
+            try:
+                _installRegFile(filename, rfi, write, useAttrs, useSEcontext)
+            except:
+                # Any exception, the thread has to keep draining the queue
+                self.lock.acquire()
+                if self.error is None:
+                    self.error = sys.exc_info()
+                self.lock.release()
+
 def _setFileAttrs(filename, rfi):
     """Set owner, group, mode and mtime of filename data from RpmFileInfo rfi.
 
@@ -796,7 +1128,9 @@ def parseYumOptions(argv, yum):
          "installpkgs=", "arch=", "archlist=", "checkinstalled", "rusage",
          "srpmdir=", "enablerepo=", "disablerepo=", "nocache", "cachedir=",
          "exclude=", "obsoletes", "noplugins", "diff", "verifyallconfig",
-         "languages=", "releaseversion=", "disablerhn"])
+         "languages=", "releaseversion=", "disablerhn", "verifyjobs=",
+         "pipeline=", "rpmdbcache", "fileconflictjobs=", "extractjobs=",
+         "rpmdbbatch=", "scriptshell"])
     except getopt.error, e:
         # FIXME: all to stderr
         log.error("Error parsing command-line arguments: %s", e)
@@ -881,6 +1215,36 @@ def parseYumOptions(argv, yum):
             rpmconfig.nodeps = 1
         elif opt == "--signature":
             rpmconfig.nosignature = 0
+        elif opt == "--pipeline":
+            try:
+                rpmconfig.pipelinewindow = int(val)
+            except ValueError:
+                log.error("Invalid number of packages: %s", val)
+                return None
+        elif opt == "--verifyjobs":
+            try:
+                rpmconfig.verifyjobs = int(val)
+            except ValueError:
+                log.error("Invalid number of processes: %s", val)
+                return None
+        elif opt == "--fileconflictjobs":
+            try:
+                rpmconfig.fileconflictjobs = int(val)
+            except ValueError:
+                log.error("Invalid number of processes: %s", val)
+                return None
+        elif opt == "--rpmdbbatch":
+            try:
+                rpmconfig.rpmdbbatch = int(val)
+            except ValueError:
+                log.error("Invalid number of packages: %s", val)
+                return None
+        elif opt == "--extractjobs":
+            try:
+                rpmconfig.extractjobs = int(val)
+            except ValueError:
+                log.error("Invalid number of threads: %s", val)
+                return None
         elif opt == "--noorder":
             rpmconfig.noorder = 1
         elif opt == "--noscripts":
@@ -909,6 +1273,10 @@ def parseYumOptions(argv, yum):
             rpmconfig.nocache = 1
         elif opt == "--cachedir":
             rpmconfig.cachedir = val
+        elif opt == "--rpmdbcache":
+            rpmconfig.rpmdbcache = 1
+        elif opt == "--scriptshell":
+            rpmconfig.scriptshell = 1
         elif opt == "--exclude":
             rpmconfig.excludes.append(val)
         elif opt == "--obsoletes":
@@ -1055,6 +1423,45 @@ def _xisalnum(chr):
     return (chr >= 'a' and chr <= 'z') or (chr >= 'A' and chr <= 'Z') \
         or (chr >= '0' and chr <= '9')
 
+# Version strings are split into their alpha and numeric segments only once,
+# the resulting keys are cached in __versionkeys__.  The cache is flushed
+# if it grows beyond VERSIONKEY_CACHE_SIZE entries.
+VERSIONKEY_CACHE_SIZE = 65536
+__versionkeys__ = {}
+__versionsegments__ = re.compile("[0-9]+|[a-zA-Z]+")
+
+def versionKey(version):
+    """Return a tuple for version string version, which compares like version
+    in stringCompare().
+
+    Numeric segments are represented as (1, value), alpha segments as
+    (0, segment) and trailing separators as (-1,).  The keys are cached."""
+
+    try:
+        return __versionkeys__[version]
+    except KeyError:
+        pass
+    key = [ ]
+    end = 0
+    for match in __versionsegments__.finditer(version):
+        segment = match.group()
+        if _xisdigit(segment[0]):
+            key.append((1, int(segment)))
+        else:
+            try:
+                segment = intern(segment)
+            except TypeError: # unicode
+                pass
+            key.append((0, segment))
+        end = match.end()
+    if end < len(version):
+        key.append((-1,))
+    key = tuple(key)
+    if len(__versionkeys__) >= VERSIONKEY_CACHE_SIZE:
+        __versionkeys__.clear()
+    __versionkeys__[version] = key
+    return key
+
 # compare two strings
 def stringCompare(str1, str2):
     """Compare version strings str1, str2 like rpm does.
@@ -1064,62 +1471,7 @@ def stringCompare(str1, str2):
 
     if str1 == str2:
         return 0
-    lenstr1 = len(str1)
-    lenstr2 = len(str2)
-    i1 = 0
-    i2 = 0
-    while i1 < lenstr1 and i2 < lenstr2:
-        # remove leading separators
-        while i1 < lenstr1 and not _xisalnum(str1[i1]):
-            i1 += 1
-        while i2 < lenstr2 and not _xisalnum(str2[i2]):
-            i2 += 1
-        if i1 == lenstr1 or i2 == lenstr2: # bz 178798
-            break
-        # start of the comparison data, search digits or alpha chars
-        j1 = i1
-        j2 = i2
-        if j1 < lenstr1 and _xisdigit(str1[j1]):
-            while j1 < lenstr1 and _xisdigit(str1[j1]):
-                j1 += 1
-            while j2 < lenstr2 and _xisdigit(str2[j2]):
-                j2 += 1
-            isnum = 1
-        else:
-            while j1 < lenstr1 and _xisalpha(str1[j1]):
-                j1 += 1
-            while j2 < lenstr2 and _xisalpha(str2[j2]):
-                j2 += 1
-            isnum = 0
-        # check if we already hit the end
-        if j1 == i1:
-            return -1
-        if j2 == i2:
-            if isnum:
-                return 1
-            return -1
-        if isnum:
-            # ignore leading "0" for numbers (1 == 000001)
-            while i1 < j1 and str1[i1] == "0":
-                i1 += 1
-            while i2 < j2 and str2[i2] == "0":
-                i2 += 1
-            # longer size of digits wins
-            if j1 - i1 > j2 - i2:
-                return 1
-            if j2 - i2 > j1 - i1:
-                return -1
-        x = cmp(str1[i1:j1], str2[i2:j2])
-        if x:
-            return x
-        # move to next comparison start
-        i1 = j1
-        i2 = j2
-    if i1 == lenstr1:
-        if i2 == lenstr2:
-            return 0
-        return -1
-    return 1
+    return cmp(versionKey(str1), versionKey(str2))
 
 def labelCompare(e1, e2):
     """Compare (E, V, R) tuples e1 and e2.
@@ -1127,14 +1479,19 @@ def labelCompare(e1, e2):
     Return an integer with the same sign as (e1 - e2).  If either of the tuples
     has empty release, ignore releases in comparison."""
 
-    r = stringCompare(e1[0], e2[0])
-    if r == 0:
-        r = stringCompare(e1[1], e2[1])
-        if r == 0:
-            if e1[2] == "" or e2[2] == "": # no release
-                return 0
-            r = stringCompare(e1[2], e2[2])
-    return r
+    if e1[0] != e2[0]:
+        r = cmp(versionKey(e1[0]), versionKey(e2[0]))
+        if r:
+            return r
+    if e1[1] != e2[1]:
+        r = cmp(versionKey(e1[1]), versionKey(e2[1]))
+        if r:
+            return r
+    if e1[2] == "" or e2[2] == "": # no release
+        return 0
+    if e1[2] == e2[2]:
+        return 0
+    return cmp(versionKey(e1[2]), versionKey(e2[2]))
 
 def pkgCompare(p1, p2):
     """Compare EVR of RpmPackage's p1 and p2.
@@ -1266,6 +1623,104 @@ def machineDistance(arch1, arch2):
     else:
         return 999   # incompatible archs, distance is very high ;)
 
+def numCPUs():
+    """Return the number of online processors, 1 if unknown."""
+
+    try:
+        return max(int(os.sysconf("SC_NPROCESSORS_ONLN")), 1)
+    except (AttributeError, ValueError, OSError):
+        return 1
+
+def parallelMap(func, items, jobs, check=None):
+    """Return [func(item) for item in items], computed by up to jobs forked
+    processes.
+
+    func is called in the child processes, so it can't modify any state of
+    the caller and its return value has to be picklable.  Items are
+    distributed round robin to the processes.  If check is defined,
+    check(result) is called for the results in order of items; if it returns
+    False, the remaining processes are killed and the results up to and
+    including this one are returned.  Exceptions raised by func are logged
+    with their traceback and reraised.  Raise OSError if forking fails."""
+
+    jobs = min(jobs, len(items))
+    if jobs <= 1:
+        results = [ ]
+        for item in items:
+            results.append(func(item))
+            if check is not None and not check(results[-1]):
+                break
+        return results
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pids = [ ]
+    pipes = [ ]
+    try:
+        for job in xrange(jobs):
+            (rfd, wfd) = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    try:
+                        os.close(rfd)
+                        for fd in pipes:
+                            fd.close()
+                        out = os.fdopen(wfd, "w")
+                        for i in xrange(job, len(items), jobs):
+                            try:
+                                result = (0, func(items[i]), None)
+                            except Exception, e:
+                                # The traceback can't be pickled
+                                result = (1, e, "".join(
+                                    traceback.format_exception(
+                                        *sys.exc_info())))
+                            try:
+                                cPickle.dump(result, out, 2)
+                            except (cPickle.PicklingError, TypeError), e:
+                                if result[0]:
+                                    # Keep the type of the exception
+                                    e = ValueError("%s: %s" % (
+                                        result[1].__class__.__name__,
+                                        result[1]))
+                                else:
+                                    e = ValueError("Can't pickle result: %s"
+                                                   % e)
+                                cPickle.dump((1, e, result[2] or ""), out, 2)
+                            out.flush()
+                        out.close()
+                        sys.stdout.flush()
+                        sys.stderr.flush()
+                    except:
+                        pass
+                finally:
+                    os._exit(0)
+            os.close(wfd)
+            pids.append(pid)
+            pipes.append(os.fdopen(rfd, "r"))
+        results = [ ]
+        for i in xrange(len(items)):
+            try:
+                (failed, result, tb) = cPickle.load(pipes[i % jobs])
+            except EOFError:
+                raise OSError, "Worker process died unexpectedly"
+            if failed:
+                if tb:
+                    log.error("Error in worker process:\n%s", tb.rstrip())
+                raise result
+            results.append(result)
+            if check is not None and not check(result):
+                break
+        return results
+    finally:
+        for fd in pipes:
+            fd.close()
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+            os.waitpid(pid, 0)
+
 def readRpmPackage(config, source, verify=None, hdronly=None,
                    db=None, tags=None):
     """Read RPM package from source and close it.
@@ -1340,6 +1795,14 @@ def pathdirname(filename):
     #return pathsplit(filename)[0]
     #return os.path.dirname(filename)
 
+def internName(name):
+    """Return the interned copy of str name, unicode names are returned
+    unchanged."""
+    try:
+        return intern(name)
+    except TypeError:
+        return name
+
 def pathsplit2(filename):
     i = filename.rfind("/") + 1
     return (filename[:i], filename[i:])
@@ -17,7 +17,7 @@
 #
 
 
-import fcntl, os, sys, struct, zlib, time
+import fcntl, os, sys, struct, zlib, time, mmap, stat
 import __builtin__
 (pack, unpack) = (struct.pack, struct.unpack)
 
@@ -500,12 +500,129 @@ class PyLZMA(PyGZIP):
     def _read_gzip_header(self, ignore):
         pass
 
+class PayloadFile:
+    """Read-only file object for a gzip or xz compressed payload.
+
+    The compressed data is read in large chunks and decompressed into one
+    string.  read() returns slices of it, readBuffer() buffer objects
+    referencing it without copying the data."""
+
+    # Bytes of compressed data read at once
+    CHUNK = 262144
+    # Bytes of gzip data decompressed at once
+    OUTPUT = 1048576
+
+    MAGIC = { "gzip" : "\037\213", "xz" : "\3757zXZ\000" }
+
+    def __init__(self, fileobj, compressor="gzip"):
+        if compressor != "xz":
+            compressor = "gzip"
+        self.fileobj = fileobj
+        self.compressor = compressor
+        self.decompobj = None   # None before the first and between members
+        self.input = ""         # Compressed data not decompressed yet
+        self.data = ""          # Decompressed data
+        self.pos = 0            # Position of the next read in self.data
+        self.eof = False        # No more decompressed data after self.data
+
+    def newdecompobj(self):
+        if self.compressor == "xz":
+            import lzma
+            return lzma.LZMADecompressor()
+        # zlib checks gzip header, CRC and length itself
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def _decompress(self):
+        """Return data decompressed from the start of self.input.
+
+        Concatenated members are decompressed as well, anything else after a
+        member is ignored like PyGZIP does.  Raise IOError."""
+
+        if self.decompobj is None:
+            magic = self.MAGIC[self.compressor]
+            if len(self.input) < len(magic):
+                self.input += self.fileobj.read(len(magic) - len(self.input))
+            if self.input[:len(magic)] != magic:
+                self.eof = True
+                self.input = ""
+                return ""
+            self.decompobj = self.newdecompobj()
+        try:
+            if self.compressor == "gzip":
+                data = self.decompobj.decompress(self.input, self.OUTPUT)
+                self.input = self.decompobj.unconsumed_tail
+            else:
+                data = self.decompobj.decompress(self.input)
+                self.input = ""
+        except Exception, e:
+            # zlib.error, lzma.error or lzma.LZMAError
+            raise IOError, "Invalid compressed payload: %s" % e
+        if self.decompobj.unused_data:
+            self.input = self.decompobj.unused_data
+            self.decompobj = None
+        return data
+
+    def _fill(self, size):
+        """Decompress until size bytes after self.pos are available, all data
+        if size < 0, or EOF.
+
+        Raise IOError."""
+
+        chunks = [ self.data[self.pos:] ]
+        avail = len(chunks[0])
+        while (size < 0 or avail < size) and not self.eof:
+            if not self.input:
+                self.input = self.fileobj.read(self.CHUNK)
+                if not self.input:
+                    self.eof = True
+                    break
+            data = self._decompress()
+            chunks.append(data)
+            avail += len(data)
+        self.data = "".join(chunks)
+        self.pos = 0
+
+    def read(self, size=-1):
+        """Return up to size bytes of decompressed data, less only at EOF.
+
+        Raise IOError."""
+
+        if size < 0 or len(self.data) - self.pos < size:
+            self._fill(size)
+        if size < 0:
+            size = len(self.data) - self.pos
+        data = self.data[self.pos:self.pos + size]
+        self.pos += len(data)
+        return data
+
+    def readBuffer(self, size):
+        """Return a buffer object with up to size bytes of decompressed data,
+        which may be less before EOF as well.
+
+        Raise IOError."""
+
+        if self.pos >= len(self.data):
+            self._fill(1)
+        size = min(size, len(self.data) - self.pos)
+        data = buffer(self.data, self.pos, size)
+        self.pos += size
+        return data
+
+    def close(self):
+        self.fileobj = None
+        self.decompobj = None
+        self.input = ""
+        self.data = ""
+        self.pos = 0
+
 class CPIOFile:
     """ Read ASCII CPIO files. """
     def __init__(self, fd):
         self.fd = fd                    # filedescriptor
         self.lastfilesize = 0           # Length of "current" file data
         self.readsize = 0       # Number of bytes read from "current" file data
+        # fd.readBuffer if fd supports it
+        self._readBuffer = getattr(fd, "readBuffer", None)
 
     def getNextEntry(self):
         """Read next header and contents, return (file name, file data length),
@@ -515,18 +632,19 @@ class CPIOFile:
 
         self.readsize = 0
         # Do padding if necessary for nexty entry
-        functions.readExact(self.fd, (4 - (self.lastfilesize % 4)) % 4)
+        pad = (4 - (self.lastfilesize % 4)) % 4
         # The cpio header contains 8 byte hex numbers with the following
         # content: magic, inode, mode, uid, gid, nlink, mtime, filesize,
         # devMajor, devMinor, rdevMajor, rdevMinor, namesize, checksum.
-        data = functions.readExact(self.fd, 110)
+        data = functions.readExact(self.fd, pad + 110)[pad:]
         # CPIO ASCII hex, expanded device numbers (070702 with CRC)
         if data[0:6] not in ["070701", "070702"]:
             raise IOError, "Bad magic reading CPIO headers %s" % data[0:6]
         # Read filename and padding.
         filenamesize = int(data[94:102], 16)
-        filename = functions.readExact(self.fd, filenamesize).rstrip("\x00")
-        functions.readExact(self.fd, (4 - ((110 + filenamesize) % 4)) % 4)
+        pad = (4 - ((110 + filenamesize) % 4)) % 4
+        filename = functions.readExact(self.fd, filenamesize + pad)
+        filename = filename[:filenamesize].rstrip("\x00")
         if filename == "TRAILER!!!": # end of archive detection
             return (None, None)
         # Adjust filename, so that it matches the way the rpm header has
@@ -552,6 +670,23 @@ class CPIOFile:
         self.readsize += size
         return functions.readExact(self.fd, size)
 
+    def readBuffer(self, size):
+        """Return up to size bytes of file data as a string or buffer object.
+
+        Less data than available may be returned, no data only at EOF of the
+        archive.  Raise IOError."""
+
+        if size > self.lastfilesize - self.readsize:
+            size = self.lastfilesize - self.readsize
+        if size <= 0:
+            return ""
+        if self._readBuffer is None:
+            data = self.fd.read(size)
+        else:
+            data = self._readBuffer(size)
+        self.readsize += len(data)
+        return data
+
     def skipToNextFile(self):
         """Skip current file data.
 
@@ -559,7 +694,7 @@ class CPIOFile:
         size = self.lastfilesize - self.readsize
         data = "1"
         while size > 0 and data:
-            data = self.read(min(size, 65536))
+            data = self.readBuffer(min(size, 1048576))
             size -= len(data)
         if size > 0:
             raise IOError, "Unexpected EOF from CPIO archive"
@@ -627,6 +762,9 @@ class RpmIO:
         raise NotImplementedError
 
 class RpmStreamIO(RpmIO):
+    # Decompress the payload with PayloadFile instead of PyGZIP or PyLZMA
+    FASTPAYLOAD = True
+
     def __init__(self, source, hdronly=None):
         RpmIO.__init__(self, source)
         self.fd = None
@@ -691,7 +829,9 @@ class RpmStreamIO(RpmIO):
                 pos = self._tell()
                 self.hdrdata = None
                 self.hdr = {}
-                if self.payloadcompressor == "xz":
+                if self.FASTPAYLOAD:
+                    cpiofd = PayloadFile(self.fd, self.payloadcompressor)
+                elif self.payloadcompressor == "xz":
                     cpiofd = PyLZMA(fileobj=self.fd)
                 else:
                     cpiofd = PyGZIP(fileobj=self.fd)
@@ -769,7 +909,7 @@ class RpmStreamIO(RpmIO):
         IOError."""
 
         self.hdr = {}
-        self.hdrdata = self.__readIndex(8)
+        self.hdrdata = self._readIndex(8)
 
     def __readHdr(self):
         """Read main header.
@@ -778,7 +918,7 @@ class RpmStreamIO(RpmIO):
         IOError."""
 
         self.hdr = {}
-        self.hdrdata = self.__readIndex(1)
+        self.hdrdata = self._readIndex(1)
 
     def getHeaderByIndex(self, idx, indexdata, storedata):
         """Parse value of tag idx.
@@ -789,10 +929,10 @@ class RpmStreamIO(RpmIO):
         tag = index[0]
         # ignore duplicate entries as long as they are identical
         if self.hdr.has_key(tag):
-            if self.hdr[tag] != self.__parseTag(index, storedata):
+            if self.hdr[tag] != self._parseTag(index, storedata):
                 log.error("%s: tag %d included twice", self.source, tag)
         else:
-            self.hdr[tag] = self.__parseTag(index, storedata)
+            self.hdr[tag] = self._parseTag(index, storedata)
         return (tag, self.hdr[tag])
 
     def getIndexData(self, idx, indexdata):
@@ -802,13 +942,13 @@ class RpmStreamIO(RpmIO):
         tag = index[0]
         # ignore duplicate entries as long as they are identical
         if self.hdr.has_key(tag):
-            if self.hdr[tag] != self.__parseTag(index, storedata):
+            if self.hdr[tag] != self._parseTag(index, storedata):
                 log.error("%s: tag %d included twice", self.source, tag)
         else:
-            self.hdr[tag] = self.__parseTag(index, storedata)
+            self.hdr[tag] = self._parseTag(index, storedata)
         return self.hdr[tag]
 
-    def __readIndex(self, pad):
+    def _readIndex(self, pad):
         """Read and verify header index and data.
 
         self.fd should already be open.  Return (number of tags, tag data size,
@@ -826,34 +966,54 @@ class RpmStreamIO(RpmIO):
             functions.readExact(self.fd, (pad - (storeSize % pad)) % pad)
         return (indexNo, storeSize, data, fmt, fmt2, 16 + len(fmt) + len(fmt2))
 
-    def __parseTag(self, index, fmt):
+    def _parseTag(self, index, fmt, base=0, size=None):
         """Parse value of tag with index from data in fmt.
 
-        Return tag value.  Raise ValueError on invalid data."""
+        The data area starts at base in fmt and is size bytes long (all of fmt
+        if size is None).  Return tag value.  Raise ValueError on invalid
+        data."""
 
         (tag, ttype, offset, count) = index
+        if size is None:
+            size = len(fmt) - base
+        if offset > size:
+            raise ValueError, "Invalid header data"
+        limit = base + size
+        offset += base
         try:
             if ttype == RPM_INT32:
-                return unpack("!%dI" % count, fmt[offset:offset + count * 4])
+                return unpack("!%dI" % count,
+                              fmt[offset:min(offset + count * 4, limit)])
             elif ttype == RPM_STRING_ARRAY or ttype == RPM_I18NSTRING:
-                data = []
-                for _ in xrange(0, count):
-                    end = fmt.index('\x00', offset)
-                    data.append(fmt[offset:end])
-                    offset = end + 1
-                return data
+                # Find the end of the last string, then one split of only
+                # these strings is a lot faster than slicing each string
+                end = offset - 1
+                for _ in xrange(count):
+                    end = fmt.find('\x00', end + 1, limit)
+                    if end < 0:
+                        raise ValueError, "Invalid header data"
+                if end < offset:
+                    return [ ]
+                return fmt[offset:end].split('\x00')
             elif ttype == RPM_STRING:
-                return fmt[offset:fmt.index('\x00', offset)]
+                end = fmt.find('\x00', offset, limit)
+                if end < 0:
+                    raise ValueError, "Invalid header data"
+                return fmt[offset:end]
             elif ttype == RPM_CHAR:
-                return unpack("!%dc" % count, fmt[offset:offset + count])
+                return unpack("!%dc" % count,
+                              fmt[offset:min(offset + count, limit)])
             elif ttype == RPM_INT8:
-                return unpack("!%dB" % count, fmt[offset:offset + count])
+                return unpack("!%dB" % count,
+                              fmt[offset:min(offset + count, limit)])
             elif ttype == RPM_INT16:
-                return unpack("!%dH" % count, fmt[offset:offset + count * 2])
+                return unpack("!%dH" % count,
+                              fmt[offset:min(offset + count * 2, limit)])
             elif ttype == RPM_INT64:
-                return unpack("!%dQ" % count, fmt[offset:offset + count * 8])
+                return unpack("!%dQ" % count,
+                              fmt[offset:min(offset + count * 8, limit)])
             elif ttype == RPM_BIN:
-                return fmt[offset:offset + count]
+                return fmt[offset:min(offset + count, limit)]
             raise ValueError, "unknown tag type: %d" % ttype
         except struct.error:
             raise ValueError, "Invalid header data"
@@ -1181,6 +1341,81 @@ class RpmFileIO(RpmStreamIO):
         # start in that case? Lowest offset in region perhaps?
         functions.updateDigestFromFile(digest, fd, offset + 16)
 
+class RpmMmapIO(RpmFileIO):
+    """RpmFileIO parsing the signature and header from a memory map of the
+    file: each index is unpacked at once and tag values are sliced directly
+    from the map.  Falls back to the RpmFileIO stream path if the source is
+    not a mappable regular file."""
+
+    def __init__(self, source, hdronly=None):
+        RpmFileIO.__init__(self, source, hdronly)
+        self.mm = None
+        self.indexes = None             # unpacked entries of current index
+        self.storebase = 0              # position of current data area
+        self.storesize = 0
+
+    def open(self, mode="r"):
+        if self.fd:
+            return
+        RpmFileIO.open(self, mode)
+        if mode != "r":
+            return
+        try:
+            fileno = self.fd.fileno()
+            if stat.S_ISREG(os.fstat(fileno).st_mode):
+                self.mm = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        except (EnvironmentError, ValueError):
+            # Empty files can't be mapped either, let the stream path
+            # report them
+            self.mm = None
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        self.indexes = None
+        RpmFileIO.close(self)
+
+    def _readIndex(self, pad):
+        """Like RpmStreamIO._readIndex(), but the returned data area is the
+        whole map, see self.storebase and self.storesize."""
+
+        if self.mm is None:
+            return RpmFileIO._readIndex(self, pad)
+        mm = self.mm
+        pos = self.fd.tell()
+        data = mm[pos:pos + 16]
+        if len(data) != 16:
+            raise IOError, "Unexpected EOF"
+        (magic, indexNo, storeSize) = unpack("!8s2I", data)
+        if magic != RPM_HEADER_INDEX_MAGIC or indexNo < 1:
+            raise ValueError, "bad index magic"
+        start = pos + 16 + 16 * indexNo
+        end = start + storeSize + (pad - (storeSize % pad)) % pad
+        if end > len(mm):
+            raise IOError, "Unexpected EOF"
+        fmt = mm[pos + 16:start]
+        values = unpack("!%dI" % (4 * indexNo), fmt)
+        self.indexes = zip(values[0::4], values[1::4], values[2::4],
+                           values[3::4])
+        (self.storebase, self.storesize) = (start, storeSize)
+        self.fd.seek(end)
+        return (indexNo, storeSize, data, fmt, mm, 16 + len(fmt) + storeSize)
+
+    def getHeaderByIndex(self, idx, indexdata, storedata):
+        if self.mm is None:
+            return RpmFileIO.getHeaderByIndex(self, idx, indexdata, storedata)
+        index = self.indexes[idx]
+        tag = index[0]
+        value = self._parseTag(index, self.mm, self.storebase, self.storesize)
+        # ignore duplicate entries as long as they are identical
+        if self.hdr.has_key(tag):
+            if self.hdr[tag] != value:
+                log.error("%s: tag %d included twice", self.source, tag)
+        else:
+            self.hdr[tag] = value
+        return (tag, self.hdr[tag])
+
 class RpmFtpIO(RpmStreamIO):
     def __init__(self, source, hdronly=None):
         RpmStreamIO.__init__(self, source, hdronly)
@@ -1228,13 +1463,13 @@ def getRpmIOFactory(source, hdronly=None):
     if   source[:5] == 'ftp:/':
         return RpmFtpIO(source, hdronly)
     elif source[:6] == 'file:/':
-        return RpmFileIO(source, hdronly)
+        return RpmMmapIO(source, hdronly)
     elif source[:6] == 'http:/':
         return RpmHttpIO(source, hdronly)
 #    elif source[:6] == 'pydb:/':
 #        return RpmFileIO(source[6:], hdronly)
     else:
-        return RpmFileIO(source, hdronly)
+        return RpmMmapIO(source, hdronly)
     return None
 
 
@@ -37,6 +37,13 @@ relation is a normal dependency, which has to be solved after package
 installation at runtime. The hard relation is a pre requirement, which has to
 be solved before the dependent package gets installed.
 
+The relations between packages to install can be taken from the resolver that
+computed the transaction: its database contains all of them after the
+transaction, so the providers found there only need to be reduced to the
+installs.  Otherwise a new database and resolver are built for the packages.
+The erased packages are not in that database, their relations are always
+generated from a new one.
+
 
 The second stage is detecting strongly connected components. These are maximal
 groups of packages that are reachable from each other. These components are
@@ -48,6 +55,15 @@ After this we can collect the leaf packages until all packages are processed.
 When collecting a connected component it is broken up and the containing
 packages are collected.
 
+By default the relations are ordered in linear time instead (see
+RpmRelations.genOrderSCC()): the strongly connected components are found with
+Tarjan's algorithm and the graph of the components is sorted topologically,
+preferring components many packages depend on. Within a component the packages
+are sorted the same way and if only packages in loops are left, the one with
+the fewest hard, then the fewest soft open requirements is taken and these
+requirements are broken. Ties are decided by the NEVRA, so the order does not
+depend on the order the packages were given in. The relations are not changed.
+
 The final stage is to generate an operation list with the ordered packages and
 which takes the updates and obsoletes list into consideration. The operation
 list is a list of tuples, where each tuple is of the form (operation, package).
@@ -73,6 +89,7 @@ Possible weights are:
 
 """
 
+import heapq
 from hashlist import HashList
 from base import *
 from resolver import RpmResolver
@@ -89,6 +106,58 @@ def operationFlag(flag, operation):
         return 1    # hard requirement
     return 0        # soft requirement
 
+def findSCCs(graph):
+    """Return the strongly connected components of graph, a list of lists
+    of the node numbers each node has arcs to, as lists of node numbers.
+
+    Uses Tarjan's algorithm without recursion.  A component is returned after
+    all components it has arcs to."""
+
+    index = [ -1 ] * len(graph) # DFS number of each node, -1: not visited
+    low = [ 0 ] * len(graph)    # lowest DFS number reachable from a node
+    onstack = [ False ] * len(graph)
+    stack = [ ]                 # visited nodes not in a component yet
+    components = [ ]
+    counter = 0
+    for root in xrange(len(graph)):
+        if index[root] != -1:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        onstack[root] = True
+        work = [ (root, 0) ]    # (node, position in graph[node]) to continue
+        while work:
+            (node, pos) = work[-1]
+            arcs = graph[node]
+            if pos < len(arcs):
+                work[-1] = (node, pos + 1)
+                next = arcs[pos]
+                if index[next] == -1:
+                    index[next] = low[next] = counter
+                    counter += 1
+                    stack.append(next)
+                    onstack[next] = True
+                    work.append((next, 0))
+                elif onstack[next] and index[next] < low[node]:
+                    low[node] = index[next]
+                continue
+            # all arcs of node done, going up
+            work.pop()
+            if work and low[node] < low[work[-1][0]]:
+                low[work[-1][0]] = low[node]
+            if low[node] == index[node]:
+                # node is the root of a component
+                component = [ ]
+                while True:
+                    p = stack.pop()
+                    onstack[p] = False
+                    component.append(p)
+                    if p == node:
+                        break
+                components.append(component)
+    return components
+
 class RpmRelation:
     """Pre and post relations for a package (a node in the dependency
     graph)."""
@@ -106,11 +175,21 @@ class RpmRelation:
 class RpmRelations(dict):
     """List of relations for each package (a dependency graph)."""
     # RpmPackage => RpmRelation
-    def __init__(self, config, rpms, operation, externaldb=None):
+    # Order with genOrderSCC(), with ConnectedComponent's otherwise
+    SCCORDER = True
+
+    def __init__(self, config, rpms, operation, externaldb=None,
+                 resolver=None):
         self.config = config
-        self.genRelations(rpms, operation, externaldb)
+        self.genRelations(rpms, operation, externaldb, resolver)
+
+    def genRelations(self, rpms, operation, externaldb=None, resolver=None):
+        """Generate the relations between the RpmPackage's in list rpms.
+
+        If resolver is not None, search dependencies in the database of this
+        RpmResolver, which has to contain all rpms, instead of building a new
+        database and resolver."""
 
-    def genRelations(self, rpms, operation, externaldb=None):
         # clear list to get to a sane state
         self.clear()
 
@@ -118,16 +197,18 @@ class RpmRelations(dict):
         for pkg in rpms:
             self[pkg] = RpmRelation()
 
-        # Build a new resolver to list all dependencies between packages.
-        if externaldb:
-            db = RpmExternalSearchDB(externaldb, self.config, None)
-        else:
-            db = RpmMemoryDB(self.config, None)
-        db.addPkgs(rpms)
-        resolver = RpmResolver(self.config, db, nocheck=1)
+        if resolver is None:
+            # Build a new resolver to list all dependencies between packages.
+            if externaldb:
+                db = RpmExternalSearchDB(externaldb, self.config, None)
+            else:
+                db = RpmMemoryDB(self.config, None)
+            db.addPkgs(rpms)
+            resolver = RpmResolver(self.config, db, nocheck=1)
+            rpms = db.getPkgs()
 
         # Add dependencies:
-        for pkg in db.getPkgs():
+        for pkg in rpms:
             log.debug1("Generating relations for %s", pkg.getNEVRA())
             resolved = resolver.getResolvedPkgDependencies(pkg)
             # ignore unresolved, we are only looking at the changes,
@@ -137,7 +218,8 @@ class RpmRelations(dict):
                     continue
                 f = operationFlag(flag, operation)
                 for pkg2 in s:
-                    if pkg2 != pkg:
+                    # providers outside of rpms are not changed
+                    if pkg2 != pkg and pkg2 in self:
                         self.addRelation(pkg, pkg2, f)
 
         self.printRel()
@@ -342,6 +424,9 @@ class RpmRelations(dict):
 
         Return an ordered list of RpmPackage's on success, None on error."""
 
+        if self.SCCORDER:
+            return self.genOrderSCC()
+
         length = len(self)
 
         order = [ ]
@@ -378,6 +463,129 @@ class RpmRelations(dict):
 
         return order
 
+    # ----
+
+    def genOrderSCC(self):
+        """Order rpms in orderer.RpmRelations relations by their strongly
+        connected components, without changing the relations.
+
+        Return an ordered list of RpmPackage's."""
+
+        # number the packages by NEVRA
+        pkgs = [ (pkg.getNEVRA(), pkg) for pkg in self ]
+        pkgs.sort()
+        pkgs = [ pkg for (nevra, pkg) in pkgs ]
+        numbers = { }
+        for i in xrange(len(pkgs)):
+            numbers[pkgs[i]] = i
+        pre = [ [ (numbers[p], flag) for (p, flag) in self[pkg].pre.items() ]
+                for pkg in pkgs ] # [[(number of required pkg, flag)]]
+
+        components = findSCCs([ [ j for (j, flag) in arcs ] for arcs in pre ])
+        component = [ 0 ] * len(pkgs) # component number of each package
+        for c in xrange(len(components)):
+            for i in components[c]:
+                component[i] = c
+        # arcs to and from other components
+        waiting = [ 0 ] * len(components)
+        post = [ [ ] for c in components ]
+        for i in xrange(len(pkgs)):
+            for (j, flag) in pre[i]:
+                if component[i] != component[j]:
+                    waiting[component[i]] += 1
+                    post[component[j]].append(component[i])
+
+        loops = [ c for c in components if len(c) > 1 ]
+        if loops and log.isDebugLoggingHere(log.DEBUG1):
+            log.debug1("-- STRONGLY CONNECTED COMPONENTS --")
+            for i in xrange(len(loops)):
+                log.debug1("  %d: %s", i,
+                           ", ".join([pkgs[j].getNEVRA() for j in loops[i]]))
+
+        # sort the components topologically, the ones most others depend on
+        # first
+        order = [ ]
+        heap = [ (-len(post[c]), min(components[c]), c)
+                 for c in xrange(len(components)) if waiting[c] == 0 ]
+        heapq.heapify(heap)
+        while heap:
+            c = heapq.heappop(heap)[2]
+            if len(components[c]) == 1:
+                order.append(pkgs[components[c][0]])
+            else:
+                self._orderComponent(pkgs, pre, components[c], order)
+            for c2 in post[c]:
+                waiting[c2] -= 1
+                if waiting[c2] == 0:
+                    heapq.heappush(heap, (-len(post[c2]), min(components[c2]),
+                                          c2))
+
+        if len(order) != len(pkgs):
+            log.error("%d Packages of %d in order list! Number of connected "
+                      "components: %d ", len(order), len(pkgs), len(loops))
+        return order
+
+    # ----
+
+    def _orderComponent(self, pkgs, pre, nodes, order):
+        """Append the RpmPackage's of the strongly connected component with
+        numbers in list nodes to order, breaking loops.
+
+        pkgs is the list of RpmPackage's by number, pre the list of [(number
+        of required RpmPackage, flag)] for each package."""
+
+        members = { }
+        for i in nodes:
+            members[i] = None
+        hard = { } # number => open hard requirements in the component
+        soft = { } # number => open soft requirements in the component
+        post = { } # number => [numbers requiring it]
+        for i in nodes:
+            (hard[i], soft[i]) = (0, 0)
+            post.setdefault(i, [ ])
+            for (j, flag) in pre[i]:
+                if members.has_key(j):
+                    if flag:
+                        hard[i] += 1
+                    else:
+                        soft[i] += 1
+                    post.setdefault(j, [ ]).append(i)
+        # packages without open requirements and all others by the
+        # requirements to break, may contain outdated entries
+        ready = [ ]
+        loops = [ (hard[i], soft[i], -len(post[i]), i) for i in nodes ]
+        heapq.heapify(loops)
+        done = { }
+        while len(done) < len(nodes):
+            if ready:
+                i = heapq.heappop(ready)[1]
+            else:
+                (h, s, p, i) = heapq.heappop(loops)
+                if done.has_key(i) or (h, s) != (hard[i], soft[i]):
+                    continue
+                for (j, flag) in pre[i]:
+                    if not members.has_key(j) or done.has_key(j):
+                        continue
+                    if flag:
+                        log.error("Breaking pre requirement for %s: %s",
+                                  pkgs[i].getNEVRA(), pkgs[j].getNEVRA())
+                    else:
+                        log.debug4("Removing requires for %s from %s",
+                                   pkgs[j].getNEVRA(), pkgs[i].getNEVRA())
+            done[i] = None
+            order.append(pkgs[i])
+            for j in post[i]:
+                if done.has_key(j):
+                    continue
+                if self[pkgs[j]].pre[pkgs[i]]:
+                    hard[j] -= 1
+                else:
+                    soft[j] -= 1
+                if hard[j] == 0 and soft[j] == 0:
+                    heapq.heappush(ready, (-len(post[j]), j))
+                else:
+                    heapq.heappush(loops, (hard[j], soft[j], -len(post[j]), j))
+
 # ----------------------------------------------------------------------------
 
 class ConnectedComponent:
@@ -647,7 +855,7 @@ class ConnectedComponentsDetector:
 class RpmOrderer:
 
     def __init__(self, config, installs, updates, obsoletes, erases,
-                 installdb=None, erasedb=None):
+                 installdb=None, erasedb=None, resolver=None):
         """Initialize.
 
         installs is a list of added RpmPackage's
@@ -656,7 +864,9 @@ class RpmOrderer:
             removed by update]
         obsoletes is a hash: new RpmPackage => ["originally" installed
             RpmPackage removed by update]
-        installs, updates and obsoletes can be None."""
+        installs, updates and obsoletes can be None.
+        resolver is the RpmResolver the changes were made with, it is used to
+        find the relations between the installs if not None."""
 
         self.config = config
         self.installs = installs
@@ -676,6 +886,7 @@ class RpmOrderer:
                         self.erases.remove(p)
         self.installdb = installdb
         self.erasedb = erasedb
+        self.resolver = resolver
 
     # ----
 
@@ -729,7 +940,8 @@ class RpmOrderer:
             else:
                 # generate relations
                 relations = RpmRelations(self.config, self.installs,
-                                         OP_INSTALL, self.installdb)
+                                         OP_INSTALL, self.installdb,
+                                         self.resolver)
 
                 # order package list
                 order2 = relations.genOrder()
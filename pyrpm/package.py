@@ -54,21 +54,7 @@ class _RpmFilenamesIterator:
         return pkg["dirnames"][pkg["dirindexes"][i]] + pkg["basenames"][i]
 
     def index(self, name):
-        if self.has_oldfilenames:
-            return self.pkg["oldfilenames"].index(name)
-
-        (dirname, basename) = functions.pathsplit2(name)
-        i = 0
-        (basenames, dirnames, dirindexes) = (self.pkg["basenames"],
-            self.pkg["dirnames"], self.pkg["dirindexes"])
-        while i < len(basenames):
-            i = basenames.index(basename, i)
-            if i < 0:
-                break
-            if dirnames[dirindexes[i]] == dirname:
-                return i
-            i += 1
-        raise ValueError
+        return self.pkg.getFileIndex(name)
 
     def __contains__(self, name):
         try:
@@ -91,6 +77,7 @@ class RpmData(dict):
         self.config = config
         self.hash = RpmData.__hashcount__
         RpmData.__hashcount__ += 1
+        self.fileindex = None   # (file list, {filename: index})
 
     def __getitem__(self, item):
         return dict.get(self, item)
@@ -98,6 +85,37 @@ class RpmData(dict):
     def iterFilenames(self):
         return _RpmFilenamesIterator(self)
 
+    def getFileIndex(self, filename):
+        """Return the index of filename in the file list.
+
+        The filename => index map is built on first use and rebuilt if the
+        file list gets replaced.  Raise ValueError if the package does not
+        contain filename."""
+
+        if self.has_key("oldfilenames"):
+            files = self["oldfilenames"]
+        else:
+            files = self["basenames"]
+        if self.fileindex is None or self.fileindex[0] is not files:
+            if files is None:
+                names = [ ]
+            elif self.has_key("oldfilenames"):
+                names = files
+            else:
+                (dirnames, dirindexes) = (self["dirnames"],
+                                          self["dirindexes"])
+                names = [dirnames[dirindexes[i]] + files[i]
+                         for i in xrange(len(files))]
+            index = { }
+            # The first of duplicate entries wins
+            for i in xrange(len(names) - 1, -1, -1):
+                index[names[i]] = i
+            self.fileindex = (files, index)
+        i = self.fileindex[1].get(filename)
+        if i is None:
+            raise ValueError, "%s not in file list" % filename
+        return i
+
     def __repr__(self):
         return "FastRpmData: <0x" + str(self.hash) + ">"
 
@@ -115,6 +133,38 @@ class RpmData(dict):
         return self.hash != pkg.hash
 
 
+class _RpmFileInfoView(RpmFileInfo):
+    """RpmFileInfo of file i of a package, reading each attribute from the
+    file tags of the package on first access."""
+
+    tags = { "inode" : "fileinodes", "mode" : "filemodes",
+             "uid" : "fileusername", "gid" : "filegroupname",
+             "mtime" : "filemtimes", "filesize" : "filesizes",
+             "dev" : "filedevices", "rdev" : "filerdevs",
+             "md5sum" : "filemd5s", "linkto" : "filelinktos",
+             "flags" : "fileflags", "verifyflags" : "fileverifyflags",
+             "filecolor" : "filecolors" }
+
+    def __init__(self, pkg, filename, i):
+        self.filename = filename
+        self.pkg = pkg
+        self.i = i
+
+    def __getattr__(self, name):
+        if not self.tags.has_key(name):
+            raise AttributeError, name
+        value = None
+        pkg = self.pkg
+        if pkg.has_key(self.tags[name]):
+            value = pkg[self.tags[name]][self.i]
+            if name == "uid":
+                value = pkg.rpmusercache.getUID(value)
+            elif name == "gid":
+                value = pkg.rpmusercache.getGID(value)
+        setattr(self, name, value)
+        return value
+
+
 class RpmUserCache:
     """If glibc is not yet installed (/sbin/ldconfig is missing), we parse
     /etc/passwd and /etc/group with our own routines."""
@@ -198,6 +248,8 @@ class RpmPackage(RpmData):
         self.yumrepo = None     # Yum repository if package is from that repo
         self.reponame = "binaryrpm"     # Name/type of the repository
         self.yumhref = None     # Original relative href in yum repo
+        self.yumsize = -1       # Size of the package file in yum repo
+        self.yumchecksum = None # (type, checksum) of the file in yum repo
         self.compstype = None   # If available refers to the type in comps.xml
         self.verifySignature = verify   # Verify signature
         self.hdronly = hdronly  # Don't open the payload
@@ -226,6 +278,7 @@ class RpmPackage(RpmData):
                 del self[key]
 
         self.header_read = 0
+        self.fileindex = None
         self.rpmusercache = RpmUserCache(self.config)
 
     def open(self, mode="r"):
@@ -435,7 +488,8 @@ class RpmPackage(RpmData):
             try:
                 (status, rusage, output) = functions.runScript(
                     self["postinprog"], self["postin"], [numPkgs],
-                    rusage=self.config.rusage, prefixes=self["prefixes"], chroot=buildroot)
+                    rusage=self.config.rusage, prefixes=self["prefixes"], chroot=buildroot,
+                    delay=True)
             except (IOError, OSError), e:
                 log.error("\n%s: Error running post install script: %s",
                           self.getNEVRA(), e)
@@ -555,7 +609,8 @@ class RpmPackage(RpmData):
             try:
                 (status, rusage, output) = functions.runScript(
                     self["postunprog"], self["postun"], [numPkgs],
-                    rusage = self.config.rusage, prefixes=self["prefixes"], chroot=buildroot)
+                    rusage = self.config.rusage, prefixes=self["prefixes"], chroot=buildroot,
+                    delay=True)
             except (IOError, OSError), e:
                 log.error("\n%s: Error running post uninstall script: %s",
                           self.getNEVRA(), e)
@@ -877,40 +932,61 @@ class RpmPackage(RpmData):
             useSEcontext = self.config.selinux_enabled
         if self.config.printhash:
             log.info2("\r\t\t\t\t\t\t ", nl=0, nofmt=1)
-        while filename != "EOF":
-            n += 1
-            npos = int(n*30/nfiles)
-            if pos < npos and self.config.printhash:
-                log.info2("#"*(npos-pos), nl=0, nofmt=1)
-            pos = npos
-            if issrc and filename[:1] == "/":
-                # src.rpm has empty tag "dirnames", but we use absolut paths in
-                # io.read(), so at least the directory '/' is there ...
-                filename = filename[1:]
-            if rfilist.has_key(filename):
-                rfi = rfilist[filename]
-                if self.__verifyFileInstall(rfi, db, pathPrefix=pathPrefix):
-                    if filesize == 0 and stat.S_ISREG(rfi.mode): # Only hardlink reg
-                        self.__possibleHardLink(rfi)
+        writer = None
+        if self.config.extractjobs > 0:
+            writer = functions.FileWriter(self.config.extractjobs)
+        try:
+            while filename != "EOF":
+                n += 1
+                npos = int(n*30/nfiles)
+                if pos < npos and self.config.printhash:
+                    log.info2("#"*(npos-pos), nl=0, nofmt=1)
+                pos = npos
+                if issrc and filename[:1] == "/":
+                    # src.rpm has empty tag "dirnames", but we use absolut
+                    # paths in io.read(), so at least the directory '/' is
+                    # there ...
+                    filename = filename[1:]
+                if rfilist.has_key(filename):
+                    rfi = rfilist[filename]
+                    if self.__verifyFileInstall(rfi, db,
+                                                pathPrefix=pathPrefix):
+                        # Only hardlink reg
+                        if filesize == 0 and stat.S_ISREG(rfi.mode):
+                            self.__possibleHardLink(rfi)
+                        else:
+                            # Hard links to the file and the service hack
+                            # need it written now
+                            fwriter = writer
+                            if self.hardlinks.has_key(rfi.getHardLinkID()) \
+                                   or filename == "/sbin/service":
+                                fwriter = None
+                            functions.installFile(rfi, cpio, filesize,
+                                                  useAttrs,
+                                                  pathPrefix = pathPrefix,
+                                                  useSEcontext = useSEcontext,
+                                                  writer = fwriter)
+                            # Many scripts have problems like e.g. openssh is
+                            # stopping all sshd (also outside of a chroot if
+                            # it is de-installed. Real hacky workaround:
+                            if pathPrefix is None and self.config.service \
+                                   and filename == "/sbin/service":
+                                open("/sbin/service", "wb").write("exit 0\n")
+                            self.__handleHardlinks(rfi, pathPrefix)
                     else:
-                        functions.installFile(rfi, cpio, filesize, useAttrs,
-                                              pathPrefix = pathPrefix,
-                                              useSEcontext = useSEcontext)
-                        # Many scripts have problems like e.g. openssh is
-                        # stopping all sshd (also outside of a chroot if
-                        # it is de-installed. Real hacky workaround:
-                        if pathPrefix is None and self.config.service \
-                               and filename == "/sbin/service":
-                            open("/sbin/service", "wb").write("exit 0\n")
-                        self.__handleHardlinks(rfi, pathPrefix)
-                else:
-                    cpio.skipToNextFile()
-                    if filesize > 0:
-                        # FIXME: If other hard links are installed, the data
-                        # is lost.
-                        self.__removeHardlinks(rfi)
-            # FIXME: else report error?
-            (filename, cpio, filesize) = self.io.read()
+                        cpio.skipToNextFile()
+                        if filesize > 0:
+                            # FIXME: If other hard links are installed, the
+                            # data is lost.
+                            self.__removeHardlinks(rfi)
+                # FIXME: else report error?
+                (filename, cpio, filesize) = self.io.read()
+        except:
+            if writer is not None:
+                writer.close()
+            raise
+        if writer is not None:
+            writer.wait()
         if nfiles == 0:
             nfiles = 1
         if self.config.printhash:
@@ -1146,7 +1222,7 @@ class RpmPackage(RpmData):
 
         if i == None:
             try:
-                i = self.iterFilenames().index(filename)
+                i = self.getFileIndex(filename)
             except ValueError:
                 return None
         rpminode = None
@@ -1194,6 +1270,20 @@ class RpmPackage(RpmData):
                           rpmfilecolor)
         return rfi
 
+    def getRpmFileInfoView(self, filename, i=None):
+        """Return a RpmFileInfo describing filename like getRpmFileInfo(), or
+        None if this package does not contain filename.
+
+        The attributes are read from the file tags on first access, which is
+        cheaper if only a few of them are needed."""
+
+        if i == None:
+            try:
+                i = self.getFileIndex(filename)
+            except ValueError:
+                return None
+        return _RpmFileInfoView(self, filename, i)
+
     def getEpoch(self):
         """Return %epoch as a string, or "0" for unspecified epoch."""
 
@@ -1378,4 +1468,66 @@ class RpmPackage(RpmData):
             return 1
         return functions.pkgCompare(self, pkg) > 0
 
+
+class RpmRepoPackage(RpmPackage):
+    """A package read from repository metadata.
+
+    The defaults of the attributes of RpmPackage are class attributes, so
+    only the values set by the repository are stored in each instance.  The
+    package becomes a complete RpmPackage when it is reread from the package
+    file, e.g. after downloading it for installation."""
+
+    yumrepo = None
+    reponame = "binaryrpm"
+    yumhref = None
+    yumsize = -1
+    yumchecksum = None
+    compstype = None
+    verifySignature = None
+    hdronly = None
+    db = None
+    io = None
+    issrc = None
+    size = 0
+    range_signature = (None, None)
+    range_header = (None, None)
+    range_payload = (None, None)
+    header_read = 0
+    fileindex = None
+
+    def __init__(self, config, source, verify=None, hdronly=None, db=None):
+        dict.__init__(self)
+        self.config = config
+        self.hash = RpmData.__hashcount__
+        RpmData.__hashcount__ += 1
+        self.source = source
+        if verify is not None:
+            self.verifySignature = verify
+        if hdronly is not None:
+            self.hdronly = hdronly
+        if db is not None:
+            self.db = db
+
+    def __getattr__(self, name):
+        # The RpmUserCache is only needed for file conflicts
+        if name == "rpmusercache":
+            self.rpmusercache = RpmUserCache(self.config)
+            return self.rpmusercache
+        raise AttributeError, name
+
+    def internTags(self):
+        """Replace the NEVRA strings by interned copies and the dependency
+        lists by tuples of entries with interned names and versions."""
+
+        for tag in ("name", "version", "release", "arch"):
+            if dict.get(self, tag) is not None:
+                self[tag] = functions.internName(self[tag])
+        for tag in ("provides", "requires", "obsoletes", "conflicts",
+                    "triggers"):
+            deps = dict.get(self, tag)
+            if deps is not None:
+                self[tag] = tuple([ (functions.internName(dep[0]), dep[1],
+                                     functions.internName(dep[2])) + dep[3:]
+                                    for dep in deps ])
+
 # vim:ts=4:sw=4:showmatch:expandtab
@@ -20,10 +20,10 @@
 ...
 """
 
-from stat import S_ISLNK, S_ISDIR
 from hashlist import HashList
 from functions import *
-import base
+from fileconflicts import isMultilibFile, filesConflict, checkFileInfo, \
+     addSharedFileConflicts
 from logger import log
 
 # ----------------------------------------------------------------------------
@@ -47,12 +47,16 @@ class RpmResolver:
     FILE_CONFLICT = -12
     # ----
 
-    def __init__(self, config, database, nocheck=0):
+    def __init__(self, config, database, nocheck=0, incremental=0):
         """Initialize, with the "currently installed" packages in RpmPackage
-        list installed."""
+        list installed.
+
+        If incremental, unresolved dependencies are tracked in a worklist,
+        see iterUnresolvedDependencies()."""
 
         self.config = config
         self.database = database
+        self.incremental = incremental
         self.clear()
 
         # do no further checks
@@ -81,6 +85,14 @@ class RpmResolver:
         # ["originally" installed RpmPackage obsoleted by update]
         self.obsoletes = { }
         self.installed_unresolved_file_requires = set()
+        # Incremental mode: (RpmPackage, dependency) pairs to check starting
+        # at self.worklist[self.worklist_pos], pairs found unresolved, the set
+        # of all these pairs and the RpmPackage's removed since
+        self.worklist = [ ]
+        self.worklist_pos = 0
+        self.worklist_unresolved = [ ]
+        self.worklist_set = set()
+        self.removed = set()
     # ----
 
 
@@ -103,6 +115,7 @@ class RpmResolver:
         if not self.isInstalled(pkg):
             self.installs.add(pkg)
         self.erases.discard(pkg)
+        self.removed.discard(pkg)
         self.check_installs.add(pkg)
 
         self.database.addPkg(pkg)
@@ -264,6 +277,7 @@ class RpmResolver:
             del self.obsoletes[pkg]
         self.check_erases.add(pkg)
         self.check_file_requires = True
+        self.removed.add(pkg)
 
         self.database.removePkg(pkg)
 
@@ -340,58 +354,17 @@ class RpmResolver:
     def _hasFileConflict(self, pkg1, pkg2, filename):
         """RpmPackage's pkg1 and pkg2 share filename.
 
-        Return 1 if the conflict is "real", 0 if it should be ignored.
-        pkg1_fi is RpmFileInfo of filename in pkg1."""
-
-        # pkg1_fi = pkg1.getRpmFileInfo(idx1)
-        pkg1_fi = pkg1.getRpmFileInfo(filename)
-        pkg2_fi = pkg2.getRpmFileInfo(filename)
-        # do not check packages with the same NEVR which are
-        # not buildarchtranslate compatible
-        if pkg1.getNEVR() == pkg2.getNEVR() and \
-               buildarchtranslate[pkg1["arch"]] != \
-               buildarchtranslate[pkg2["arch"]] and \
-               pkg1["arch"] != "noarch" and \
-               pkg2["arch"] != "noarch" and \
-               pkg1_fi.filecolor != pkg2_fi.filecolor and \
-               pkg1_fi.filecolor > 0 and pkg2_fi.filecolor > 0:
-            return 0
-
-        # check if data is sufficient
-        if not pkg1_fi.mode:
-            raise ValueError, \
-                  "Package '%s': File mode is not set for file '%s'" % \
-                  (pkg1.getNEVRA(), filename)
-        if not pkg2_fi.mode:
-            raise ValueError, \
-                  "Package '%s': File mode is not set for file '%s'" % \
-                  (pkg2.getNEVRA(), filename)
-
-        # check if user and group are identical
-        if pkg1_fi.uid != pkg2_fi.uid and \
-               pkg1_fi.gid != pkg2_fi.gid:
-            return 1
-
-        # ignore directories
-        if S_ISDIR(pkg1_fi.mode) and S_ISDIR(pkg2_fi.mode):
-            return 0
-        # ignore links
-        if S_ISLNK(pkg1_fi.mode) and S_ISLNK(pkg2_fi.mode) and \
-               (pkg1_fi.linkto == pkg2_fi.linkto):
-            return 0
-
-        # ignore identical files
-        if pkg1_fi.mode == pkg2_fi.mode and \
-               pkg1_fi.filesize == pkg2_fi.filesize and \
-               pkg1_fi.md5sum == pkg2_fi.md5sum:
-            return 0
+        Return 1 if the conflict is "real", 0 if it should be ignored."""
 
-        # ignore ghost files
-        if pkg1_fi.flags & base.RPMFILE_GHOST or \
-               pkg2_fi.flags & base.RPMFILE_GHOST:
+        pkg1_fi = pkg1.getRpmFileInfoView(filename)
+        pkg2_fi = pkg2.getRpmFileInfoView(filename)
+        if isMultilibFile(pkg1, pkg1_fi, pkg2, pkg2_fi):
             return 0
 
-        return 1
+        # check if data is sufficient
+        checkFileInfo(pkg1, pkg1_fi)
+        checkFileInfo(pkg2, pkg2_fi)
+        return filesConflict(pkg1_fi, pkg2_fi)
     # ----
 
     def _pkgObsolete(self, pkg, obsolete_pkg):
@@ -648,7 +621,19 @@ class RpmResolver:
     # ----
 
     def iterUnresolvedDependencies(self):
-        """only check changes done to the database"""
+        """Yield (RpmPackage, (name, RPMSENSE_* flag, EVR string)) for each
+        unresolved dependency.
+
+        Only changes done to the database are checked.  In incremental mode
+        packages may be added and removed while iterating, the dependencies
+        touched by them are checked in the same run.  Unresolved dependencies
+        are yielded again by the next run."""
+
+        if self.incremental:
+            for (pkg, dep) in self.__iterWorklist():
+                yield pkg, dep
+            return
+
         for pkg in list(self.check_erases):
             # check if provides are required and not provided by another
             # package
@@ -693,6 +678,68 @@ class RpmResolver:
                         yield p, dep
             self.check_file_requires = not ok or bool(self.check_erases)
 
+    def __queueDependency(self, pkg, dep):
+        """Add dependency dep of RpmPackage pkg to the worklist."""
+
+        item = (pkg, dep)
+        if item not in self.worklist_set:
+            self.worklist_set.add(item)
+            self.worklist.append(item)
+
+    def __fillWorklist(self):
+        """Queue the requirements of added packages and the requirements of
+        other packages resolved by removed packages."""
+
+        for pkg in self.check_installs:
+            for u in pkg["requires"]:
+                if u[0][:7] == "rpmlib(": # drop rpmlib requirements
+                    continue
+                self.__queueDependency(pkg, u)
+        self.check_installs.clear()
+
+        # Only requirements of files owned by a removed package can become
+        # unresolved, so there is no need to check all file requirements
+        for pkg in self.check_erases:
+            for dep in pkg["provides"]:
+                sr = self.database.searchRequires(dep[0], dep[1], dep[2])
+                for (p, deps) in sr.iteritems():
+                    for d in deps:
+                        self.__queueDependency(p, d)
+            for f in pkg.iterFilenames():
+                sr = self.database.searchRequires(f, 0, "")
+                for (p, deps) in sr.iteritems():
+                    for d in deps:
+                        self.__queueDependency(p, d)
+        self.check_erases.clear()
+        self.check_file_requires = False
+
+    def __iterWorklist(self):
+        """Yield the unresolved dependencies in the worklist, see
+        iterUnresolvedDependencies().
+
+        Each queued dependency is checked once per run, resolved ones and
+        those of removed packages are dropped."""
+
+        self.worklist.extend(self.worklist_unresolved)
+        self.worklist_unresolved = [ ]
+        self.__fillWorklist()
+        while self.worklist_pos < len(self.worklist):
+            item = self.worklist[self.worklist_pos]
+            self.worklist_pos += 1
+            if self.worklist_pos > 1024 and \
+                   self.worklist_pos * 2 > len(self.worklist):
+                del self.worklist[:self.worklist_pos]
+                self.worklist_pos = 0
+            (pkg, dep) = item
+            if pkg in self.removed or \
+                   self.database.searchDependency(dep[0], dep[1], dep[2]):
+                self.worklist_set.discard(item)
+            else:
+                # Keep the worklist valid if the caller stops iterating
+                self.worklist_unresolved.append(item)
+                yield pkg, dep
+            self.__fillWorklist()
+
     def getPkgConflicts(self, pkg, deps, dest):
         """Check for conflicts to pkg's deps, add results to dest[pkg].
 
@@ -822,31 +869,32 @@ class RpmResolver:
         if self.config.nofileconflicts:
             # file conflicts turned off
             return conflicts
+        # The packages sharing a path are compared at once, see
+        # fileconflicts.addFileConflicts()
+        jobs = self.config.fileconflictjobs or numCPUs()
+        # shared: [(name, [(pkg, None),..]),..]
+        shared = [ ]
         if self.config.checkinstalled == 0:
             # no conflicts if there is no new package
+            checked = set()
             for pkg in self.installs:
                 for name in pkg.iterFilenames():
+                    if name in checked:
+                        continue
                     dups = db.searchFilenames(name)
                     if len(dups) == 1: continue
+                    checked.add(name)
                     log.debug1("Checking for file conflicts for '%s'", name)
-                    for p in dups:
-                        if p is pkg: continue
-                        if self._hasFileConflict(pkg, p, name):
-                            conflicts.setdefault(pkg, [ ]).append(
-                                (name, p))
+                    shared.append((name, [(p, None) for p in dups]))
+            addSharedFileConflicts(shared, conflicts, self.installs, jobs)
             return conflicts
 
-        # duplicates: { name: [(pkg, idx),..], .. }
+        # duplicates: { name: [pkg,..], .. }
         duplicates = self.database.getFileDuplicates()
         for name in duplicates:
-            dups = duplicates[name]
             log.debug1("Checking for file conflicts for '%s'", name)
-            for j in xrange(len(dups)):
-                for k in xrange(j+1, len(dups)):
-                    if not self._hasFileConflict(dups[j], dups[k], name):
-                        continue
-                    conflicts.setdefault(dups[j], [ ]).append((name, dups[k]))
-                    conflicts.setdefault(dups[k], [ ]).append((name, dups[j]))
+            shared.append((name, [(p, None) for p in duplicates[name]]))
+        addSharedFileConflicts(shared, conflicts, jobs=jobs)
         return conflicts
 
     # ----
@@ -375,7 +375,7 @@ class RpmYum:
                          "upgrade" in self.command or
                          "remove" in self.command)
         self.opresolver = RpmResolver(self.config, db,
-                                      nocheck=justquery)
+                                      nocheck=justquery, incremental=1)
         if not justquery:
             self.__generateObsoletesList()
         if self.config.timer:
@@ -1074,8 +1074,8 @@ class RpmYum:
         Return 1 after reaching a steady state."""
 
         log.info2("Resolving dependencies...")
-        # List of filereqs we already checked
-        self.filereqs = []
+        # Set of filereqs we already checked
+        self.filereqs = set()
         self.iteration = 1
 
         # As long as either __handleUnresolvedDeps() or __handleConflicts()
@@ -1123,31 +1123,25 @@ class RpmYum:
 
         Return 1 if some package changes have been done, 0 otherwise."""
 
-        # Otherwise get first unresolved dep and then try to solve it as long
-        # as we have unresolved deps. If we fail to resolve a dep we try the
-        # next one until only unresolvable deps remain.
+        # Try to solve each unresolved dep once. The resolver works
+        # incrementally: deps touched by the packages we add or remove while
+        # resolving show up later in the same iteration, so there is no need
+        # to restart it after each change.
         ret = 0
-        unresolved = self.opresolver.iterUnresolvedDependencies()
         # Store our unresolvable deps in here.
-        unresolvable = []
-        while True:
-            for pkg, dep in unresolved:
-                # Have we already tried to resolve this dep? If yes, skip it
-                if dep in unresolvable:
-                    continue
-                log.info3("Dependency iteration %s", str(self.iteration))
-                self.iteration += 1
-                log.info3("Resolving dependency for %s", pkg.getNEVRA())
-                # If we were able to resolve this dep in any way we reget the
-                # deps and do the next internal iteration
-                if self.__resolveDep(pkg, dep):
-                    ret = 1
-                    unresolved = self.opresolver.iterUnresolvedDependencies()
-                    break
-                # Add this dep to the ones we can't resolve at the moment
-                unresolvable.append(dep)
-            else: # exit while loop if we got through the for loop
-                break
+        unresolvable = set()
+        for pkg, dep in self.opresolver.iterUnresolvedDependencies():
+            # Have we already tried to resolve this dep? If yes, skip it
+            if dep in unresolvable:
+                continue
+            log.info3("Dependency iteration %s", str(self.iteration))
+            self.iteration += 1
+            log.info3("Resolving dependency for %s", pkg.getNEVRA())
+            if self.__resolveDep(pkg, dep):
+                ret = 1
+                continue
+            # Add this dep to the ones we can't resolve at the moment
+            unresolvable.add(dep)
         return ret
 
     def __resolveDep(self, pkg, dep):
@@ -1168,7 +1162,7 @@ class RpmYum:
         # already handled and only handle each one once.
         modified_repo = 0
         if dep[0][0] == "/" and not dep[0] in self.filereqs:
-            self.filereqs.append(dep[0])
+            self.filereqs.add(dep[0])
             for repo in self.repos.dbs:
                 if not hasattr(repo, 'isFilelistImported') or \
                        repo.isFilelistImported():
@@ -0,0 +1,165 @@
+#!/usr/bin/python
+#
+# (c) 2006 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Library General Public License as published by
+# the Free Software Foundation; version 2 only
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Library General Public License for more details.
+#
+# You should have received a copy of the GNU Library General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# Micro benchmark for functions.stringCompare() and functions.labelCompare()
+# against the former character scanning implementation, which is kept here
+# as reference for the parity tests in functionstest.
+#
+
+import sys, random
+from time import time
+
+PYRPMDIR = ".."
+if not PYRPMDIR in sys.path:
+    sys.path.append(PYRPMDIR)
+import pyrpm.functions as functions
+
+def refStringCompare(str1, str2):
+    """Reference implementation: scan str1 and str2 character by character
+    like rpm does."""
+
+    if str1 == str2:
+        return 0
+    lenstr1 = len(str1)
+    lenstr2 = len(str2)
+    i1 = 0
+    i2 = 0
+    while i1 < lenstr1 and i2 < lenstr2:
+        # remove leading separators
+        while i1 < lenstr1 and not functions._xisalnum(str1[i1]):
+            i1 += 1
+        while i2 < lenstr2 and not functions._xisalnum(str2[i2]):
+            i2 += 1
+        if i1 == lenstr1 or i2 == lenstr2: # bz 178798
+            break
+        # start of the comparison data, search digits or alpha chars
+        j1 = i1
+        j2 = i2
+        if j1 < lenstr1 and functions._xisdigit(str1[j1]):
+            while j1 < lenstr1 and functions._xisdigit(str1[j1]):
+                j1 += 1
+            while j2 < lenstr2 and functions._xisdigit(str2[j2]):
+                j2 += 1
+            isnum = 1
+        else:
+            while j1 < lenstr1 and functions._xisalpha(str1[j1]):
+                j1 += 1
+            while j2 < lenstr2 and functions._xisalpha(str2[j2]):
+                j2 += 1
+            isnum = 0
+        # check if we already hit the end
+        if j1 == i1:
+            return -1
+        if j2 == i2:
+            if isnum:
+                return 1
+            return -1
+        if isnum:
+            # ignore leading "0" for numbers (1 == 000001)
+            while i1 < j1 and str1[i1] == "0":
+                i1 += 1
+            while i2 < j2 and str2[i2] == "0":
+                i2 += 1
+            # longer size of digits wins
+            if j1 - i1 > j2 - i2:
+                return 1
+            if j2 - i2 > j1 - i1:
+                return -1
+        x = cmp(str1[i1:j1], str2[i2:j2])
+        if x:
+            return x
+        # move to next comparison start
+        i1 = j1
+        i2 = j2
+    if i1 == lenstr1:
+        if i2 == lenstr2:
+            return 0
+        return -1
+    return 1
+
+def refLabelCompare(e1, e2):
+    """Reference implementation of labelCompare() using refStringCompare()."""
+
+    r = refStringCompare(e1[0], e2[0])
+    if r == 0:
+        r = refStringCompare(e1[1], e2[1])
+        if r == 0:
+            if e1[2] == "" or e2[2] == "": # no release
+                return 0
+            r = refStringCompare(e1[2], e2[2])
+    return r
+
+# Versions and releases as found in a distribution
+VERSIONS = [ "0", "1", "1.0", "1.0.1", "1.00", "1.0a", "1.0.a", "1.0rc1",
+             "1.0-rc1", "2.6.18", "2.6.9", "2.6.18.1", "20060101",
+             "0.9.7a", "0.9.7f", "0.9.8b", "1.2.3.4.5.6", "2.0_beta3",
+             "2.0beta3", "7.0.0.0", "007", "1..0", "1.0.", "1.0..", "a",
+             "Z", "abc", "1.fc5", "1.fc6", "1.el5", "12.2.EL4", "0.5.FC5",
+             "3.1.20060413cvs", "4.3.2-7", "1~rc1", "1.0+svn20060101", "" ]
+
+def allStrings(alphabet, maxlen):
+    """Return all strings up to length maxlen using characters of alphabet."""
+
+    result = [ "" ]
+    last = [ "" ]
+    for _ in xrange(maxlen):
+        last = [ s + c for s in last for c in alphabet ]
+        result.extend(last)
+    return result
+
+def genLabels(num, seed=42):
+    """Return num random (E, V, R) tuples built from VERSIONS."""
+
+    rnd = random.Random(seed)
+    epochs = [ "0", "0", "0", "1", "2" ]
+    releases = [ v for v in VERSIONS if v ] + [ "" ]
+    return [ (rnd.choice(epochs), rnd.choice(VERSIONS), rnd.choice(releases))
+             for _ in xrange(num) ]
+
+def bench(name, func, pairs, loops):
+    t0 = time()
+    for _ in xrange(loops):
+        for (a, b) in pairs:
+            func(a, b)
+    t = time() - t0
+    print "%-24s %8.3fs  %10.0f compares/s" % (name, t, loops*len(pairs) / t)
+    return t
+
+def main():
+    loops = 5
+    if len(sys.argv) > 1:
+        loops = int(sys.argv[1])
+    labels = genLabels(2000)
+    pairs = [ (labels[i], labels[(i * 7 + 3) % len(labels)])
+              for i in xrange(len(labels)) ] * 10
+    for (a, b) in pairs:
+        if functions.labelCompare(a, b) != refLabelCompare(a, b):
+            print "MISMATCH", a, b
+            return 1
+    strpairs = [ (a[1], b[1]) for (a, b) in pairs ]
+    t1 = bench("refStringCompare", refStringCompare, strpairs, loops)
+    t2 = bench("stringCompare", functions.stringCompare, strpairs, loops)
+    print "speedup: %.1fx" % (t1 / t2)
+    t1 = bench("refLabelCompare", refLabelCompare, pairs, loops)
+    t2 = bench("labelCompare", functions.labelCompare, pairs, loops)
+    print "speedup: %.1fx" % (t1 / t2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# vim:ts=4:sw=4:showmatch:expandtab
@@ -0,0 +1,134 @@
+#!/usr/bin/python
+#
+# Benchmark for file conflict checking
+#
+# Usage: fileconflictbench.py [-j jobs] [packages ...]
+#
+# Generates a synthetic distribution with private files, directories and
+# identical files shared by many packages and a few real conflicts.  The
+# conflicts are searched with the per file lookups and pairwise comparisons
+# done before (up to 4000 packages) and with findFileConflicts(), using one
+# and jobs processes (default: one per CPU).
+#
+
+import sys
+sys.path[0:0] = ['..']
+import time, random
+from pyrpm.config import rpmconfig
+from pyrpm.package import RpmPackage
+from pyrpm.resolver import RpmResolver
+from pyrpm.database.memorydb import RpmMemoryDB
+from pyrpm.fileconflicts import findFileConflicts
+from pyrpm.functions import numCPUs
+
+LOCALES = 300
+
+def genPkg(i):
+    """Return package number i.
+
+    Every package has private files, shares a few directories and sometimes
+    an identical license file with others.  Packages 1000*n+7 and 1000*n+8
+    conflict on one file."""
+
+    rnd = random.Random(i)
+    files = [ ("/usr/share/pkg%d/" % i, "file%d" % j, 0100644, "%032x" % j)
+              for j in xrange(30) ]
+    files.append(("/usr/share/pkg%d" % i, "", 040755, ""))
+    for _ in xrange(5):
+        locale = "/usr/share/locale/l%d/LC_MESSAGES" % \
+                 rnd.randint(0, LOCALES - 1)
+        files.append((locale, "", 040755, ""))
+        files.append((locale + "/", "pkg%d.mo" % i, 0100644, "%032x" % i))
+    if i % 10 == 0:
+        files.append(("/usr/share/doc/common/", "LICENSE", 0100644, "1" * 32))
+    if i % 1000 in (7, 8):
+        files.append(("/etc/", "conflict%d" % (i / 1000), 0100644,
+                      "%032x" % i))
+    pkg = RpmPackage(rpmconfig, "dummy")
+    pkg["name"] = "pkg%d" % i
+    pkg["epoch"] = [ 0 ]
+    pkg["version"] = "1.0"
+    pkg["release"] = "1"
+    pkg["arch"] = "i386"
+    pkg["sourcerpm"] = "pkg%d-1.0-1.src.rpm" % i
+    for tag in ("provides", "requires", "obsoletes", "conflicts", "triggers"):
+        pkg[tag] = [ ]
+    dirnames = [ ]
+    dirindex = { }
+    for (dirname, basename, mode, md5sum) in files:
+        if not dirindex.has_key(dirname):
+            dirindex[dirname] = len(dirnames)
+            dirnames.append(dirname)
+    pkg["dirnames"] = dirnames
+    pkg["basenames"] = [ f[1] for f in files ]
+    pkg["dirindexes"] = [ dirindex[f[0]] for f in files ]
+    pkg["filemodes"] = [ f[2] for f in files ]
+    pkg["filemd5s"] = [ f[3] for f in files ]
+    pkg["filesizes"] = [ 100 ] * len(files)
+    pkg["fileusername"] = [ "root" ] * len(files)
+    pkg["filegroupname"] = [ "root" ] * len(files)
+    pkg["fileflags"] = [ 0 ] * len(files)
+    pkg["filelinktos"] = [ "" ] * len(files)
+    pkg["filecolors"] = [ 0 ] * len(files)
+    return pkg
+
+def pairwiseConflicts(pkgs):
+    """Return file conflicts of pkgs found with per file lookups and
+    pairwise comparisons."""
+
+    db = RpmMemoryDB(rpmconfig, None)
+    resolver = RpmResolver(rpmconfig, db, nocheck=1)
+    for pkg in pkgs:
+        db.addPkg(pkg)
+    conflicts = { }
+    for pkg in pkgs:
+        for name in pkg.iterFilenames():
+            dups = db.searchFilenames(name)
+            if len(dups) == 1: continue
+            for p in dups:
+                if p is pkg: continue
+                if resolver._hasFileConflict(pkg, p, name):
+                    conflicts.setdefault(pkg, [ ]).append((name, p))
+    return conflicts
+
+def normalize(conflicts):
+    """Return conflicts as a sorted list of (name, name, filename)."""
+
+    result = [ (pkg["name"], p["name"], name) for pkg in conflicts.keys()
+               for (name, p) in conflicts[pkg] ]
+    result.sort()
+    return result
+
+def main():
+    args = sys.argv[1:]
+    jobs = numCPUs()
+    if args[:1] == [ "-j" ]:
+        jobs = int(args[1])
+        args = args[2:]
+    sizes = [ 1000, 4000, 20000 ]
+    if args:
+        sizes = [ int(arg) for arg in args ]
+    for packages in sizes:
+        pkgs = [ genPkg(i) for i in xrange(packages) ]
+        t = time.time()
+        conflicts = normalize(findFileConflicts([pkgs]))
+        t = time.time() - t
+        msg = "%5d packages: merged %6.2fs" % (packages, t)
+        t = time.time()
+        if normalize(findFileConflicts([pkgs], jobs)) != conflicts:
+            print "Results differ!"
+            return 1
+        msg += "  %d jobs %6.2fs" % (jobs, time.time() - t)
+        if packages <= 4000:
+            t = time.time()
+            if normalize(pairwiseConflicts(pkgs)) != conflicts:
+                print "Results differ!"
+                return 1
+            msg += "  pairwise %7.2fs" % (time.time() - t)
+        print msg + "  (%d conflicts)" % (len(conflicts) / 2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# vim:ts=4:sw=4:showmatch:expandtab
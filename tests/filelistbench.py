@@ -0,0 +1,132 @@
+#!/usr/bin/python
+#
+# Memory benchmark for the filename index of RpmMemoryDB
+#
+# Usage: filelistbench.py [packages ...]
+#
+# Generates synthetic packages with file lists like a repository with
+# imported filelists.xml has them: every name is a separate string object.
+# Each package set is indexed by the dict of lists FilenamesList used before
+# and by FilenamesList in a forked process, the growth of the resident set
+# and the time are reported.
+#
+
+import sys
+sys.path[0:0] = ['..']
+import os, time, random, gc
+from pyrpm.config import rpmconfig
+from pyrpm.package import RpmPackage
+from pyrpm.database.lists import FilenamesList, genBasenames2
+
+LOCALES = [ "l%d" % i for i in xrange(80) ]
+DOCS = [ "README", "COPYING", "AUTHORS", "NEWS", "ChangeLog", "TODO" ]
+
+class ListFilenamesList:
+    """The mapping dirname => { basename => [RpmPackage] } used before."""
+
+    def __init__(self):
+        self.path = { }
+
+    def addPkg(self, pkg):
+        path = self.path
+        basenames = pkg["basenames"]
+        if basenames != None:
+            dirindexes = pkg["dirindexes"]
+            dirnames = pkg["dirnames"]
+            for dirname in dirnames:
+                path.setdefault(dirname, {})
+            dirnames = [ dirnames[di] for di in dirindexes ]
+        else:
+            (basenames, dirnames) = genBasenames2(pkg["oldfilenames"])
+            for dirname in dirnames:
+                path.setdefault(dirname, {})
+        for i in xrange(len(basenames)):
+            path[dirnames[i]].setdefault(basenames[i], []).append(pkg)
+
+def genFiles(i):
+    """Return the file names of package number i."""
+
+    rnd = random.Random(i)
+    files = [ "/usr/bin/pkg%d" % i, "/usr/lib/libpkg%d.so.1" % i ]
+    files.extend([ "/usr/share/doc/pkg%d-1.0/%s" % (i, doc)
+                   for doc in rnd.sample(DOCS, 3) ])
+    files.extend([ "/usr/share/pkg%d/data/file%d" % (i, j)
+                   for j in xrange(rnd.randint(5, 60)) ])
+    files.extend([ "/usr/include/pkg%d/%s.h" % (i, "hdr%d" % j)
+                   for j in xrange(rnd.randint(0, 10)) ])
+    if i % 3 == 0:
+        files.extend([ "/usr/share/locale/%s/LC_MESSAGES/pkg%d.mo" %
+                       (locale, i)
+                       for locale in rnd.sample(LOCALES, 40) ])
+    return files
+
+def genPkg(i):
+    """Return package number i with a file list split into new string
+    objects."""
+
+    pkg = RpmPackage(rpmconfig, "dummy")
+    pkg["name"] = "pkg%d" % i
+    (dnames, dindexes, bnames) = ([ ], [ ], [ ])
+    for f in genFiles(i):
+        idx = f.rindex("/")
+        (dname, fname) = (f[:idx+1], f[idx+1:])
+        if not dnames or dnames[-1] != dname:
+            dnames.append(dname)
+        dindexes.append(len(dnames) - 1)
+        bnames.append(fname)
+    pkg["dirnames"] = dnames
+    pkg["dirindexes"] = dindexes
+    pkg["basenames"] = bnames
+    return pkg
+
+def residentSize():
+    """Return the resident set size of this process in kB."""
+
+    fd = open("/proc/self/statm")
+    pages = int(fd.read().split()[1])
+    fd.close()
+    return pages * os.sysconf("SC_PAGE_SIZE") / 1024
+
+def measure(cls, packages):
+    """Return (kB, seconds) for generating and indexing packages packages
+    with cls, measured in a child process."""
+
+    (rfd, wfd) = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(rfd)
+            gc.collect()
+            size = residentSize()
+            pkgs = [ genPkg(i) for i in xrange(packages) ]
+            t = time.time()
+            l = cls()
+            for pkg in pkgs:
+                l.addPkg(pkg)
+            t = time.time() - t
+            gc.collect()
+            os.write(wfd, "%d %f" % (residentSize() - size, t))
+        finally:
+            os._exit(0)
+    os.close(wfd)
+    fd = os.fdopen(rfd)
+    (size, t) = fd.read().split()
+    fd.close()
+    os.waitpid(pid, 0)
+    return (int(size), float(t))
+
+def main():
+    sizes = [ 5000, 20000 ]
+    if len(sys.argv) > 1:
+        sizes = [ int(arg) for arg in sys.argv[1:] ]
+    for packages in sizes:
+        (size1, t1) = measure(ListFilenamesList, packages)
+        (size2, t2) = measure(FilenamesList, packages)
+        print "%5d packages: lists %7d kB %5.2fs  compact %7d kB %5.2fs" % \
+              (packages, size1, t1, size2, t2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# vim:ts=4:sw=4:showmatch:expandtab
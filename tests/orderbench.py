@@ -0,0 +1,134 @@
+#!/usr/bin/python
+#
+# Benchmark for ordering the packages of a transaction
+#
+# Usage: orderbench.py [packages ...]
+#
+# Generates a synthetic distribution with a core loop of %pre requirements
+# like glibc, bash and filesystem and big loops of soft requirements like the
+# perl and python stacks have, builds the relations like rpmgraph.py does and
+# orders them with the ConnectedComponent's (up to 500 packages) and with
+# genOrderSCC().  Gives the times and the numbers of hard and soft
+# requirements not met by the orders.
+#
+
+import sys
+sys.path[0:0] = ['..']
+import time, random
+from pyrpm.config import rpmconfig
+from pyrpm.base import OP_INSTALL, RPMSENSE_EQUAL, RPMSENSE_SCRIPT_PRE, \
+     RPMSENSE_SCRIPT_POST
+from pyrpm.package import RpmPackage
+from pyrpm.orderer import RpmRelations
+
+CORE = 10
+
+def genPkg(i, packages):
+    """Return package number i of a distribution with packages packages.
+
+    Packages 0 to CORE-1 form a loop of %pre requirements, the others
+    require some of them in %post.  Every tenth package of the rest belongs
+    to the perl stack, every tenth plus one to the python stack.  Their
+    interpreters require some of their modules, the modules require the
+    interpreter in %post and two other modules.  The others require up to
+    four packages with lower numbers."""
+
+    rnd = random.Random(i)
+    pkg = RpmPackage(rpmconfig, "dummy")
+    pkg["name"] = "pkg%d" % i
+    pkg["epoch"] = [ 0 ]
+    pkg["version"] = "1.0"
+    pkg["release"] = "1"
+    pkg["arch"] = "i386"
+    pkg["sourcerpm"] = "pkg%d-1.0-1.src.rpm" % i
+    pkg["provides"] = [ ("pkg%d" % i, RPMSENSE_EQUAL, "1.0-1") ]
+    requires = [ ]
+    if i < CORE:
+        requires.append(("pkg%d" % ((i + 1) % CORE), RPMSENSE_SCRIPT_PRE, ""))
+    else:
+        requires.append(("pkg%d" % rnd.randint(0, CORE - 1),
+                         RPMSENSE_SCRIPT_POST, ""))
+        if i % 10 in (0, 1) and i >= 20:
+            # perl and python modules
+            requires.append(("pkg%d" % (10 + i % 10), RPMSENSE_SCRIPT_POST,
+                             ""))
+            for _ in xrange(2):
+                j = rnd.randint(2, (packages - 1) / 10) * 10 + i % 10
+                if j < packages:
+                    requires.append(("pkg%d" % j, 0, ""))
+        elif i in (10, 11):
+            # perl and python interpreters
+            for j in xrange(20 + i % 10, packages, 30):
+                requires.append(("pkg%d" % j, 0, ""))
+        else:
+            for _ in xrange(rnd.randint(0, 4)):
+                requires.append(("pkg%d" % rnd.randint(CORE, i - 1), 0, ""))
+    pkg["requires"] = requires
+    for tag in ("obsoletes", "conflicts", "triggers"):
+        pkg[tag] = [ ]
+    return pkg
+
+def genRelations(pkgs):
+    """Return the RpmRelations for installing the RpmPackage's in list
+    pkgs."""
+
+    return RpmRelations(rpmconfig, pkgs, OP_INSTALL)
+
+def unmet(relations, order):
+    """Return (hard, soft) numbers of requirements in RpmRelations relations
+    not met by the RpmPackage list order."""
+
+    position = { }
+    for i in xrange(len(order)):
+        position[order[i]] = i
+    (hard, soft) = (0, 0)
+    for pkg in relations:
+        for (pre, flag) in relations[pkg].pre.items():
+            if position[pre] > position[pkg]:
+                if flag:
+                    hard += 1
+                else:
+                    soft += 1
+    return (hard, soft)
+
+def run(pkgs, scc):
+    """Order the RpmPackage's in list pkgs with genOrderSCC() if scc, with
+    the ConnectedComponent's otherwise.
+
+    Return (seconds, order, hard, soft) with the numbers of unmet hard and
+    soft requirements."""
+
+    relations = genRelations(pkgs)
+    RpmRelations.SCCORDER = scc
+    try:
+        t = time.time()
+        order = relations.genOrder()
+        t = time.time() - t
+    finally:
+        RpmRelations.SCCORDER = True
+    (hard, soft) = unmet(genRelations(pkgs), order)
+    return (t, order, hard, soft)
+
+def main():
+    sizes = [ 250, 500, 3000, 10000 ]
+    if len(sys.argv) > 1:
+        sizes = [ int(arg) for arg in sys.argv[1:] ]
+    for packages in sizes:
+        pkgs = [ genPkg(i, packages) for i in xrange(packages) ]
+        msg = "%5d packages:" % packages
+        for scc in (False, True):
+            if not scc and packages > 500:
+                continue
+            (t, order, hard, soft) = run(pkgs, scc)
+            if len(order) != packages:
+                print "Packages missing!"
+                return 1
+            msg += "  %s %7.2fs (%d hard, %d soft unmet)" % \
+                   (("components", "SCC")[scc], t, hard, soft)
+        print msg
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# vim:ts=4:sw=4:showmatch:expandtab
@@ -0,0 +1,144 @@
+#!/usr/bin/python
+#
+# Benchmark for reading rpm payloads
+#
+# Usage: payloadbench.py [megabytes]
+#
+# Generates a cpio archive with files of mixed sizes and compressibility and
+# compresses it with gzip and, if the lzma module is available, with xz.  The
+# files are read like installFile() does and written to /dev/null, with
+# PyGZIP or PyLZMA and the former read loop and with PayloadFile.  The
+# throughput is given in MB/s of uncompressed data.
+#
+
+import sys
+sys.path[0:0] = ['..']
+import os, time, gzip, random
+from cStringIO import StringIO
+from pyrpm.io import PyGZIP, PyLZMA, PayloadFile, CPIOFile
+
+def genCpio(files):
+    """Return a cpio archive of the (filename, data) or (filename, data,
+    mode) in list files."""
+
+    output = [ ]
+    pos = 0
+    for entry in files + [ ("TRAILER!!!", "") ]:
+        (filename, data, mode) = (entry + (0100644,))[:3]
+        name = filename + "\x00"
+        hdr = "070701" + "".join([ "%08x" % value for value in
+                                   (0, mode, 0, 0, 1, 0, len(data), 0, 0,
+                                    0, 0, len(name), 0) ])
+        for chunk in (hdr + name, data):
+            pad = "\x00" * ((4 - (pos + len(chunk)) % 4) % 4)
+            output.append(chunk + pad)
+            pos += len(chunk) + len(pad)
+    return "".join(output)
+
+def gzipData(data):
+    """Return data gzip compressed."""
+
+    output = StringIO()
+    fd = gzip.GzipFile(fileobj=output, mode="wb", compresslevel=6)
+    fd.write(data)
+    fd.close()
+    return output.getvalue()
+
+def genFiles(megabytes):
+    """Return a list of (filename, data) of about megabytes MB."""
+
+    rnd = random.Random(0)
+    words = [ "word%d" % i for i in xrange(2000) ]
+    files = [ ]
+    size = 0
+    i = 0
+    while size < megabytes * 1048576:
+        if i % 3 == 0:
+            # Compresses badly
+            data = "".join([ chr(rnd.randint(0, 255)) for _ in xrange(4096) ])
+            data *= rnd.randint(1, 64)
+        else:
+            data = " ".join([ rnd.choice(words) for _ in
+                              xrange(rnd.randint(10, 20000)) ])
+        files.append(("./usr/share/bench/file%d" % i, data))
+        size += len(data)
+        i += 1
+    return files
+
+def extractOld(cpio, output):
+    """Read all files from CPIOFile cpio with the former installFile() loop
+    and write them to file descriptor output.  Return the number of bytes
+    read."""
+
+    total = 0
+    while 1:
+        cpio.skipToNextFile()
+        (filename, size) = cpio.getNextEntry()
+        if filename is None:
+            break
+        total += size
+        data = "1"
+        while size > 0 and data:
+            data = cpio.read(65536)
+            size -= len(data)
+            os.write(output, data)
+    return total
+
+def extract(cpio, output):
+    """Read all files from CPIOFile cpio like installFile() and write them to
+    file descriptor output.  Return the number of bytes read."""
+
+    total = 0
+    while 1:
+        cpio.skipToNextFile()
+        (filename, size) = cpio.getNextEntry()
+        if filename is None:
+            break
+        total += size
+        data = "1"
+        while size > 0 and data:
+            data = cpio.readBuffer(min(size, 1048576))
+            size -= len(data)
+            os.write(output, data)
+    return total
+
+def bench(func, fd):
+    """Return (MB/s, bytes) of func(CPIOFile(fd), output)."""
+
+    output = os.open("/dev/null", os.O_WRONLY)
+    try:
+        t = time.time()
+        total = func(CPIOFile(fd), output)
+        t = time.time() - t
+    finally:
+        os.close(output)
+    return (total / t / 1048576, total)
+
+def main():
+    megabytes = 64
+    if len(sys.argv) > 1:
+        megabytes = int(sys.argv[1])
+    archive = genCpio(genFiles(megabytes))
+    payloads = [ ("gzip", gzipData(archive), PyGZIP) ]
+    try:
+        import lzma
+    except ImportError:
+        print "xz:   lzma module not available"
+    else:
+        payloads.append(("xz", lzma.compress(archive), PyLZMA))
+    for (compressor, payload, cls) in payloads:
+        (old, total1) = bench(extractOld, cls(fileobj=StringIO(payload)))
+        (new, total2) = bench(extract, PayloadFile(StringIO(payload),
+                                                    compressor))
+        if total1 != total2:
+            print "Results differ!"
+            return 1
+        print "%-5s %d MB: %s %7.1f MB/s  PayloadFile %7.1f MB/s  " \
+              "(%.2fx)" % (compressor + ":", total1 / 1048576, cls.__name__,
+                           old, new, new / old)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# vim:ts=4:sw=4:showmatch:expandtab
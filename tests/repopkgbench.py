@@ -0,0 +1,74 @@
+#!/usr/bin/python
+#
+# Memory benchmark for packages read from primary.xml
+#
+# Usage: repopkgbench.py [packages ...]
+#
+# Generates a synthetic primary.xml.gz like sqlitebench.py and parses it with
+# RpmRepoDB into RpmPackage and into RpmRepoPackage objects, each in a forked
+# process.  The growth of the resident set and the time are reported.
+#
+
+import sys
+sys.path[0:0] = ['..']
+import os, time, tempfile, shutil, gc
+from pyrpm.config import rpmconfig
+from pyrpm.database.repodb import RpmRepoDB, iterparse
+from pyrpm.io import PyGZIP
+from sqlitebench import genPrimary
+from filelistbench import residentSize
+
+def measure(filename, compact):
+    """Return (kB, seconds, packages) for parsing primary.xml.gz filename
+    in a child process."""
+
+    (rfd, wfd) = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(rfd)
+            repo = RpmRepoDB(rpmconfig, [], reponame="bench")
+            repo.COMPACT = compact
+            gc.collect()
+            size = residentSize()
+            t = time.time()
+            repo._parse(iter(iterparse(PyGZIP(filename),
+                                       events=("start", "end"))))
+            t = time.time() - t
+            gc.collect()
+            os.write(wfd, "%d %f %d" % (residentSize() - size, t,
+                                        len(repo.getPkgs())))
+        finally:
+            os._exit(0)
+    os.close(wfd)
+    fd = os.fdopen(rfd)
+    (size, t, packages) = fd.read().split()
+    fd.close()
+    os.waitpid(pid, 0)
+    return (int(size), float(t), int(packages))
+
+def main():
+    sizes = [ 5000, 20000 ]
+    if len(sys.argv) > 1:
+        sizes = [ int(arg) for arg in sys.argv[1:] ]
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for packages in sizes:
+            filename = os.path.join(tmpdir, "primary.xml.gz")
+            genPrimary(filename, range(packages))
+            (size1, t1, n1) = measure(filename, False)
+            (size2, t2, n2) = measure(filename, True)
+            if n1 != packages or n2 != packages:
+                print "Packages missing!"
+                return 1
+            print "%5d packages: RpmPackage %7d kB %5.2fs  " \
+                  "RpmRepoPackage %7d kB %5.2fs" % \
+                  (packages, size1, t1, size2, t2)
+    finally:
+        shutil.rmtree(tmpdir)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# vim:ts=4:sw=4:showmatch:expandtab
@@ -0,0 +1,171 @@
+#!/usr/bin/python
+#
+# Benchmark for the dependency resolution loop of pyrpmyum
+#
+# Usage: resolvebench.py [packages ...]
+#
+# Generates a synthetic installed distribution and a repository with the
+# next release, in which every package moves to new library sonames and some
+# packages require new packages or libraries nobody provides.  Like the
+# resolve*.sh scenarios do with real packages, the distribution is upgraded
+# and the dependencies get resolved, with the old restarting loop and with
+# the incremental resolver.
+#
+
+import sys
+sys.path[0:0] = ['..']
+import time, random
+from pyrpm.config import rpmconfig
+from pyrpm.base import RPMSENSE_EQUAL
+from pyrpm.package import RpmPackage
+from pyrpm.resolver import RpmResolver
+from pyrpm.database.memorydb import RpmMemoryDB
+
+def genPkg(i, release, missing=False, new=False):
+    """Return package number i of distribution release.
+
+    Package i requires the libraries and some files of up to three packages
+    with lower numbers, all packages depend on package 0 indirectly.  If
+    missing, the package also requires a library nobody provides, if new the
+    library of package new<i>."""
+
+    rnd = random.Random(i)
+    pkg = RpmPackage(rpmconfig, "dummy")
+    pkg["name"] = "pkg%d" % i
+    pkg["epoch"] = [ 0 ]
+    pkg["version"] = "%d.0" % release
+    pkg["release"] = "1"
+    pkg["arch"] = "i386"
+    pkg["sourcerpm"] = "pkg%d-%d.0-1.src.rpm" % (i, release)
+    pkg["provides"] = [ ("pkg%d" % i, RPMSENSE_EQUAL, "%d.0-1" % release),
+                        ("libpkg%d.so.%d" % (i, release), 0, "") ]
+    requires = [ ]
+    if i > 0:
+        deps = [ i - 1 ] + [ rnd.randint(max(0, i - 50), i - 1)
+                             for _ in xrange(2) ]
+        for j in deps:
+            requires.append(("libpkg%d.so.%d" % (j, release), 0, ""))
+        requires.append(("/usr/bin/pkg%d" % deps[-1], 0, ""))
+    if missing:
+        requires.append(("libmissing%d.so" % i, 0, ""))
+    if new:
+        requires.append(("libnew%d.so" % i, 0, ""))
+    pkg["requires"] = requires
+    pkg["obsoletes"] = [ ]
+    pkg["conflicts"] = [ ]
+    pkg["triggers"] = [ ]
+    pkg["basenames"] = [ "pkg%d" % i, "README" ]
+    pkg["dirnames"] = [ "/usr/bin/", "/usr/share/doc/pkg%d/" % i ]
+    pkg["dirindexes"] = [ 0, 1 ]
+    return pkg
+
+def genNewPkg(i):
+    """Return the new package providing the library required by package
+    i."""
+
+    pkg = RpmPackage(rpmconfig, "dummy")
+    pkg["name"] = "new%d" % i
+    pkg["epoch"] = [ 0 ]
+    pkg["version"] = "1.0"
+    pkg["release"] = "1"
+    pkg["arch"] = "i386"
+    pkg["sourcerpm"] = "new%d-1.0-1.src.rpm" % i
+    pkg["provides"] = [ ("new%d" % i, RPMSENSE_EQUAL, "1.0-1"),
+                        ("libnew%d.so" % i, 0, "") ]
+    pkg["requires"] = [ ("libpkg%d.so.2" % i, 0, "") ]
+    for tag in ("obsoletes", "conflicts", "triggers"):
+        pkg[tag] = [ ]
+    return pkg
+
+def genDistribution(packages):
+    """Return (installed db, repository db) with packages packages."""
+
+    installed = RpmMemoryDB(rpmconfig, None)
+    repo = RpmMemoryDB(rpmconfig, None)
+    for i in xrange(packages):
+        installed.addPkg(genPkg(i, 1))
+        repo.addPkg(genPkg(i, 2, i % 50 == 49, i % 10 == 5))
+        if i % 10 == 5:
+            repo.addPkg(genNewPkg(i))
+    return (installed, repo)
+
+def resolveDep(resolver, repo, pkg, dep):
+    """Try to resolve dep of pkg by updating to packages from repo, like
+    RpmYum.__resolveDep.  Return 1 if something changed, 0 otherwise."""
+
+    for upkg in repo.searchDependency(dep[0], dep[1], dep[2]):
+        if resolver.update(upkg) == resolver.OK:
+            return 1
+    for upkg in repo.getPkgsByName(pkg["name"]):
+        if resolver.update(upkg) == resolver.OK:
+            return 1
+    return 0
+
+def resolveRestart(resolver, repo):
+    """The dependency loop restarting after every change."""
+
+    unresolved = resolver.iterUnresolvedDependencies()
+    unresolvable = [ ]
+    while True:
+        for pkg, dep in unresolved:
+            if dep in unresolvable:
+                continue
+            if resolveDep(resolver, repo, pkg, dep):
+                unresolved = resolver.iterUnresolvedDependencies()
+                break
+            unresolvable.append(dep)
+        else:
+            break
+
+def resolveIncremental(resolver, repo):
+    """The dependency loop of RpmYum.__handleUnresolvedDeps."""
+
+    unresolvable = set()
+    for pkg, dep in resolver.iterUnresolvedDependencies():
+        if dep in unresolvable:
+            continue
+        if resolveDep(resolver, repo, pkg, dep):
+            continue
+        unresolvable.add(dep)
+
+def run(packages, incremental):
+    """Upgrade a distribution with packages packages and resolve all
+    dependencies.
+
+    Return (seconds, sorted installed NEVRAs, sorted unresolved deps)."""
+
+    (installed, repo) = genDistribution(packages)
+    resolver = RpmResolver(rpmconfig, installed, incremental=incremental)
+    for i in xrange(packages):
+        resolver.update(repo.getPkgsByName("pkg%d" % i)[0])
+    t = time.time()
+    if incremental:
+        resolveIncremental(resolver, repo)
+    else:
+        resolveRestart(resolver, repo)
+    t = time.time() - t
+    nevras = [ pkg.getNEVRA() for pkg in installed.getPkgs() ]
+    nevras.sort()
+    unresolved = [ (pkg.getNEVRA(), dep) for (pkg, dep)
+                   in resolver.iterUnresolvedDependencies() ]
+    unresolved.sort()
+    return (t, nevras, unresolved)
+
+def main():
+    sizes = [ 250, 500, 1000, 2000 ]
+    if len(sys.argv) > 1:
+        sizes = [ int(arg) for arg in sys.argv[1:] ]
+    for packages in sizes:
+        (t1, nevras1, unresolved1) = run(packages, 0)
+        (t2, nevras2, unresolved2) = run(packages, 1)
+        if nevras1 != nevras2 or unresolved1 != unresolved2:
+            print "Results differ!"
+            return 1
+        print "%5d packages: restarting %7.2fs  incremental %6.2fs" % \
+              (packages, t1, t2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# vim:ts=4:sw=4:showmatch:expandtab
@@ -0,0 +1,159 @@
+#!/usr/bin/python
+#
+# Benchmark for importing repository metadata into the sqlite cache
+#
+# Usage: sqlitebench.py [packages]
+#
+# Generates a synthetic primary.xml.gz and filelists.xml.gz and imports them
+# with SqliteRepoDB with and without the bulk load.
+#
+
+import sys
+sys.path[0:0] = ['..']
+import os, time, gzip, tempfile, shutil, random
+from pyrpm.config import rpmconfig
+from pyrpm.database.sqliterepodb import SqliteRepoDB
+
+HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+FLAGS = [ "EQ", "LT", "GT", "LE", "GE" ]
+
+def genEntries(rnd, tag, count, pre=False):
+    lines = [ '    <rpm:%s>' % tag ]
+    for _ in xrange(count):
+        attrs = 'name="lib%d.so"' % rnd.randint(0, 5000)
+        if rnd.random() < 0.5:
+            attrs += ' flags="%s" epoch="0" ver="%d.%d" rel="%d"' % \
+                     (rnd.choice(FLAGS), rnd.randint(0, 9),
+                      rnd.randint(0, 9), rnd.randint(1, 5))
+        if pre and rnd.random() < 0.1:
+            attrs += ' pre="1"'
+        lines.append('      <rpm:entry %s/>' % attrs)
+    lines.append('    </rpm:%s>' % tag)
+    return lines
+
+def genFiles(i, count):
+    return [ "/usr/share/pkg%d/dir%d/file%d" % (i, j % 5, j)
+             for j in xrange(count) ]
+
+def genPrimary(filename, packages):
+    """Write a primary.xml.gz with the synthetic packages numbered in list
+    packages to filename."""
+    fd = gzip.open(filename, "w")
+    fd.write(HEADER)
+    fd.write('<metadata xmlns="http://linux.duke.edu/metadata/common" '
+             'xmlns:rpm="http://linux.duke.edu/metadata/rpm" '
+             'packages="%d">\n' % len(packages))
+    for i in packages:
+        rnd = random.Random(i)
+        lines = [
+            '<package type="rpm">',
+            '  <name>pkg%d</name>' % i,
+            '  <arch>i386</arch>',
+            '  <version epoch="0" ver="1.%d" rel="1"/>' % (i % 7),
+            '  <checksum type="sha" pkgid="YES">%040x</checksum>' % i,
+            '  <summary>Package %d</summary>' % i,
+            '  <description>Synthetic package %d.</description>' % i,
+            '  <packager>Nobody</packager>',
+            '  <url>http://example.com/</url>',
+            '  <time file="1000" build="1000"/>',
+            '  <size package="%d" installed="%d" archive="%d"/>' % (i, i, i),
+            '  <location href="pkg%d-1.%d-1.i386.rpm"/>' % (i, i % 7),
+            '  <format>',
+            '    <rpm:license>GPL</rpm:license>',
+            '    <rpm:vendor>Example</rpm:vendor>',
+            '    <rpm:group>System</rpm:group>',
+            '    <rpm:buildhost>localhost</rpm:buildhost>',
+            '    <rpm:sourcerpm>pkg%d-1.%d-1.src.rpm</rpm:sourcerpm>' %
+            (i, i % 7),
+            '    <rpm:header-range start="440" end="%d"/>' % (5000 + i),
+            ]
+        lines.extend(genEntries(rnd, "provides", rnd.randint(1, 6)))
+        lines.extend(genEntries(rnd, "requires", rnd.randint(2, 20), True))
+        if rnd.random() < 0.05:
+            lines.extend(genEntries(rnd, "conflicts", 1))
+        if rnd.random() < 0.05:
+            lines.extend(genEntries(rnd, "obsoletes", 1))
+        lines.append('    <file>/usr/bin/pkg%d</file>' % i)
+        lines.extend([ '  </format>', '</package>', '' ])
+        fd.write("\n".join(lines))
+    fd.write('</metadata>\n')
+    fd.close()
+
+def genFilelists(filename, packages):
+    """Write a filelists.xml.gz matching genPrimary() to filename."""
+    fd = gzip.open(filename, "w")
+    fd.write(HEADER)
+    fd.write('<filelists xmlns="http://linux.duke.edu/metadata/filelists" '
+             'packages="%d">\n' % len(packages))
+    for i in packages:
+        lines = [ '<package pkgid="%040x" name="pkg%d" arch="i386">' % (i, i),
+                  '  <version epoch="0" ver="1.%d" rel="1"/>' % (i % 7),
+                  '  <file>/usr/bin/pkg%d</file>' % i ]
+        lines.extend([ '  <file>%s</file>' % f for f in genFiles(i, 30) ])
+        lines.extend([ '</package>', '' ])
+        fd.write("\n".join(lines))
+    fd.write('</filelists>\n')
+    fd.close()
+
+def dumpDb(db, tables):
+    """Return the content of tables in sqlite database db."""
+    cur = db.cursor()
+    result = [ ]
+    for table in tables:
+        cur.execute("SELECT * FROM %s" % table)
+        rows = [ tuple(row) for row in cur.fetchall() ]
+        rows.sort()
+        result.append(rows)
+    return result
+
+def importRepo(tmpdir, bulk):
+    """Import the metadata in tmpdir, return (seconds primary, seconds
+    filelists, repo)."""
+    repo = SqliteRepoDB(rpmconfig, [], reponame="bench")
+    repo.BULKLOAD = bulk
+    repo.repomd = { "primary" : { "checksum" : "0" },
+                    "filelists" : { "checksum" : "0" } }
+    times = [ ]
+    for dbtype in ("primary", "filelists"):
+        t = time.time()
+        repo.importDbFile(dbtype, os.path.join(tmpdir, "%s.xml.gz" % dbtype),
+                          os.path.join(tmpdir, "%s-%d.sqlite" %
+                                       (dbtype, bulk)))
+        times.append(time.time() - t)
+    return (times[0], times[1], repo)
+
+def main():
+    packages = 30000
+    if len(sys.argv) > 1:
+        packages = int(sys.argv[1])
+    tmpdir = tempfile.mkdtemp()
+    try:
+        genPrimary(os.path.join(tmpdir, "primary.xml.gz"), range(packages))
+        genFilelists(os.path.join(tmpdir, "filelists.xml.gz"),
+                     range(packages))
+        (p1, f1, plainrepo) = importRepo(tmpdir, False)
+        (p2, f2, bulkrepo) = importRepo(tmpdir, True)
+        primary = ("packages", "requires", "provides", "conflicts",
+                   "obsoletes", "files")
+        filelists = ("packages", "filelist")
+        if dumpDb(plainrepo._primarydb, primary) != \
+               dumpDb(bulkrepo._primarydb, primary) or \
+               dumpDb(plainrepo._filelistsdb, filelists) != \
+               dumpDb(bulkrepo._filelistsdb, filelists):
+            print "Databases differ!"
+            return 1
+        print "%d packages" % packages
+        print "primary:   plain %6.2fs  bulk %6.2fs  (%.2fx)" % \
+              (p1, p2, p1 / p2)
+        print "filelists: plain %6.2fs  bulk %6.2fs  (%.2fx)" % \
+              (f1, f2, f1 / f2)
+        plainrepo.close()
+        bulkrepo.close()
+    finally:
+        shutil.rmtree(tmpdir)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# vim:ts=4:sw=4:showmatch:expandtab